@@ -2,7 +2,7 @@
 {
     "name": "Cotizador Especial CCN",
     "summary": "Wizard para cotizar servicios CCN",
-    "version": "18.0.9.11.10",
+    "version": "18.0.9.11.12",
     "author": "Witann Technologies",
     "license": "LGPL-3",
     "category": "Sales/Sales",
@@ -26,6 +26,7 @@
         "views/quote_actions.xml",
         "views/ccn_menus.xml",
         "views/sale_order_button.xml",
+        "views/sale_order_material_job.xml",
         "views/product_template_ccn.xml",
         # "data/ccn_rubros.xml",  # Comentado temporalmente - los rubros ya existen en BD
         "views/quote_tabs_status.xml",
@@ -33,6 +34,7 @@
         "views/cleanup_disable_legacy_views.xml",
         "views/res_partner_views.xml",
         "data/migrate_fix_general.xml",
+        "data/material_order_cron.xml",
     ],
     "assets": {
         "web.assets_backend": [
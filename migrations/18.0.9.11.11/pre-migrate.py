@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Migración: importes de línea almacenados (total_price, mo_prestaciones,
+price_subtotal, amount_tax)
+
+Estos campos pasan de store=False a store=True. Si se deja que el ORM cree las
+columnas, recalcula todas las líneas registro por registro durante el upgrade.
+Aquí se crean las columnas antes de cargar el módulo y se llenan con
+sentencias UPDATE set-based que replican las fórmulas de los computes
+(incluido el redondeo por moneda), de modo que el ORM ya no tenga nada que
+recalcular.
+"""
+import logging
+
+from odoo.tools.sql import column_exists, create_column
+
+_logger = logging.getLogger(__name__)
+
+TABLE = 'ccn_service_quote_line'
+NEW_COLUMNS = ('mo_prestaciones', 'total_price', 'price_subtotal', 'amount_tax')
+
+
+def _round_sql(expr):
+    """Expresión SQL equivalente a currency.round(expr) (sin moneda, sin redondeo)."""
+    return (
+        "CASE WHEN c.rounding > 0 "
+        "THEN ROUND(({expr})::numeric / c.rounding) * c.rounding "
+        "ELSE ({expr}) END"
+    ).format(expr=expr)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+
+    missing = [col for col in NEW_COLUMNS if not column_exists(cr, TABLE, col)]
+    if not missing:
+        return
+    for col in missing:
+        create_column(cr, TABLE, col, 'numeric')
+
+    if 'mo_prestaciones' in missing or 'total_price' in missing:
+        # Prestaciones: solo Mano de Obra, sobre el subtotal mensual ya almacenado
+        cr.execute(f"""
+            UPDATE {TABLE} AS l
+               SET mo_prestaciones = CASE
+                       WHEN l.rubro_code = 'mano_obra'
+                       THEN {_round_sql("COALESCE(l.monthly_subtotal, 0) * COALESCE(q.prestaciones_percent, 0) / 100.0")}
+                       ELSE 0 END
+              FROM ccn_service_quote AS q
+              LEFT JOIN res_currency AS c ON c.id = q.currency_id
+             WHERE q.id = l.quote_id
+        """)
+        _logger.info("mo_prestaciones inicializado en %s líneas", cr.rowcount)
+
+        cr.execute(f"""
+            UPDATE {TABLE} AS l
+               SET total_price = {_round_sql(
+                       "(COALESCE(l.monthly_subtotal, 0) + COALESCE(l.mo_prestaciones, 0)) "
+                       "* COALESCE(l.quantity, 0)")}
+              FROM ccn_service_quote AS q
+              LEFT JOIN res_currency AS c ON c.id = q.currency_id
+             WHERE q.id = l.quote_id
+        """)
+        _logger.info("total_price inicializado en %s líneas", cr.rowcount)
+
+    if 'price_subtotal' in missing or 'amount_tax' in missing:
+        # Subtotal base = cantidad x precio de lista x (1 + tabulador);
+        # impuestos = subtotal x suma de impuestos porcentuales de la línea
+        cr.execute(f"""
+            UPDATE {TABLE} AS l
+               SET price_subtotal = s.subtotal,
+                   amount_tax = s.subtotal * s.pct / 100.0
+              FROM (
+                    SELECT l2.id,
+                           COALESCE(l2.quantity, 0) * COALESCE(pt.list_price, 0)
+                               * (1 + COALESCE(NULLIF(l2.tabulator_percent, ''), '0')::numeric / 100.0) AS subtotal,
+                           COALESCE(tx.pct, 0) AS pct
+                      FROM {TABLE} AS l2
+                      LEFT JOIN product_product AS pp ON pp.id = l2.product_id
+                      LEFT JOIN product_template AS pt ON pt.id = pp.product_tmpl_id
+                      LEFT JOIN (
+                            SELECT rel.line_id, SUM(t.amount) AS pct
+                              FROM ccn_quote_line_tax_rel AS rel
+                              JOIN account_tax AS t ON t.id = rel.tax_id
+                             WHERE t.amount_type = 'percent'
+                             GROUP BY rel.line_id
+                      ) AS tx ON tx.line_id = l2.id
+                   ) AS s
+             WHERE s.id = l.id
+        """)
+        _logger.info("price_subtotal/amount_tax inicializados en %s líneas", cr.rowcount)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Migración: totales almacenados del sitio con la fórmula del Resumen del Sitio.
+
+CCNServiceQuoteSite._compute_indicators ahora usa el motor compartido
+(quote_cost_breakdown) en lugar de su fórmula propia sobre list_price; se
+recalculan los valores ya guardados.
+"""
+import logging
+
+from odoo import SUPERUSER_ID, api
+
+_logger = logging.getLogger(__name__)
+
+SITE_FIELDS = (
+    'headcount', 'subtotal1', 'admin_amt', 'util_amt', 'subtotal2',
+    'transporte_amt', 'bienestar_amt', 'financial_amt', 'total_monthly',
+)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    Site = env['ccn.service.quote.site'].with_context(active_test=False)
+    sites = Site.search([])
+    for fname in SITE_FIELDS:
+        env.add_to_compute(Site._fields[fname], sites)
+    sites.flush_recordset(list(SITE_FIELDS))
+    _logger.info("Totales de %s sitios recalculados con la fórmula unificada", len(sites))
@@ -6,7 +6,16 @@ Problema: Algunas líneas tienen service_type incorrecto basado en su rubro_code
 Por ejemplo, líneas de 'maquinaria_jardineria' con service_type='limpieza'.
 
 Esta migración corrige automáticamente el service_type basándose en el rubro_code.
+Se ejecuta por lotes de id con tools.migration.batched_update.
 """
+import logging
+
+from odoo import SUPERUSER_ID, api
+from odoo.tools.sql import table_exists
+from odoo.addons.ccn_service_quote.tools.migration import batched_update
+
+_logger = logging.getLogger(__name__)
+
 
 def migrate(cr, version):
     """
@@ -39,52 +48,36 @@ def migrate(cr, version):
         'maquinaria_limpieza': 'limpieza',
         'equipo_especial_limpieza': 'limpieza',
     }
-
-    print("\n=== Iniciando corrección de service_type en líneas de cotización ===")
-
-    for rubro_code, correct_service in rubro_to_service.items():
-        # Buscar líneas con rubro_code correcto pero service_type incorrecto
-        cr.execute("""
-            UPDATE ccn_service_quote_line
-            SET service_type = %s
-            WHERE rubro_code = %s
-              AND (service_type IS NULL OR service_type != %s)
-            RETURNING id
-        """, (correct_service, rubro_code, correct_service))
-
-        updated_ids = [row[0] for row in cr.fetchall()]
-
-        if updated_ids:
-            print(f"  ✓ Corregidas {len(updated_ids)} líneas de '{rubro_code}' -> service_type='{correct_service}'")
-
-    # También corregir líneas basándose en el code del rubro_id (por si rubro_code está vacío)
-    cr.execute("""
-        UPDATE ccn_service_quote_line AS l
-        SET service_type = 'jardineria'
-        FROM ccn_service_rubro AS r
-        WHERE l.rubro_id = r.id
-          AND r.code IN ('herramienta_menor_jardineria', 'maquinaria_jardineria',
-                         'fertilizantes_tierra_lama', 'consumibles_jardineria', 'epp_alturas')
-          AND (l.service_type IS NULL OR l.service_type != 'jardineria')
-        RETURNING l.id
-    """)
-
-    jard_ids = [row[0] for row in cr.fetchall()]
-    if jard_ids:
-        print(f"  ✓ Corregidas {len(jard_ids)} líneas adicionales (por rubro_id) -> jardineria")
-
-    cr.execute("""
-        UPDATE ccn_service_quote_line AS l
-        SET service_type = 'limpieza'
-        FROM ccn_service_rubro AS r
-        WHERE l.rubro_id = r.id
-          AND r.code IN ('material_limpieza', 'maquinaria_limpieza', 'equipo_especial_limpieza')
-          AND (l.service_type IS NULL OR l.service_type != 'limpieza')
-        RETURNING l.id
-    """)
-
-    limp_ids = [row[0] for row in cr.fetchall()]
-    if limp_ids:
-        print(f"  ✓ Corregidas {len(limp_ids)} líneas adicionales (por rubro_id) -> limpieza")
-
-    print("=== Corrección completada ===\n")
+    codes_by_service = {}
+    for rubro_code, service in rubro_to_service.items():
+        codes_by_service.setdefault(service, []).append(rubro_code)
+
+    _logger.info("Iniciando corrección de service_type en líneas de cotización")
+
+    # Sin commit entre lotes: forma parte de la transacción de la actualización
+    total = 0
+    for service, codes in codes_by_service.items():
+        # Por rubro_code
+        total += batched_update(
+            cr, 'ccn_service_quote_line',
+            set_sql="service_type = %(service)s",
+            where_sql="t.rubro_code IN %(codes)s AND t.service_type IS DISTINCT FROM %(service)s",
+            params={'service': service, 'codes': tuple(codes)},
+            label="service_type %s (por rubro_code)" % service,
+        )
+        # También por el code del rubro_id (por si rubro_code está vacío)
+        total += batched_update(
+            cr, 'ccn_service_quote_line',
+            set_sql="service_type = %(service)s",
+            from_sql="ccn_service_rubro r",
+            where_sql="t.rubro_id = r.id AND r.code IN %(codes)s AND t.service_type IS DISTINCT FROM %(service)s",
+            params={'service': service, 'codes': tuple(codes)},
+            label="service_type %s (por rubro_id)" % service,
+        )
+
+    _logger.info("Corrección de service_type completada: %s líneas", total)
+
+    # Los estados de rubro se agrupan por service_type: reconstruirlos si hubo cambios
+    if total and table_exists(cr, 'ccn_service_quote_rubro_state'):
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        env['ccn.service.quote.rubro.state']._ccn_rebuild()
@@ -3,8 +3,11 @@
 from . import (
     service_quote,
     quote_tab_trigger,
+    quote_cost_breakdown,
+    quote_indicator_snapshot,
     site,
     ack,
+    quote_rubro_state,
     add_package_wizard,
     patch_rubro_code,
     quote_rubro_counts,
@@ -16,11 +19,13 @@ from . import (
     quote_line_tax,
     quote_line_service_type_auto,
     quote_fix_service_type,
+    quote_general_fix,
     quote_partner_user_fields,
     res_partner,
     rubro,
     rubro_flag,
     sale_order,
+    material_order_job,
     service_package,
     pick_quote_wizard
 )
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from odoo import api, fields, models
+from odoo import api, fields, models, _
+from odoo.exceptions import ValidationError
 
 
 RUBRO_SELECTION = [
@@ -55,3 +56,53 @@ class ServiceQuoteAck(models.Model):
         for rec in self:
             if rec.site_id and rec.quote_id and rec.site_id.quote_id != rec.quote_id:
                 raise models.ValidationError("El sitio del ACK pertenece a otra cotización.")
+
+    @api.model
+    def _ccn_upsert(self, entries):
+        """Crea o actualiza ACKs en una sola sentencia.
+
+        ``entries``: iterable de ``(quote_id, site_id, service_type, rubro_code, is_empty)``.
+        Usa la restricción única (quote_id, site_id, service_type, rubro_code)
+        con ``ON CONFLICT`` y actualiza la tabla de estados de rubro. Devuelve
+        el número de ACKs escritos.
+        """
+        rows = {}
+        for quote_id, site_id, service_type, rubro_code, is_empty in entries:
+            rows[(quote_id, site_id, service_type, rubro_code)] = bool(is_empty)
+        if not rows:
+            return 0
+
+        valid_services = {code for code, _label in SERVICE_TYPE_SELECTION}
+        valid_rubros = {code for code, _label in RUBRO_SELECTION}
+        site_quote = {
+            site['id']: site['quote_id'] and site['quote_id'][0]
+            for site in self.env['ccn.service.quote.site'].with_context(active_test=False).search_read(
+                [('id', 'in', list({key[1] for key in rows}))], ['quote_id'])
+        }
+        for quote_id, site_id, service_type, rubro_code in rows:
+            if service_type not in valid_services or rubro_code not in valid_rubros:
+                raise ValidationError(_("Tipo de servicio o rubro inválido: %s / %s") % (service_type, rubro_code))
+            if site_quote.get(site_id) != quote_id:
+                raise ValidationError(_("El sitio del ACK pertenece a otra cotización."))
+
+        self.flush_model()
+        uid = self.env.uid
+        self.env.cr.execute(
+            """
+            INSERT INTO ccn_service_quote_ack
+                   (quote_id, site_id, service_type, rubro_code, is_empty,
+                    create_uid, create_date, write_uid, write_date)
+            VALUES {}
+            ON CONFLICT (quote_id, site_id, service_type, rubro_code)
+            DO UPDATE SET is_empty = EXCLUDED.is_empty,
+                          write_uid = EXCLUDED.write_uid,
+                          write_date = EXCLUDED.write_date
+            """.format(', '.join(
+                ["(%s, %s, %s, %s, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')"] * len(rows))),
+            [value for key, flag in rows.items() for value in key + (flag, uid, uid)],
+        )
+        self.invalidate_model()
+        self.env['ccn.service.quote'].invalidate_model(['ack_ids'])
+        self.env['ccn.service.quote.rubro.state']._ccn_apply_ack_flags(rows)
+        return len(rows)
+
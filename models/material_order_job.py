@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Cola de generación de proyecto y órdenes de materiales al confirmar una SO CCN.
+
+action_confirm solo encola un trabajo por orden; el cron ``ccn_material_order_job_cron``
+lo procesa en segundo plano por bloques de sitios:
+
+1. Cuenta analítica + proyecto, y una sola escritura de analytic_distribution
+   sobre todas las líneas de la SO.
+2. Por cada bloque de sitios: un create() de las SO de materiales con sus
+   líneas como comandos one2many y una sola confirmación del bloque.
+
+Cada bloque se confirma (commit) por separado y el avance queda en el trabajo,
+así un reintento continúa donde se quedó. Los errores se guardan en el trabajo
+y se muestran en la orden.
+"""
+import logging
+import threading
+import time
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+# Sitios por bloque (una transacción por bloque)
+SITE_CHUNK_SIZE = 20
+# Trabajos tomados por corrida del cron
+JOBS_PER_RUN = 10
+
+
+class CCNMaterialOrderJob(models.Model):
+    _name = 'ccn.material.order.job'
+    _description = 'Trabajo de órdenes de materiales CCN'
+    _order = 'id desc'
+
+    order_id = fields.Many2one('sale.order', string='Orden de venta', required=True, ondelete='cascade', index=True)
+    quote_id = fields.Many2one('ccn.service.quote', string='Cotización CCN', related='order_id.ccn_quote_id')
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('running', 'En proceso'),
+        ('done', 'Terminado'),
+        ('failed', 'Fallido'),
+    ], string='Estado', default='pending', required=True, index=True)
+    analytic_account_id = fields.Many2one('account.analytic.account', string='Cuenta analítica', readonly=True)
+    project_id = fields.Many2one('project.project', string='Proyecto', readonly=True)
+    material_order_ids = fields.Many2many('sale.order', 'ccn_material_order_job_sale_order_rel',
+                                          'job_id', 'order_id', string='Órdenes de materiales', readonly=True)
+    site_count = fields.Integer(string='Sitios', readonly=True)
+    done_site_keys = fields.Json(string='Sitios procesados', readonly=True)
+    progress = fields.Float(string='Avance (%)', compute='_compute_progress')
+    attempts = fields.Integer(string='Intentos', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+    date_done = fields.Datetime(string='Terminado el', readonly=True)
+
+    @api.depends('state', 'site_count', 'done_site_keys')
+    def _compute_progress(self):
+        for job in self:
+            if job.state == 'done':
+                job.progress = 100.0
+            elif job.site_count:
+                job.progress = 100.0 * len(job.done_site_keys or []) / job.site_count
+            else:
+                job.progress = 0.0
+
+    # ----------------- Cola -----------------
+
+    @api.model
+    def _ccn_enqueue(self, orders):
+        """Crea un trabajo pendiente por orden (si no tiene uno activo) y despierta el cron."""
+        active = self.search([('order_id', 'in', orders.ids), ('state', 'in', ('pending', 'running'))])
+        busy = set(active.order_id.ids)
+        jobs = self.create([{'order_id': order.id} for order in orders if order.id not in busy])
+        if jobs:
+            cron = self.env.ref('ccn_service_quote.ccn_material_order_job_cron', raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+        return jobs
+
+    @api.model
+    def _cron_process_jobs(self, limit=JOBS_PER_RUN):
+        """Procesa hasta ``limit`` trabajos pendientes, bloque por bloque."""
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        self.env.cr.execute("""
+            SELECT id FROM ccn_material_order_job
+             WHERE state IN ('pending', 'running')
+             ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [limit])
+        jobs = self.browse([row[0] for row in self.env.cr.fetchall()])
+        for job in jobs:
+            job._ccn_run(auto_commit=auto_commit)
+        # Quedan más trabajos: re-disparar en lugar de esperar el intervalo
+        if len(jobs) == limit:
+            self.env.ref('ccn_service_quote.ccn_material_order_job_cron')._trigger()
+
+    def action_retry(self):
+        self.filtered(lambda j: j.state == 'failed').write({'state': 'pending', 'error': False})
+        cron = self.env.ref('ccn_service_quote.ccn_material_order_job_cron', raise_if_not_found=False)
+        if cron:
+            cron._trigger()
+        return True
+
+    # ----------------- Procesamiento -----------------
+
+    def _ccn_run(self, auto_commit=False):
+        """Ejecuta el trabajo completo; con ``auto_commit`` confirma cada bloque."""
+        self.ensure_one()
+        start = time.monotonic()
+        self.write({'state': 'running', 'attempts': self.attempts + 1, 'error': False})
+        try:
+            with self.env.cr.savepoint():
+                self._ccn_step_project()
+            if auto_commit:
+                self.env.cr.commit()
+            # Una sola búsqueda de líneas por corrida; cada bloque toma su parte
+            by_site = self._ccn_material_sites()
+            while True:
+                with self.env.cr.savepoint():
+                    pending = self._ccn_step_materials(by_site)
+                if auto_commit:
+                    self.env.cr.commit()
+                if not pending:
+                    break
+        except Exception as e:
+            _logger.exception("[CCN] Trabajo de materiales %s (SO %s) falló", self.id, self.order_id.name)
+            self.write({'state': 'failed', 'error': str(e)})
+            if auto_commit:
+                self.env.cr.commit()
+            return False
+        self.write({'state': 'done', 'date_done': fields.Datetime.now()})
+        _logger.info("[CCN] Trabajo de materiales %s (SO %s): %s órdenes en %.2fs",
+                     self.id, self.order_id.name, len(self.material_order_ids), time.monotonic() - start)
+        if auto_commit:
+            self.env.cr.commit()
+        return True
+
+    def _ccn_step_project(self):
+        """Cuenta analítica, proyecto y distribución analítica de la SO (una vez)."""
+        order = self.order_id
+        if not order.ccn_quote_id:
+            raise UserError(_("La orden %s no tiene cotización CCN.") % order.name)
+        if self.analytic_account_id:
+            return
+        plan = self.env.ref('analytic.analytic_plan_projects', raise_if_not_found=False)
+        name = _('Proyecto %s - %s') % (order.name, order.partner_id.name)
+        analytic_account = self.env['account.analytic.account'].create({
+            'name': name,
+            'partner_id': order.partner_id.id,
+            'plan_id': plan.id if plan else False,
+        })
+        project = self.env['project.project'].create({
+            'name': name,
+            'partner_id': order.partner_id.id,
+            'sale_order_id': order.id,
+        })
+        # Una sola escritura para todas las líneas de la SO
+        if order.order_line:
+            order.order_line.write({'analytic_distribution': {str(analytic_account.id): 100}})
+        self.write({'analytic_account_id': analytic_account.id, 'project_id': project.id})
+
+    def _ccn_material_sites(self):
+        """``{clave_sitio: líneas de material}`` con clave = id de sitio (0 si no tiene)."""
+        lines = self.env['ccn.service.quote.line'].search([
+            ('quote_id', '=', self.order_id.ccn_quote_id.id),
+            ('type', '=', 'material'),
+            ('product_id', '!=', False),
+        ], order='site_id, id')
+        by_site = {}
+        for line in lines:
+            by_site.setdefault(line.site_id.id or 0, []).append(line)
+        return by_site
+
+    def _ccn_step_materials(self, by_site=None):
+        """Procesa el siguiente bloque de sitios de ``by_site`` (ver _ccn_material_sites).
+
+        Devuelve True si quedan sitios.
+        """
+        order = self.order_id
+        if by_site is None:
+            by_site = self._ccn_material_sites()
+        done = list(self.done_site_keys or [])
+        todo = [key for key in by_site if key not in done]
+        chunk = todo[:SITE_CHUNK_SIZE]
+        if not chunk:
+            self.write({'site_count': len(by_site)})
+            return False
+
+        distribution = {str(self.analytic_account_id.id): 100} if self.analytic_account_id else False
+        company_taxes = {}
+        Site = self.env['ccn.service.quote.site']
+        vals_list = []
+        for key in chunk:
+            site = Site.browse(key)
+            line_cmds = []
+            for line in by_site[key]:
+                product = line.product_id
+                if product not in company_taxes:
+                    company_taxes[product] = product.taxes_id.filtered(lambda t: t.company_id == order.company_id)
+                line_cmds.append((0, 0, {
+                    'product_id': product.id,
+                    'name': product.name,
+                    'product_uom_qty': line.quantity or 1.0,
+                    'price_unit': line.price_unit_final or 0.0,
+                    'tax_id': [(6, 0, company_taxes[product].ids)],
+                    'analytic_distribution': distribution,
+                }))
+            vals_list.append({
+                'partner_id': order.partner_id.id,
+                'origin': _('%s - Materiales %s') % (order.name, site.name if site else _('General')),
+                'order_line': line_cmds,
+            })
+        material_orders = self.env['sale.order'].create(vals_list)
+        # Confirmar automáticamente las órdenes de materiales del bloque
+        material_orders.action_confirm()
+
+        done += chunk
+        self.write({
+            'site_count': len(by_site),
+            'done_site_keys': done,
+            'material_order_ids': [(4, so.id) for so in material_orders],
+        })
+        _logger.info("[CCN] Trabajo de materiales %s: %s/%s sitios", self.id, len(done), len(by_site))
+        return len(done) < len(by_site)
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 from odoo import fields, models
+from odoo.tools.sql import create_index, index_exists
+
+# Índice compuesto para las búsquedas por pestaña, contadores e indicadores
+LINE_SCOPE_INDEX = 'ccn_service_quote_line_scope_idx'
+
 
 class CCNServiceQuoteLine(models.Model):
     _inherit = "ccn.service.quote.line"
@@ -10,3 +15,10 @@ class CCNServiceQuoteLine(models.Model):
         store=True,
         readonly=True,
     )
+
+    def init(self):
+        # Los dominios y agrupados filtran por (quote_id, site_id, service_type,
+        # rubro_code) sobre la columna almacenada, sin join a ccn_service_rubro
+        if not index_exists(self.env.cr, LINE_SCOPE_INDEX):
+            create_index(self.env.cr, LINE_SCOPE_INDEX, self._table,
+                         ['quote_id', 'site_id', 'service_type', 'rubro_code'])
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields
+from odoo import api, models, fields
+
+# Campos del template que cambian el índice rubro → productos permitidos
+RUBRO_INDEX_FIELDS = ('ccn_rubro_ids', 'ccn_exclude_from_quote', 'sale_ok')
+
+_CONTAINER_CACHE_KEY = 'ccn_container_map'
 
 class ProductTemplate(models.Model):
     _inherit = "product.template"
@@ -19,3 +24,112 @@ class ProductTemplate(models.Model):
         "rubro_id",                # columna FK a ccn.service.rubro
         string="Rubros Cotizador"
     )
+
+    # Identificador estable de los productos "contenedor" que usa el importador
+    # de la SO (p. ej. 'servicio:jardineria', 'rubro:mano_obra')
+    ccn_container_key = fields.Char(
+        string="Clave contenedor CCN",
+        index=True,
+        copy=False,
+        help="Clave técnica del producto contenedor usado al importar cotizaciones CCN en la orden de venta."
+    )
+
+    _sql_constraints = [
+        ('ccn_container_key_uniq', 'unique(ccn_container_key)',
+         'La clave de producto contenedor CCN debe ser única.'),
+    ]
+
+    @api.model
+    def _ccn_container_map(self):
+        """``{clave: product.product id}`` de los contenedores, archivados incluidos.
+
+        Se memoriza en ``env.cr.cache`` durante la transacción y se descarta al
+        crear, modificar, archivar o borrar un contenedor (template o variante).
+        """
+        cache = self.env.cr.cache
+        if _CONTAINER_CACHE_KEY not in cache:
+            products = self.env['product.product'].sudo().with_context(active_test=False).search(
+                [('ccn_container_key', '!=', False)], order='active desc, id')
+            mapping = {}
+            for product in products:
+                mapping.setdefault(product.ccn_container_key, product.id)
+            cache[_CONTAINER_CACHE_KEY] = mapping
+        return dict(cache[_CONTAINER_CACHE_KEY])
+
+    @api.model
+    def _ccn_invalidate_container_map(self):
+        self.env.cr.cache.pop(_CONTAINER_CACHE_KEY, None)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        templates = super().create(vals_list)
+        if any(vals.get('ccn_container_key') for vals in vals_list):
+            self._ccn_invalidate_container_map()
+        if any(vals.get('ccn_rubro_ids') for vals in vals_list):
+            self.env['ccn.service.rubro']._ccn_refresh_allowed_products(templates.ids)
+        return templates
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'ccn_container_key' in vals or ('active' in vals and self.filtered('ccn_container_key')):
+            self._ccn_invalidate_container_map()
+        if any(fname in vals for fname in RUBRO_INDEX_FIELDS):
+            self.env['ccn.service.rubro']._ccn_refresh_allowed_products(self.ids)
+        return res
+
+    def unlink(self):
+        containers = self.filtered('ccn_container_key')
+        res = super().unlink()
+        if containers:
+            self._ccn_invalidate_container_map()
+        return res
+
+
+class ProductProduct(models.Model):
+    _inherit = "product.product"
+
+    # Lado inverso del índice ccn.service.rubro.allowed_product_ids
+    ccn_allowed_rubro_ids = fields.Many2many(
+        "ccn.service.rubro",
+        "ccn_rubro_product_map",
+        "product_product_id",
+        "ccn_service_rubro_id",
+        string="Rubros Cotizador (índice)",
+        readonly=True,
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        products = super().create(vals_list)
+        # Variantes nuevas de templates con rubros entran al índice
+        templates = products.product_tmpl_id.filtered('ccn_rubro_ids')
+        if templates:
+            self.env['ccn.service.rubro']._ccn_refresh_allowed_products(templates.ids)
+        if products.filtered('ccn_container_key'):
+            self.env['product.template']._ccn_invalidate_container_map()
+        return products
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'active' in vals and self.filtered('ccn_container_key'):
+            self.env['product.template']._ccn_invalidate_container_map()
+        return res
+
+    def unlink(self):
+        containers = self.filtered('ccn_container_key')
+        res = super().unlink()
+        if containers:
+            self.env['product.template']._ccn_invalidate_container_map()
+        return res
+
+    @api.model
+    def name_search(self, name='', args=None, operator='ilike', limit=100):
+        # Autocompletado desde una pestaña de rubro: filtra por el índice en
+        # lugar de unir product_template/ccn_rubro_ids en cada tecla
+        args = list(args or [])
+        code = self.env.context.get('ctx_rubro_code')
+        if code and not any(isinstance(leaf, (list, tuple)) and leaf[0] == 'ccn_allowed_rubro_ids' for leaf in args):
+            rubro = self.env['ccn.service.rubro'].search([('code', '=', code)], limit=1)
+            if rubro:
+                args.append(('ccn_allowed_rubro_ids', '=', rubro.id))
+        return super().name_search(name=name, args=args, operator=operator, limit=limit)
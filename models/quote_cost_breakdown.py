@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Motor único de desglose de costos de la cotización.
+
+Agrupa las líneas una sola vez por (sitio, tipo de servicio, rubro) y aplica la
+fórmula del Resumen del Sitio:
+
+SUBTOTAL 1 = Mano Obra + Uniformes + EPP + EPP Alturas + Equipo Especial +
+             Comunicación + Herramienta Menor + Material Limpieza
+Administración / Utilidad = SUBTOTAL 1 × %
+SUBTOTAL 2 = SUBTOTAL 1 + Administración + Utilidad
+Transporte / Bienestar = tarifa × total_colaboradores
+Costo Financiero = (SUBTOTAL 1 + Perfil Médico + Maquinaria Limpieza +
+                    Fertilizantes + Consumibles + Transporte + Capacitación) × %
+TOTAL ANTES IVA = SUBTOTAL 2 + rubros adicionales + Transporte + Bienestar + Costo Financiero
+IVA = 16 %
+
+Lo consumen los indicadores por sitio/servicio, el wizard y el reporte de
+Resumen General y los totales almacenados del sitio. Los agrupados (y su
+reagrupación por sitio) se memorizan en ``env.cr.cache`` durante la
+transacción y se descartan al modificar líneas o la cotización, y cuando los
+importes de una línea se recalculan por dependencia.
+"""
+from odoo import api, models
+
+IVA_RATE = 0.16
+
+# Clave del desglose -> código de rubro
+BREAKDOWN_RUBROS = [
+    ('mano_obra', 'mano_obra'),
+    ('uniformes', 'uniforme'),
+    ('epp', 'epp'),
+    ('epp_alturas', 'epp_alturas'),
+    ('equipo_especial', 'equipo_especial_limpieza'),
+    ('comunicacion', 'comunicacion_computo'),
+    ('herramienta', 'herramienta_menor_jardineria'),
+    ('material_limpieza', 'material_limpieza'),
+    ('perfil_medico', 'perfil_medico'),
+    ('maquinaria_limpieza', 'maquinaria_limpieza'),
+    ('maquinaria_jardineria', 'maquinaria_jardineria'),
+    ('fertilizantes', 'fertilizantes_tierra_lama'),
+    ('consumibles', 'consumibles_jardineria'),
+    ('capacitacion', 'capacitacion'),
+]
+
+BUCKET_FIELDS = ('count', 'quantity', 'monthly_subtotal', 'mo_prestaciones', 'total_price')
+
+_CACHE_KEY = 'ccn_cost_buckets'
+_SITE_CACHE_KEY = 'ccn_cost_site_buckets'
+
+
+def _empty_bucket():
+    return dict.fromkeys(BUCKET_FIELDS, 0.0)
+
+
+def compute_breakdown(rubros, admin_pct=0.0, utilidad_pct=0.0, costo_financiero_pct=0.0,
+                      tarifa_transporte=0.0, tarifa_bienestar=0.0):
+    """Aplica la fórmula del sitio a ``{rubro_code: bucket}`` y devuelve un dict plano."""
+    def total(code):
+        return rubros.get(code, {}).get('total_price', 0.0)
+
+    res = {key: total(code) for key, code in BREAKDOWN_RUBROS}
+    res['elementos'] = int(sum(b.get('count', 0) for b in rubros.values()))
+    res['colaboradores'] = int(rubros.get('mano_obra', {}).get('quantity', 0.0))
+    res['sueldo_bruto'] = rubros.get('mano_obra', {}).get('monthly_subtotal', 0.0)
+    res['prestaciones'] = rubros.get('mano_obra', {}).get('mo_prestaciones', 0.0)
+
+    res['otros_rubros'] = (res['epp_alturas'] + res['equipo_especial'] + res['comunicacion'] +
+                           res['herramienta'] + res['material_limpieza'])
+    res['subtotal_1'] = res['mano_obra'] + res['uniformes'] + res['epp'] + res['otros_rubros']
+    res['administracion'] = res['subtotal_1'] * (admin_pct / 100.0)
+    res['utilidad'] = res['subtotal_1'] * (utilidad_pct / 100.0)
+    res['subtotal_2'] = res['subtotal_1'] + res['administracion'] + res['utilidad']
+    res['transporte'] = tarifa_transporte * res['colaboradores']
+    res['bienestar'] = tarifa_bienestar * res['colaboradores']
+    base_costo_financiero = (res['subtotal_1'] + res['perfil_medico'] + res['maquinaria_limpieza'] +
+                             res['fertilizantes'] + res['consumibles'] + res['transporte'] +
+                             res['capacitacion'])
+    res['costo_financiero'] = base_costo_financiero * (costo_financiero_pct / 100.0)
+    res['total_mensual_antes_iva'] = (res['subtotal_2'] + res['perfil_medico'] + res['maquinaria_limpieza'] +
+                                      res['maquinaria_jardineria'] + res['fertilizantes'] +
+                                      res['consumibles'] + res['transporte'] + res['bienestar'] +
+                                      res['capacitacion'] + res['costo_financiero'])
+    res['iva'] = res['total_mensual_antes_iva'] * IVA_RATE
+    res['total_mensual_con_iva'] = res['total_mensual_antes_iva'] + res['iva']
+    # Total del servicio: suma simple de todos los rubros
+    res['total_rubros'] = sum(res[key] for key, _code in BREAKDOWN_RUBROS)
+    return res
+
+
+class ServiceQuoteCostBreakdown(models.Model):
+    _inherit = 'ccn.service.quote'
+
+    def _ccn_cost_buckets(self):
+        """``{quote_id: {(site_id, service_type, rubro_code): bucket}}``.
+
+        Las cotizaciones guardadas salen de un único _read_group memorizado por
+        transacción; las que están en memoria (onchange) agrupan line_ids.
+        """
+        cache = self.env.cr.cache.setdefault(_CACHE_KEY, {})
+        res = {}
+        missing = self.browse([rec.id for rec in self if isinstance(rec.id, int) and rec.id not in cache])
+        if missing:
+            # El _read_group hace flush antes de agrupar: los recomputos que
+            # dispare invalidan aquí, antes de llenar la memoria
+            totals = missing._ccn_read_line_totals(['site_id', 'service_type', 'rubro_code'])
+            for quote_id in missing.ids:
+                cache[quote_id] = {}
+            for (quote_id, *key), vals in totals.items():
+                cache[quote_id][tuple(key)] = vals
+        for rec in self:
+            if isinstance(rec.id, int):
+                res[rec.id] = cache[rec.id]
+                continue
+            buckets = {}
+            for line in rec.line_ids:
+                key = (line.site_id.id, line.service_type, line.rubro_code or line.rubro_id.code)
+                bucket = buckets.setdefault(key, _empty_bucket())
+                bucket['count'] += 1
+                for fname in BUCKET_FIELDS[1:]:
+                    bucket[fname] += line[fname] or 0.0
+            res[rec.id] = buckets
+        return res
+
+    def _ccn_site_buckets(self, service_type=None):
+        """``{quote_id: {site_id: {rubro_code: bucket}}}``, opcionalmente de un solo servicio.
+
+        Reagrupa los buckets de _ccn_cost_buckets() por sitio. Para cotizaciones
+        guardadas el resultado también se memoriza por (cotización, servicio):
+        el Resumen del Sitio, el wizard, el reporte y los totales del sitio
+        comparten la misma agregación, y cada grupo de indicadores la arma
+        solo cuando alguno de sus campos se lee.
+        """
+        memo = self.env.cr.cache.setdefault(_SITE_CACHE_KEY, {})
+        all_buckets = None
+        res = {}
+        for quote in self:
+            saved = isinstance(quote.id, int)
+            if saved and (quote.id, service_type) in memo:
+                res[quote.id] = memo[(quote.id, service_type)]
+                continue
+            if all_buckets is None:
+                all_buckets = self._ccn_cost_buckets()
+            by_site = {}
+            for (site_id, srv, code), bucket in all_buckets[quote.id].items():
+                if service_type and srv != service_type:
+                    continue
+                agg = by_site.setdefault(site_id, {}).setdefault(code, _empty_bucket())
+                for fname in BUCKET_FIELDS:
+                    agg[fname] += bucket[fname]
+            if saved:
+                memo[(quote.id, service_type)] = by_site
+            res[quote.id] = by_site
+        return res
+
+    @api.model
+    def _ccn_invalidate_cost_buckets(self, quote_ids):
+        cache = self.env.cr.cache.get(_CACHE_KEY)
+        if cache:
+            for quote_id in quote_ids:
+                cache.pop(quote_id, None)
+        memo = self.env.cr.cache.get(_SITE_CACHE_KEY)
+        if memo:
+            quote_ids = set(quote_ids)
+            for key in [key for key in memo if key[0] in quote_ids]:
+                del memo[key]
+
+    def _ccn_breakdown_params(self):
+        self.ensure_one()
+        return {
+            'admin_pct': self.admin_percent or 0.0,
+            'utilidad_pct': self.utility_percent or 0.0,
+            'costo_financiero_pct': self.financial_percent or 0.0,
+            'tarifa_transporte': self.transporte_rate or 0.0,
+            'tarifa_bienestar': self.bienestar_rate or 0.0,
+        }
+
+    def _ccn_cost_breakdown(self, site_ids=None, service_type=None):
+        """Desglose por sitio: ``{quote_id: {site_id: desglose}}``.
+
+        ``site_ids`` limita los sitios evaluados (por defecto todos los que
+        tienen líneas); ``service_type`` restringe los rubros a un servicio.
+        Un sitio sin líneas devuelve el desglose en ceros.
+        """
+        site_buckets = self._ccn_site_buckets(service_type)
+        res = {}
+        for quote in self:
+            by_site = site_buckets[quote.id]
+            params = quote._ccn_breakdown_params()
+            wanted = site_ids if site_ids is not None else list(by_site)
+            res[quote.id] = {
+                site_id: compute_breakdown(by_site.get(site_id, {}), **params)
+                for site_id in wanted
+            }
+        return res
+
+    def get_cost_breakdown(self):
+        """API (reporte/cliente): desglose por sitio activo de la cotización.
+
+        Devuelve ``{site_id: desglose}`` de los sitios activos, sin incluir 'General'.
+        """
+        self.ensure_one()
+        sites = self.site_ids.filtered(lambda s: s.active and not s.is_general)
+        return self._ccn_cost_breakdown(site_ids=sites.ids)[self.id]
+
+    def write(self, vals):
+        # Porcentajes y prestaciones cambian total_price por recompute, sin pasar por line.write
+        self._ccn_invalidate_cost_buckets(self.ids)
+        return super().write(vals)
+
+
+class ServiceQuoteLineCostBreakdown(models.Model):
+    _inherit = 'ccn.service.quote.line'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        self.env['ccn.service.quote']._ccn_invalidate_cost_buckets(lines.quote_id.ids)
+        return lines
+
+    def write(self, vals):
+        quote_ids = set(self.quote_id.ids)
+        res = super().write(vals)
+        self.env['ccn.service.quote']._ccn_invalidate_cost_buckets(quote_ids | set(self.quote_id.ids))
+        return res
+
+    def unlink(self):
+        quote_ids = self.quote_id.ids
+        res = super().unlink()
+        self.env['ccn.service.quote']._ccn_invalidate_cost_buckets(quote_ids)
+        return res
+
+    def _compute_prices(self):
+        # Recomputo por dependencia (precio de producto, moneda, prestaciones):
+        # cambia los importes almacenados sin pasar por write
+        super()._compute_prices()
+        self.env['ccn.service.quote']._ccn_invalidate_cost_buckets(
+            [qid for qid in self.quote_id.ids if isinstance(qid, int)])
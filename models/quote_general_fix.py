@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Normalización del sitio 'General' de las cotizaciones en pasadas SQL por bloques.
+
+La usan data/migrate_fix_general.xml (en cada actualización del módulo) y el
+post_init_hook. Por cada bloque de cotizaciones se ejecuta un número fijo de
+sentencias, sin importar cuántas cotizaciones, sitios o líneas contenga:
+
+1. Sincroniza is_general con el nombre del sitio.
+2. Fusiona los 'General' duplicados en el canónico (menor sequence, id):
+   reasigna líneas, ACKs, reconocimientos de rubro (ccn.service.rubro.flag)
+   y sitio actual; los que chocan con uno del canónico se combinan en él
+   (OR de la marca) antes de eliminar los duplicados.
+3. Crea el 'General' de las cotizaciones que no lo tienen.
+4. Normaliza el canónico (activo, sequence -999) y general_site_id.
+5. Rellena current_site_id / is_current.
+
+Al terminar recalcula los totales almacenados de los sitios que recibieron
+líneas o se crearon, y crea el índice único parcial de 'General' si aún no
+existía.
+"""
+import logging
+import time
+
+from odoo import api, models
+
+_logger = logging.getLogger(__name__)
+
+# Cotizaciones por bloque
+GENERAL_FIX_CHUNK = 5000
+
+
+class ServiceQuoteGeneralFix(models.Model):
+    _inherit = 'ccn.service.quote'
+
+    # Usado por data/migrate_fix_general.xml y post_init_hook
+    @api.model
+    def _fix_general_sites(self, limit=None, chunk_size=GENERAL_FIX_CHUNK):
+        self.env.flush_all()
+        cr = self.env.cr
+        query = "SELECT id FROM ccn_service_quote ORDER BY id"
+        cr.execute(query + (" LIMIT %s" if limit else ""), [limit] if limit else [])
+        quote_ids = [row[0] for row in cr.fetchall()]
+        if not quote_ids:
+            return True
+
+        start = time.monotonic()
+        totals = dict.fromkeys(('merged', 'created', 'current'), 0)
+        touched = set()
+        for offset in range(0, len(quote_ids), chunk_size):
+            chunk = quote_ids[offset:offset + chunk_size]
+            stats = self._ccn_fix_general_chunk(chunk)
+            touched.update(stats.pop('site_ids'))
+            for key, value in stats.items():
+                totals[key] += value
+            _logger.info(
+                "[CCN] Sitios General: %s/%s cotizaciones (duplicados fusionados=%s, creados=%s, sitio actual=%s)",
+                offset + len(chunk), len(quote_ids), totals['merged'], totals['created'], totals['current'])
+
+        self.env.invalidate_all()
+        if touched:
+            self._ccn_recompute_site_totals(touched)
+        self.env['ccn.service.quote.site']._ccn_ensure_general_index()
+        _logger.info("[CCN] Sitios General normalizados en %.2fs", time.monotonic() - start)
+        return True
+
+    @api.model
+    def _ccn_recompute_site_totals(self, site_ids):
+        """Recalcula los indicadores almacenados de ``site_ids`` (líneas movidas por SQL)."""
+        Site = self.env['ccn.service.quote.site'].with_context(active_test=False)
+        sites = Site.browse(site_ids).exists()
+        if not sites:
+            return
+        self._ccn_invalidate_cost_buckets(sites.quote_id.ids)
+        self._ccn_bump_indicator_version(sites.quote_id.ids)
+        for field in Site._fields.values():
+            if field.store and field.compute == '_compute_indicators':
+                self.env.add_to_compute(field, sites)
+        sites.flush_recordset()
+
+    @api.model
+    def _ccn_fix_general_chunk(self, quote_ids):
+        """Normaliza el 'General' de ``quote_ids``.
+
+        Devuelve los conteos del bloque y ``site_ids``: los sitios cuyos totales
+        almacenados hay que recalcular (canónicos que recibieron líneas y
+        'General' creados).
+        """
+        cr = self.env.cr
+        uid = self.env.uid
+
+        # 1. is_general consistente con el nombre
+        cr.execute("""
+            UPDATE ccn_service_quote_site
+               SET is_general = (lower(trim(name)) = 'general')
+             WHERE quote_id = ANY(%s)
+               AND is_general IS DISTINCT FROM (lower(trim(name)) = 'general')
+        """, [quote_ids])
+
+        # 2. Duplicados → canónico
+        cr.execute("""
+            WITH ranked AS (
+                SELECT id, quote_id,
+                       row_number() OVER (PARTITION BY quote_id ORDER BY sequence, id) AS rn
+                  FROM ccn_service_quote_site
+                 WHERE quote_id = ANY(%s) AND is_general
+            )
+            SELECT d.id, c.id, d.quote_id
+              FROM ranked d
+              JOIN ranked c ON c.quote_id = d.quote_id AND c.rn = 1
+             WHERE d.rn > 1
+        """, [quote_ids])
+        pairs = cr.fetchall()
+        canon_ids = []
+        if pairs:
+            dup_ids = [dup for dup, _canon, _qid in pairs]
+            canon_ids = [canon for _dup, canon, _qid in pairs]
+            merge = "unnest(%(dups)s::int[], %(canons)s::int[]) AS m(dup, canon)"
+            params = {'dups': dup_ids, 'canons': canon_ids}
+            cr.execute(f"""
+                UPDATE ccn_service_quote_line l SET site_id = m.canon
+                  FROM {merge} WHERE l.site_id = m.dup
+            """, params)
+            # ACKs: los que chocan con uno del canónico se combinan en él; el resto se mueve
+            cr.execute(f"""
+                UPDATE ccn_service_quote_ack c SET is_empty = TRUE
+                  FROM {merge}, ccn_service_quote_ack a
+                 WHERE a.site_id = m.dup AND c.site_id = m.canon
+                   AND c.quote_id = a.quote_id AND c.service_type = a.service_type
+                   AND c.rubro_code = a.rubro_code
+                   AND a.is_empty AND NOT COALESCE(c.is_empty, FALSE)
+            """, params)
+            cr.execute(f"""
+                UPDATE ccn_service_quote_ack a SET site_id = m.canon
+                  FROM {merge}
+                 WHERE a.site_id = m.dup
+                   AND NOT EXISTS (
+                        SELECT 1 FROM ccn_service_quote_ack c
+                         WHERE c.quote_id = a.quote_id AND c.site_id = m.canon
+                           AND c.service_type = a.service_type AND c.rubro_code = a.rubro_code)
+            """, params)
+            # Reconocimientos de rubro: misma regla (unique quote/site/type/rubro)
+            cr.execute(f"""
+                UPDATE ccn_service_rubro_flag c SET ack_empty = TRUE
+                  FROM {merge}, ccn_service_rubro_flag f
+                 WHERE f.site_id = m.dup AND c.site_id = m.canon
+                   AND c.quote_id = f.quote_id AND c.type = f.type AND c.rubro_id = f.rubro_id
+                   AND f.ack_empty AND NOT COALESCE(c.ack_empty, FALSE)
+            """, params)
+            cr.execute(f"""
+                UPDATE ccn_service_rubro_flag f SET site_id = m.canon
+                  FROM {merge}
+                 WHERE f.site_id = m.dup
+                   AND NOT EXISTS (
+                        SELECT 1 FROM ccn_service_rubro_flag c
+                         WHERE c.quote_id = f.quote_id AND c.site_id = m.canon
+                           AND c.type = f.type AND c.rubro_id = f.rubro_id)
+            """, params)
+            cr.execute(f"""
+                UPDATE ccn_service_quote q SET current_site_id = m.canon
+                  FROM {merge} WHERE q.current_site_id = m.dup
+            """, params)
+            cr.execute("DELETE FROM ccn_service_quote_site WHERE id = ANY(%s)", [dup_ids])
+            # Líneas y ACKs cambiaron de sitio: estados de rubro desde cero
+            self.env['ccn.service.quote.rubro.state']._ccn_rebuild({qid for _dup, _canon, qid in pairs})
+
+        # 3. Crear los que faltan
+        cr.execute("""
+            INSERT INTO ccn_service_quote_site
+                   (quote_id, name, active, sequence, is_general, is_current, currency_id,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT q.id, 'General', TRUE, -999, TRUE, FALSE, q.currency_id,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM ccn_service_quote q
+             WHERE q.id = ANY(%(ids)s)
+               AND NOT EXISTS (SELECT 1 FROM ccn_service_quote_site s
+                                WHERE s.quote_id = q.id AND s.is_general)
+            RETURNING id
+        """, {'uid': uid, 'ids': quote_ids})
+        created_ids = [row[0] for row in cr.fetchall()]
+
+        # 4. Canónico activo y primero; general_site_id al día
+        cr.execute("""
+            UPDATE ccn_service_quote_site
+               SET active = TRUE, sequence = -999, name = 'General'
+             WHERE quote_id = ANY(%s) AND is_general
+               AND (NOT active OR sequence IS DISTINCT FROM -999 OR name <> 'General')
+        """, [quote_ids])
+        cr.execute("""
+            UPDATE ccn_service_quote q SET general_site_id = s.id
+              FROM ccn_service_quote_site s
+             WHERE s.quote_id = q.id AND s.is_general
+               AND q.id = ANY(%s)
+               AND q.general_site_id IS DISTINCT FROM s.id
+        """, [quote_ids])
+
+        # 5. Sitio actual: el General si falta o no es un sitio activo de la cotización
+        cr.execute("""
+            UPDATE ccn_service_quote q SET current_site_id = q.general_site_id
+             WHERE q.id = ANY(%s)
+               AND NOT EXISTS (SELECT 1 FROM ccn_service_quote_site s
+                                WHERE s.id = q.current_site_id AND s.quote_id = q.id AND s.active)
+        """, [quote_ids])
+        current = cr.rowcount
+        cr.execute("""
+            UPDATE ccn_service_quote_site s
+               SET is_current = COALESCE(s.id = q.current_site_id, FALSE)
+              FROM ccn_service_quote q
+             WHERE s.quote_id = q.id AND q.id = ANY(%s)
+               AND s.is_current IS DISTINCT FROM COALESCE(s.id = q.current_site_id, FALSE)
+        """, [quote_ids])
+        return {
+            'merged': len(pairs),
+            'created': len(created_ids),
+            'current': current,
+            'site_ids': set(canon_ids) | set(created_ids),
+        }
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Snapshot persistido de indicadores para cotizaciones pendientes o autorizadas.
+
+Sus cifras casi no cambian, pero cada apertura recalculaba todos los
+indicadores desde las líneas. Los computes de quote_indicators guardan aquí
+los valores de cada grupo (general, por sitio y por sitio/servicio) junto con
+la huella de la cotización: ``indicator_version``, un contador que se
+incrementa por SQL (sin tocar write_date, y solo en cotizaciones pendientes o
+autorizadas) cuando se crean, modifican, borran
+o recalculan líneas, o cuando se escribe en la cotización algo distinto de la
+navegación (sitio/servicio visto). Mientras la huella coincida, la lectura sale
+del snapshot.
+
+Los snapshots de la transacción se leen una sola vez por cotización y las
+escrituras se encolan y se guardan en el precommit, fuera de los computes.
+"""
+import json
+
+from odoo import api, fields, models
+
+SNAPSHOT_STATES = ('pending', 'authorized')
+
+# Campos de navegación: cambiarlos no invalida los snapshots
+NAVIGATION_FIELDS = {'current_site_id', 'current_service_type', 'current_type', 'tab_update_trigger'}
+
+_CACHE_KEY = 'ccn_indicator_snapshots'
+_QUEUE_KEY = 'ccn_indicator_snapshot_queue'
+
+
+class ServiceQuoteIndicatorSnapshot(models.Model):
+    _name = 'ccn.service.quote.indicator.snapshot'
+    _description = 'Snapshot de indicadores de cotización'
+    _log_access = False
+
+    quote_id = fields.Many2one('ccn.service.quote', string='Cotización', required=True, ondelete='cascade', index=True)
+    scope_key = fields.Char(string='Alcance', required=True,
+                            help="'general', 'sitio:<site_id>' o 'servicio:<site_id>:<tipo>'")
+    fingerprint = fields.Char(string='Huella', required=True)
+    snapshot_values = fields.Json(string='Valores')
+
+    _sql_constraints = [
+        ('ccn_indicator_snapshot_unique_scope', 'unique(quote_id, scope_key)',
+         'Ya existe un snapshot para ese alcance.'),
+    ]
+
+
+class ServiceQuoteIndicatorSnapshotMixin(models.Model):
+    _inherit = 'ccn.service.quote'
+
+    indicator_version = fields.Integer(string='Versión de indicadores', readonly=True, copy=False, default=0)
+
+    @api.model
+    def _ccn_bump_indicator_version(self, quote_ids):
+        """Invalida los snapshots de ``quote_ids`` sin escribir la cotización por el ORM.
+
+        Solo toca cotizaciones en ``SNAPSHOT_STATES``: las demás no usan
+        snapshots y la edición en borrador no debe bloquear la fila de la
+        cotización. Al pasar a esos estados ``write`` vuelve a incrementar.
+        """
+        quote_ids = [qid for qid in set(quote_ids) if isinstance(qid, int)]
+        if not quote_ids:
+            return
+        self.env.cr.execute("""
+            UPDATE ccn_service_quote SET indicator_version = COALESCE(indicator_version, 0) + 1
+             WHERE id = ANY(%s) AND state IN %s
+        """, [quote_ids, SNAPSHOT_STATES])
+        self.browse(quote_ids).invalidate_recordset(['indicator_version'])
+
+    def _ccn_snapshot_fingerprints(self):
+        """``{quote_id: huella}`` de las cotizaciones guardadas en estado pendiente/autorizado."""
+        return {
+            quote.id: str(quote.indicator_version or 0)
+            for quote in self
+            if isinstance(quote.id, int) and quote.state in SNAPSHOT_STATES
+        }
+
+    def _ccn_snapshot_lookup(self, scopes):
+        """Valores vigentes para ``{quote_id: scope_key}``.
+
+        Devuelve ``(huellas, aciertos)``: las huellas de las cotizaciones que
+        admiten snapshot y ``{quote_id: valores}`` de los snapshots cuya huella
+        sigue vigente. Los snapshots de cada cotización se leen una vez por
+        transacción y los tres grupos de indicadores los comparten.
+        """
+        if not scopes:
+            return {}, {}
+        fingerprints = self._ccn_snapshot_fingerprints()
+        wanted = {qid: scope for qid, scope in scopes.items() if qid in fingerprints}
+        if not wanted:
+            return fingerprints, {}
+        cache = self.env.cr.cache.setdefault(_CACHE_KEY, {})
+        missing = [qid for qid in wanted if qid not in cache]
+        if missing:
+            for quote_id in missing:
+                cache[quote_id] = {}
+            self.env.cr.execute("""
+                SELECT quote_id, scope_key, fingerprint, snapshot_values
+                  FROM ccn_service_quote_indicator_snapshot
+                 WHERE quote_id = ANY(%s)
+            """, [missing])
+            for quote_id, scope_key, fingerprint, values in self.env.cr.fetchall():
+                cache[quote_id][scope_key] = (fingerprint, values)
+        hits = {}
+        for quote_id, scope_key in wanted.items():
+            fingerprint, values = cache[quote_id].get(scope_key, (None, None))
+            if fingerprint == fingerprints[quote_id]:
+                hits[quote_id] = values
+        return fingerprints, hits
+
+    @api.model
+    def _ccn_snapshot_store(self, fingerprints, entries):
+        """Encola ``{quote_id: (scope_key, valores)}`` con la huella actual para el precommit."""
+        # Las lecturas en réplica/cursor de solo lectura simplemente no guardan
+        if getattr(self.env.cr, 'readonly', False):
+            return
+        entries = {qid: entry for qid, entry in entries.items() if qid in fingerprints}
+        if not entries:
+            return
+        cache = self.env.cr.cache.setdefault(_CACHE_KEY, {})
+        data = self.env.cr.precommit.data
+        if _QUEUE_KEY not in data:
+            data[_QUEUE_KEY] = {}
+            self.env.cr.precommit.add(self._ccn_snapshot_flush)
+        for quote_id, (scope_key, values) in entries.items():
+            data[_QUEUE_KEY][(quote_id, scope_key)] = (fingerprints[quote_id], values)
+            cache.setdefault(quote_id, {})[scope_key] = (fingerprints[quote_id], values)
+
+    def _ccn_snapshot_flush(self):
+        """Precommit: upsert de los snapshots encolados cuya huella sigue vigente."""
+        queue = self.env.cr.precommit.data.pop(_QUEUE_KEY, {})
+        if not queue:
+            return
+        # Líneas recalculadas después de encolar ya incrementaron la versión
+        self.env.cr.execute(
+            "SELECT id, COALESCE(indicator_version, 0) FROM ccn_service_quote WHERE id = ANY(%s)",
+            [list({quote_id for quote_id, _scope in queue})],
+        )
+        current = {quote_id: str(version) for quote_id, version in self.env.cr.fetchall()}
+        rows = [
+            (quote_id, scope_key, fingerprint, json.dumps(values))
+            for (quote_id, scope_key), (fingerprint, values) in queue.items()
+            if current.get(quote_id) == fingerprint
+        ]
+        if not rows:
+            return
+        self.env.cr.execute(
+            """
+            INSERT INTO ccn_service_quote_indicator_snapshot (quote_id, scope_key, fingerprint, snapshot_values)
+            VALUES {}
+            ON CONFLICT (quote_id, scope_key)
+            DO UPDATE SET fingerprint = EXCLUDED.fingerprint, snapshot_values = EXCLUDED.snapshot_values
+            """.format(', '.join(['(%s, %s, %s, %s::jsonb)'] * len(rows))),
+            [value for row in rows for value in row],
+        )
+        self.env['ccn.service.quote.indicator.snapshot'].invalidate_model()
+
+    def write(self, vals):
+        if set(vals) - NAVIGATION_FIELDS:
+            self._ccn_bump_indicator_version(self.ids)
+        res = super().write(vals)
+        # Entrada a pendiente/autorizado: el incremento previo se omitió en borrador
+        if 'state' in vals:
+            self.flush_recordset(['state'])
+            self._ccn_bump_indicator_version(self.ids)
+        return res
+
+
+class ServiceQuoteLineIndicatorSnapshot(models.Model):
+    _inherit = 'ccn.service.quote.line'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        self.env['ccn.service.quote']._ccn_bump_indicator_version(lines.quote_id.ids)
+        return lines
+
+    def write(self, vals):
+        quote_ids = set(self.quote_id.ids)
+        res = super().write(vals)
+        self.env['ccn.service.quote']._ccn_bump_indicator_version(quote_ids | set(self.quote_id.ids))
+        return res
+
+    def unlink(self):
+        quote_ids = self.quote_id.ids
+        res = super().unlink()
+        self.env['ccn.service.quote']._ccn_bump_indicator_version(quote_ids)
+        return res
+
+    def _compute_prices(self):
+        # Recomputo por dependencia (precio de producto, moneda, prestaciones)
+        super()._compute_prices()
+        self.env['ccn.service.quote']._ccn_bump_indicator_version(self.quote_id.ids)
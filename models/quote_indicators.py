@@ -10,6 +10,42 @@ Tres niveles de indicadores:
 """
 from odoo import api, fields, models
 
+from .ack import SERVICE_TYPE_SELECTION
+from .quote_cost_breakdown import compute_breakdown
+
+SERVICE_TYPES = {code for code, _label in SERVICE_TYPE_SELECTION}
+
+# Claves del desglose (ver quote_cost_breakdown) publicadas como indicator_sitio_<clave>
+SITIO_KEYS = [
+    'mano_obra', 'uniformes', 'epp', 'epp_alturas', 'equipo_especial', 'comunicacion',
+    'herramienta', 'material_limpieza', 'otros_rubros', 'subtotal_1', 'administracion',
+    'utilidad', 'subtotal_2', 'perfil_medico', 'maquinaria_limpieza', 'maquinaria_jardineria',
+    'fertilizantes', 'consumibles', 'transporte', 'bienestar', 'capacitacion',
+    'costo_financiero', 'total_mensual_antes_iva', 'iva', 'total_mensual_con_iva',
+]
+SITIO_PP_KEYS = [key for key in SITIO_KEYS if key not in ('iva', 'total_mensual_con_iva')]
+
+# (sufijo indicator_servicio_<sufijo>, clave del desglose); cada uno con su _pp
+SERVICIO_FIELDS = [
+    ('sueldo_bruto', 'sueldo_bruto'),
+    ('prestaciones', 'prestaciones'),
+    ('mano_obra', 'mano_obra'),
+    ('uniformes', 'uniformes'),
+    ('epp', 'epp'),
+    ('epp_alturas', 'epp_alturas'),
+    ('comunicacion', 'comunicacion'),
+    ('herramienta', 'herramienta'),
+    ('perfil_medico', 'perfil_medico'),
+    ('maquinaria', 'maquinaria_jardineria'),
+    ('fertilizantes', 'fertilizantes'),
+    ('consumibles', 'consumibles'),
+    ('capacitacion', 'capacitacion'),
+    ('material_limpieza', 'material_limpieza'),
+    ('maquinaria_limpieza', 'maquinaria_limpieza'),
+    ('equipo_especial', 'equipo_especial'),
+    ('total', 'total_rubros'),
+]
+
 class ServiceQuoteIndicators(models.Model):
     _inherit = 'ccn.service.quote'
 
@@ -269,36 +305,54 @@ class ServiceQuoteIndicators(models.Model):
         Calcula indicadores generales (todos los sitios y servicios).
         Suma global de toda la cotización.
         """
+        # Pendientes/autorizadas: snapshot vigente si la huella no cambió
+        scopes = {rec.id: 'general' for rec in self}
+        fingerprints, hits = self._ccn_snapshot_lookup(scopes)
+        # Mismo agrupado (sitio, servicio, rubro) que usan los demás indicadores:
+        # un único _read_group por lote, o line_ids en memoria durante onchange.
+        all_buckets = self.filtered(lambda r: r.id not in hits)._ccn_cost_buckets()
+        to_store = {}
         for rec in self:
+            if rec.id in hits:
+                rec.update(hits[rec.id])
+                continue
+            buckets = all_buckets[rec.id]
             # Total de elementos = todas las líneas de la cotización
-            total_elementos = len(rec.line_ids)
+            total_elementos = int(sum(b['count'] for b in buckets.values()))
 
             # Costo mensual total = suma de todos los total_price
-            costo_mensual = sum(rec.line_ids.mapped('total_price'))
+            costo_mensual = sum(b['total_price'] for b in buckets.values())
 
             # Personal requerido = suma de quantity en todas las líneas de mano_obra
-            mo_lines = rec.line_ids.filtered(lambda l: l.rubro_code == 'mano_obra')
-            personal_requerido = int(sum(mo_lines.mapped('quantity')))
+            personal_requerido = int(sum(
+                b['quantity'] for (_site, _srv, code), b in buckets.items() if code == 'mano_obra'
+            ))
+            rubros_con_datos = len({code for (_site, _srv, code), b in buckets.items() if code and b['count']})
 
             # Porcentaje de completitud (estimación basada en rubros con líneas)
             # TODO: Mejorar esta métrica según criterios de negocio
             # Por ahora: calculamos cuántos rubros tienen líneas vs total esperado
-            rubros_con_datos = len(set(rec.line_ids.mapped('rubro_code')))
             total_rubros_esperados = 14  # Total de rubros definidos en RUBRO_CODES
             pct_completado = (rubros_con_datos / total_rubros_esperados * 100.0) if total_rubros_esperados > 0 else 0.0
 
             # Asignar valores
-            rec.indicator_general_total_elementos = total_elementos
-            rec.indicator_general_costo_mensual = costo_mensual
-            rec.indicator_general_personal_requerido = personal_requerido
-            rec.indicator_general_pct_completado = pct_completado
+            vals = {
+                'indicator_general_total_elementos': total_elementos,
+                'indicator_general_costo_mensual': costo_mensual,
+                'indicator_general_personal_requerido': personal_requerido,
+                'indicator_general_pct_completado': pct_completado,
+            }
+            rec.update(vals)
+            to_store[rec.id] = (scopes[rec.id], vals)
+        self._ccn_snapshot_store(fingerprints, to_store)
 
     @api.depends('line_ids', 'line_ids.total_price', 'current_site_id', 'utility_percent', 'admin_percent',
                  'transporte_rate', 'bienestar_rate', 'financial_percent')
     def _compute_indicators_sitio(self):
         """
         Calcula indicadores del sitio actual (tabla Resumen del Sitio).
-        Suma TODOS los servicios del sitio actual.
+        Suma TODOS los servicios del sitio actual; la fórmula vive en
+        quote_cost_breakdown.compute_breakdown().
 
         Fórmulas:
         SUBTOTAL 1 = Mano Obra + Uniformes + EPP + EPP Alturas + Equipo Especial +
@@ -313,218 +367,49 @@ class ServiceQuoteIndicators(models.Model):
         TOTAL ANTES IVA = SUBTOTAL 2 + Perfil Médico + Maquinaria Limpieza + Maquinaria Jardinería +
                          Fertilizantes + Consumibles + Transporte + Bienestar + Capacitación + Costo Financiero
         """
+        # Solo se evalúa el sitio actual; la agregación por sitio se comparte
+        # (memorizada por transacción) con los demás consumidores del motor
+        scopes = {rec.id: f'sitio:{rec.current_site_id.id}' for rec in self if rec.current_site_id}
+        fingerprints, hits = self._ccn_snapshot_lookup(scopes)
+        site_buckets = self.filtered(lambda r: r.current_site_id and r.id not in hits)._ccn_site_buckets()
+        to_store = {}
         for rec in self:
-            if not rec.current_site_id:
-                # Sin sitio, poner todo en 0
-                rec.indicator_sitio_mano_obra = 0.0
-                rec.indicator_sitio_uniformes = 0.0
-                rec.indicator_sitio_epp = 0.0
-                rec.indicator_sitio_epp_alturas = 0.0
-                rec.indicator_sitio_equipo_especial = 0.0
-                rec.indicator_sitio_comunicacion = 0.0
-                rec.indicator_sitio_herramienta = 0.0
-                rec.indicator_sitio_material_limpieza = 0.0
-                rec.indicator_sitio_otros_rubros = 0.0
-                rec.indicator_sitio_subtotal_1 = 0.0
-                rec.indicator_sitio_administracion = 0.0
-                rec.indicator_sitio_administracion_pct = 0.0
-                rec.indicator_sitio_utilidad = 0.0
-                rec.indicator_sitio_utilidad_pct = 0.0
-                rec.indicator_sitio_subtotal_2 = 0.0
-                rec.indicator_sitio_perfil_medico = 0.0
-                rec.indicator_sitio_maquinaria_limpieza = 0.0
-                rec.indicator_sitio_maquinaria_jardineria = 0.0
-                rec.indicator_sitio_fertilizantes = 0.0
-                rec.indicator_sitio_consumibles = 0.0
-                rec.indicator_sitio_transporte = 0.0
-                rec.indicator_sitio_bienestar = 0.0
-                rec.indicator_sitio_capacitacion = 0.0
-                rec.indicator_sitio_costo_financiero = 0.0
-                rec.indicator_sitio_costo_financiero_pct = 0.0
-                rec.indicator_sitio_total_mensual_antes_iva = 0.0
-                rec.indicator_sitio_iva = 0.0
-                rec.indicator_sitio_total_mensual_con_iva = 0.0
-                # PP values
-                rec.indicator_sitio_mano_obra_pp = 0.0
-                rec.indicator_sitio_uniformes_pp = 0.0
-                rec.indicator_sitio_epp_pp = 0.0
-                rec.indicator_sitio_epp_alturas_pp = 0.0
-                rec.indicator_sitio_equipo_especial_pp = 0.0
-                rec.indicator_sitio_comunicacion_pp = 0.0
-                rec.indicator_sitio_herramienta_pp = 0.0
-                rec.indicator_sitio_material_limpieza_pp = 0.0
-                rec.indicator_sitio_otros_rubros_pp = 0.0
-                rec.indicator_sitio_subtotal_1_pp = 0.0
-                rec.indicator_sitio_administracion_pp = 0.0
-                rec.indicator_sitio_utilidad_pp = 0.0
-                rec.indicator_sitio_subtotal_2_pp = 0.0
-                rec.indicator_sitio_perfil_medico_pp = 0.0
-                rec.indicator_sitio_maquinaria_limpieza_pp = 0.0
-                rec.indicator_sitio_maquinaria_jardineria_pp = 0.0
-                rec.indicator_sitio_fertilizantes_pp = 0.0
-                rec.indicator_sitio_consumibles_pp = 0.0
-                rec.indicator_sitio_transporte_pp = 0.0
-                rec.indicator_sitio_bienestar_pp = 0.0
-                rec.indicator_sitio_capacitacion_pp = 0.0
-                rec.indicator_sitio_costo_financiero_pp = 0.0
-                rec.indicator_sitio_total_mensual_antes_iva_pp = 0.0
-                # Legacy
-                rec.indicator_sitio_total_elementos = 0
-                rec.indicator_sitio_inversion_inicial = 0.0
-                rec.indicator_sitio_costo_mensual = 0.0
-                rec.indicator_sitio_personal_total = 0
+            if rec.id in hits:
+                rec.update(hits[rec.id])
                 continue
-
-            # Filtrar líneas por sitio actual (todos los servicios)
-            lines = rec.line_ids.filtered(lambda l: l.site_id == rec.current_site_id)
-
-            # Calcular total de colaboradores (suma de quantity en todas las líneas de mano_obra)
-            mo_lines = lines.filtered(lambda l: l.rubro_code == 'mano_obra')
-            total_colaboradores = int(sum(mo_lines.mapped('quantity')))
-
-            # Helper para sumar por rubro
-            def sum_by_rubro(rubro_code):
-                return sum(lines.filtered(lambda l: l.rubro_code == rubro_code).mapped('total_price'))
-
-            # Calcular rubros individuales
-            mano_obra = sum_by_rubro('mano_obra')
-            uniformes = sum_by_rubro('uniforme')
-            epp = sum_by_rubro('epp')
-            epp_alturas = sum_by_rubro('epp_alturas')
-            equipo_especial = sum_by_rubro('equipo_especial_limpieza')
-            comunicacion = sum_by_rubro('comunicacion_computo')
-            herramienta = sum_by_rubro('herramienta_menor_jardineria')
-            material_limpieza = sum_by_rubro('material_limpieza')
-            perfil_medico = sum_by_rubro('perfil_medico')
-            maquinaria_limpieza = sum_by_rubro('maquinaria_limpieza')
-            maquinaria_jardineria = sum_by_rubro('maquinaria_jardineria')
-            fertilizantes = sum_by_rubro('fertilizantes_tierra_lama')
-            consumibles = sum_by_rubro('consumibles_jardineria')
-            capacitacion = sum_by_rubro('capacitacion')
-
-            # SUBTOTAL 1 (según fórmula proporcionada)
-            subtotal_1 = (mano_obra + uniformes + epp + epp_alturas + equipo_especial +
-                         comunicacion + herramienta + material_limpieza)
-
-            # Porcentajes configurables
-            admin_pct = rec.admin_percent or 0.0
-            utilidad_pct = rec.utility_percent or 0.0
-            costo_financiero_pct = rec.financial_percent or 0.0
-
-            # Administración y Utilidad sobre SUBTOTAL 1
-            administracion = subtotal_1 * (admin_pct / 100.0)
-            utilidad = subtotal_1 * (utilidad_pct / 100.0)
-
-            # SUBTOTAL 2
-            subtotal_2 = subtotal_1 + administracion + utilidad
-
-            # Transporte y Bienestar (basados en tarifas por colaborador)
-            tarifa_transporte = rec.transporte_rate or 0.0
-            tarifa_bienestar = rec.bienestar_rate or 0.0
-            transporte = tarifa_transporte * total_colaboradores
-            bienestar = tarifa_bienestar * total_colaboradores
-
-            # Costo Financiero (según fórmula proporcionada)
-            base_costo_financiero = (subtotal_1 + perfil_medico + maquinaria_limpieza +
-                                    fertilizantes + consumibles + transporte + capacitacion)
-            costo_financiero = base_costo_financiero * (costo_financiero_pct / 100.0)
-
-            # TOTAL MENSUAL ANTES DE IVA (según fórmula proporcionada)
-            total_mensual_antes_iva = (subtotal_2 + perfil_medico + maquinaria_limpieza +
-                                      maquinaria_jardineria + fertilizantes + consumibles +
-                                      transporte + bienestar + capacitacion + costo_financiero)
-
-            # IVA (16% sobre total antes de IVA)
-            iva = total_mensual_antes_iva * 0.16
-
-            # TOTAL MENSUAL CON IVA
-            total_mensual_con_iva = total_mensual_antes_iva + iva
-
-            # Asignar valores totales
-            rec.indicator_sitio_mano_obra = mano_obra
-            rec.indicator_sitio_uniformes = uniformes
-            rec.indicator_sitio_epp = epp
-            rec.indicator_sitio_epp_alturas = epp_alturas
-            rec.indicator_sitio_equipo_especial = equipo_especial
-            rec.indicator_sitio_comunicacion = comunicacion
-            rec.indicator_sitio_herramienta = herramienta
-            rec.indicator_sitio_material_limpieza = material_limpieza
-            rec.indicator_sitio_otros_rubros = epp_alturas + equipo_especial + comunicacion + herramienta + material_limpieza
-            rec.indicator_sitio_subtotal_1 = subtotal_1
-            rec.indicator_sitio_administracion = administracion
-            rec.indicator_sitio_administracion_pct = admin_pct
-            rec.indicator_sitio_utilidad = utilidad
-            rec.indicator_sitio_utilidad_pct = utilidad_pct
-            rec.indicator_sitio_subtotal_2 = subtotal_2
-            rec.indicator_sitio_perfil_medico = perfil_medico
-            rec.indicator_sitio_maquinaria_limpieza = maquinaria_limpieza
-            rec.indicator_sitio_maquinaria_jardineria = maquinaria_jardineria
-            rec.indicator_sitio_fertilizantes = fertilizantes
-            rec.indicator_sitio_consumibles = consumibles
-            rec.indicator_sitio_transporte = transporte
-            rec.indicator_sitio_bienestar = bienestar
-            rec.indicator_sitio_capacitacion = capacitacion
-            rec.indicator_sitio_costo_financiero = costo_financiero
-            rec.indicator_sitio_costo_financiero_pct = costo_financiero_pct
-            rec.indicator_sitio_total_mensual_antes_iva = total_mensual_antes_iva
-            rec.indicator_sitio_iva = iva
-            rec.indicator_sitio_total_mensual_con_iva = total_mensual_con_iva
-
-            # Calcular valores por persona (Per Person)
-            if total_colaboradores > 0:
-                rec.indicator_sitio_mano_obra_pp = mano_obra / total_colaboradores
-                rec.indicator_sitio_uniformes_pp = uniformes / total_colaboradores
-                rec.indicator_sitio_epp_pp = epp / total_colaboradores
-                rec.indicator_sitio_epp_alturas_pp = epp_alturas / total_colaboradores
-                rec.indicator_sitio_equipo_especial_pp = equipo_especial / total_colaboradores
-                rec.indicator_sitio_comunicacion_pp = comunicacion / total_colaboradores
-                rec.indicator_sitio_herramienta_pp = herramienta / total_colaboradores
-                rec.indicator_sitio_material_limpieza_pp = material_limpieza / total_colaboradores
-                rec.indicator_sitio_otros_rubros_pp = rec.indicator_sitio_otros_rubros / total_colaboradores
-                rec.indicator_sitio_subtotal_1_pp = subtotal_1 / total_colaboradores
-                rec.indicator_sitio_administracion_pp = administracion / total_colaboradores
-                rec.indicator_sitio_utilidad_pp = utilidad / total_colaboradores
-                rec.indicator_sitio_subtotal_2_pp = subtotal_2 / total_colaboradores
-                rec.indicator_sitio_perfil_medico_pp = perfil_medico / total_colaboradores
-                rec.indicator_sitio_maquinaria_limpieza_pp = maquinaria_limpieza / total_colaboradores
-                rec.indicator_sitio_maquinaria_jardineria_pp = maquinaria_jardineria / total_colaboradores
-                rec.indicator_sitio_fertilizantes_pp = fertilizantes / total_colaboradores
-                rec.indicator_sitio_consumibles_pp = consumibles / total_colaboradores
-                rec.indicator_sitio_transporte_pp = transporte / total_colaboradores
-                rec.indicator_sitio_bienestar_pp = bienestar / total_colaboradores
-                rec.indicator_sitio_capacitacion_pp = capacitacion / total_colaboradores
-                rec.indicator_sitio_costo_financiero_pp = costo_financiero / total_colaboradores
-                rec.indicator_sitio_total_mensual_antes_iva_pp = total_mensual_antes_iva / total_colaboradores
+            site_id = rec.current_site_id.id
+            if site_id:
+                # Todos los servicios del sitio actual
+                params = rec._ccn_breakdown_params()
+                breakdown = compute_breakdown(site_buckets[rec.id].get(site_id, {}), **params)
             else:
-                rec.indicator_sitio_mano_obra_pp = 0.0
-                rec.indicator_sitio_uniformes_pp = 0.0
-                rec.indicator_sitio_epp_pp = 0.0
-                rec.indicator_sitio_epp_alturas_pp = 0.0
-                rec.indicator_sitio_equipo_especial_pp = 0.0
-                rec.indicator_sitio_comunicacion_pp = 0.0
-                rec.indicator_sitio_herramienta_pp = 0.0
-                rec.indicator_sitio_material_limpieza_pp = 0.0
-                rec.indicator_sitio_otros_rubros_pp = 0.0
-                rec.indicator_sitio_subtotal_1_pp = 0.0
-                rec.indicator_sitio_administracion_pp = 0.0
-                rec.indicator_sitio_utilidad_pp = 0.0
-                rec.indicator_sitio_subtotal_2_pp = 0.0
-                rec.indicator_sitio_perfil_medico_pp = 0.0
-                rec.indicator_sitio_maquinaria_limpieza_pp = 0.0
-                rec.indicator_sitio_maquinaria_jardineria_pp = 0.0
-                rec.indicator_sitio_fertilizantes_pp = 0.0
-                rec.indicator_sitio_consumibles_pp = 0.0
-                rec.indicator_sitio_transporte_pp = 0.0
-                rec.indicator_sitio_bienestar_pp = 0.0
-                rec.indicator_sitio_capacitacion_pp = 0.0
-                rec.indicator_sitio_costo_financiero_pp = 0.0
-                rec.indicator_sitio_total_mensual_antes_iva_pp = 0.0
-
+                # Sin sitio, poner todo en 0
+                breakdown = compute_breakdown({})
+                params = {}
+            total_colaboradores = breakdown['colaboradores']
+
+            vals = {f'indicator_sitio_{key}': breakdown[key] for key in SITIO_KEYS}
+            vals.update({
+                'indicator_sitio_administracion_pct': params.get('admin_pct', 0.0),
+                'indicator_sitio_utilidad_pct': params.get('utilidad_pct', 0.0),
+                'indicator_sitio_costo_financiero_pct': params.get('costo_financiero_pct', 0.0),
+            })
+            # Valores por persona (Per Person)
+            for key in SITIO_PP_KEYS:
+                vals[f'indicator_sitio_{key}_pp'] = (
+                    breakdown[key] / total_colaboradores if total_colaboradores > 0 else 0.0
+                )
             # Valores legacy (mantener compatibilidad)
-            rec.indicator_sitio_total_elementos = len(lines)
-            rec.indicator_sitio_inversion_inicial = 0.0  # TODO: calcular inversión inicial si aplica
-            rec.indicator_sitio_costo_mensual = total_mensual_antes_iva
-            rec.indicator_sitio_personal_total = total_colaboradores
+            vals.update({
+                'indicator_sitio_total_elementos': breakdown['elementos'],
+                'indicator_sitio_inversion_inicial': 0.0,  # TODO: calcular inversión inicial si aplica
+                'indicator_sitio_costo_mensual': breakdown['total_mensual_antes_iva'],
+                'indicator_sitio_personal_total': total_colaboradores,
+            })
+            rec.update(vals)
+            if rec.id in scopes:
+                to_store[rec.id] = (scopes[rec.id], vals)
+        self._ccn_snapshot_store(fingerprints, to_store)
 
     @api.depends('line_ids', 'line_ids.total_price', 'line_ids.monthly_subtotal', 'line_ids.mo_prestaciones',
                  'current_site_id', 'current_service_type', 'prestaciones_percent')
@@ -533,150 +418,45 @@ class ServiceQuoteIndicators(models.Model):
         Calcula indicadores del servicio actual en el sitio actual.
         Filtrar line_ids por current_site_id y current_service_type y calcular valores reales.
         """
+        # 'resumen_sitio' no es un servicio con líneas: no hay nada que agregar
+        with_service = self.filtered(lambda r: r.current_site_id and r.current_service_type in SERVICE_TYPES)
+        scopes = {
+            rec.id: f'servicio:{rec.current_site_id.id}:{rec.current_service_type}'
+            for rec in with_service
+        }
+        fingerprints, hits = with_service._ccn_snapshot_lookup(scopes)
+        # Un solo _read_group para las guardadas del lote; luego una agregación por servicio
+        with_service.filtered(lambda r: isinstance(r.id, int) and r.id not in hits)._ccn_cost_buckets()
+        to_store = {}
         for rec in self:
-            if not rec.current_site_id or not rec.current_service_type:
-                # Sin contexto, poner todo en 0
-                rec.indicator_servicio_total_colaboradores = 0
-                rec.indicator_servicio_pct_prestaciones = 0.0
-                rec.indicator_servicio_sueldo_bruto = 0.0
-                rec.indicator_servicio_sueldo_bruto_pp = 0.0
-                rec.indicator_servicio_prestaciones = 0.0
-                rec.indicator_servicio_prestaciones_pp = 0.0
-                rec.indicator_servicio_mano_obra = 0.0
-                rec.indicator_servicio_mano_obra_pp = 0.0
-                rec.indicator_servicio_uniformes = 0.0
-                rec.indicator_servicio_uniformes_pp = 0.0
-                rec.indicator_servicio_epp = 0.0
-                rec.indicator_servicio_epp_pp = 0.0
-                rec.indicator_servicio_epp_alturas = 0.0
-                rec.indicator_servicio_epp_alturas_pp = 0.0
-                rec.indicator_servicio_comunicacion = 0.0
-                rec.indicator_servicio_comunicacion_pp = 0.0
-                rec.indicator_servicio_herramienta = 0.0
-                rec.indicator_servicio_herramienta_pp = 0.0
-                rec.indicator_servicio_perfil_medico = 0.0
-                rec.indicator_servicio_perfil_medico_pp = 0.0
-                rec.indicator_servicio_maquinaria = 0.0
-                rec.indicator_servicio_maquinaria_pp = 0.0
-                rec.indicator_servicio_fertilizantes = 0.0
-                rec.indicator_servicio_fertilizantes_pp = 0.0
-                rec.indicator_servicio_consumibles = 0.0
-                rec.indicator_servicio_consumibles_pp = 0.0
-                rec.indicator_servicio_capacitacion = 0.0
-                rec.indicator_servicio_capacitacion_pp = 0.0
-                rec.indicator_servicio_material_limpieza = 0.0
-                rec.indicator_servicio_material_limpieza_pp = 0.0
-                rec.indicator_servicio_maquinaria_limpieza = 0.0
-                rec.indicator_servicio_maquinaria_limpieza_pp = 0.0
-                rec.indicator_servicio_equipo_especial = 0.0
-                rec.indicator_servicio_equipo_especial_pp = 0.0
-                rec.indicator_servicio_total = 0.0
-                rec.indicator_servicio_total_pp = 0.0
+            if rec.id in hits:
+                rec.update(hits[rec.id])
                 continue
-
-            # Filtrar líneas por sitio y servicio actual
-            lines = rec.line_ids.filtered(
-                lambda l: l.site_id == rec.current_site_id and l.service_type == rec.current_service_type
-            )
-
-            # Calcular colaboradores (suma de quantity en líneas de mano_obra)
-            mo_lines = lines.filtered(lambda l: l.rubro_code == 'mano_obra')
-            total_colaboradores = int(sum(mo_lines.mapped('quantity')))
-
-            # Porcentaje de prestaciones
-            pct_prestaciones = rec.prestaciones_percent or 0.0
-
-            # Helper para sumar por rubro
-            def sum_by_rubro(rubro_code):
-                return sum(lines.filtered(lambda l: l.rubro_code == rubro_code).mapped('total_price'))
-
-            # Calcular mano de obra (total_price ya incluye prestaciones)
-            mano_obra = sum_by_rubro('mano_obra')
-
-            # Calcular sueldo bruto y prestaciones por separado para mostrar el desglose
-            sueldo_bruto = sum(mo_lines.mapped('monthly_subtotal'))  # Subtotal sin prestaciones
-            prestaciones = sum(mo_lines.mapped('mo_prestaciones'))   # Prestaciones calculadas
-
-            # Calcular totales por rubro
-            uniformes = sum_by_rubro('uniforme')
-            epp = sum_by_rubro('epp')
-            epp_alturas = sum_by_rubro('epp_alturas')
-            comunicacion = sum_by_rubro('comunicacion_computo')
-            herramienta = sum_by_rubro('herramienta_menor_jardineria')
-            perfil_medico = sum_by_rubro('perfil_medico')
-            maquinaria = sum_by_rubro('maquinaria_jardineria')
-            fertilizantes = sum_by_rubro('fertilizantes_tierra_lama')
-            consumibles = sum_by_rubro('consumibles_jardineria')
-            capacitacion = sum_by_rubro('capacitacion')
-            material_limpieza = sum_by_rubro('material_limpieza')
-            maquinaria_limpieza = sum_by_rubro('maquinaria_limpieza')
-            equipo_especial = sum_by_rubro('equipo_especial_limpieza')
-
-            # Asignar valores
-            rec.indicator_servicio_total_colaboradores = total_colaboradores
-            rec.indicator_servicio_pct_prestaciones = pct_prestaciones
-
-            rec.indicator_servicio_sueldo_bruto = sueldo_bruto
-            rec.indicator_servicio_prestaciones = prestaciones
-            rec.indicator_servicio_mano_obra = mano_obra
-
-            rec.indicator_servicio_uniformes = uniformes
-            rec.indicator_servicio_epp = epp
-            rec.indicator_servicio_epp_alturas = epp_alturas
-            rec.indicator_servicio_comunicacion = comunicacion
-            rec.indicator_servicio_herramienta = herramienta
-            rec.indicator_servicio_perfil_medico = perfil_medico
-            rec.indicator_servicio_maquinaria = maquinaria
-            rec.indicator_servicio_fertilizantes = fertilizantes
-            rec.indicator_servicio_consumibles = consumibles
-            rec.indicator_servicio_capacitacion = capacitacion
-            rec.indicator_servicio_material_limpieza = material_limpieza
-            rec.indicator_servicio_maquinaria_limpieza = maquinaria_limpieza
-            rec.indicator_servicio_equipo_especial = equipo_especial
-
-            # Calcular totales por persona
-            if total_colaboradores > 0:
-                rec.indicator_servicio_sueldo_bruto_pp = sueldo_bruto / total_colaboradores
-                rec.indicator_servicio_prestaciones_pp = prestaciones / total_colaboradores
-                rec.indicator_servicio_mano_obra_pp = mano_obra / total_colaboradores
-                rec.indicator_servicio_uniformes_pp = uniformes / total_colaboradores
-                rec.indicator_servicio_epp_pp = epp / total_colaboradores
-                rec.indicator_servicio_epp_alturas_pp = epp_alturas / total_colaboradores
-                rec.indicator_servicio_comunicacion_pp = comunicacion / total_colaboradores
-                rec.indicator_servicio_herramienta_pp = herramienta / total_colaboradores
-                rec.indicator_servicio_perfil_medico_pp = perfil_medico / total_colaboradores
-                rec.indicator_servicio_maquinaria_pp = maquinaria / total_colaboradores
-                rec.indicator_servicio_fertilizantes_pp = fertilizantes / total_colaboradores
-                rec.indicator_servicio_consumibles_pp = consumibles / total_colaboradores
-                rec.indicator_servicio_capacitacion_pp = capacitacion / total_colaboradores
-                rec.indicator_servicio_material_limpieza_pp = material_limpieza / total_colaboradores
-                rec.indicator_servicio_maquinaria_limpieza_pp = maquinaria_limpieza / total_colaboradores
-                rec.indicator_servicio_equipo_especial_pp = equipo_especial / total_colaboradores
+            site_id = rec.current_site_id.id
+            if rec in with_service:
+                # Líneas del sitio y servicio actual
+                rubros = rec._ccn_site_buckets(rec.current_service_type)[rec.id].get(site_id, {})
+                breakdown = compute_breakdown(rubros)
+                pct_prestaciones = rec.prestaciones_percent or 0.0
             else:
-                rec.indicator_servicio_sueldo_bruto_pp = 0.0
-                rec.indicator_servicio_prestaciones_pp = 0.0
-                rec.indicator_servicio_mano_obra_pp = 0.0
-                rec.indicator_servicio_uniformes_pp = 0.0
-                rec.indicator_servicio_epp_pp = 0.0
-                rec.indicator_servicio_epp_alturas_pp = 0.0
-                rec.indicator_servicio_comunicacion_pp = 0.0
-                rec.indicator_servicio_herramienta_pp = 0.0
-                rec.indicator_servicio_perfil_medico_pp = 0.0
-                rec.indicator_servicio_maquinaria_pp = 0.0
-                rec.indicator_servicio_fertilizantes_pp = 0.0
-                rec.indicator_servicio_consumibles_pp = 0.0
-                rec.indicator_servicio_capacitacion_pp = 0.0
-                rec.indicator_servicio_material_limpieza_pp = 0.0
-                rec.indicator_servicio_maquinaria_limpieza_pp = 0.0
-                rec.indicator_servicio_equipo_especial_pp = 0.0
-
-            # Total del servicio (suma de todos los rubros)
-            total = (mano_obra + uniformes + epp + epp_alturas + comunicacion + herramienta +
-                    perfil_medico + maquinaria + fertilizantes + consumibles + capacitacion +
-                    material_limpieza + maquinaria_limpieza + equipo_especial)
-
-            rec.indicator_servicio_total = total
-            rec.indicator_servicio_total_pp = total / total_colaboradores if total_colaboradores > 0 else 0.0
+                # Sin contexto, poner todo en 0
+                breakdown = compute_breakdown({})
+                pct_prestaciones = 0.0
+            total_colaboradores = breakdown['colaboradores']
+
+            vals = {
+                'indicator_servicio_total_colaboradores': total_colaboradores,
+                'indicator_servicio_pct_prestaciones': pct_prestaciones,
+            }
+            for name, key in SERVICIO_FIELDS:
+                vals[f'indicator_servicio_{name}'] = breakdown[key]
+                vals[f'indicator_servicio_{name}_pp'] = (
+                    breakdown[key] / total_colaboradores if total_colaboradores > 0 else 0.0
+                )
+            rec.update(vals)
+            if rec.id in scopes:
+                to_store[rec.id] = (scopes[rec.id], vals)
+        self._ccn_snapshot_store(fingerprints, to_store)
 
     # ============================================
     # MÉTODOS DE ACCIÓN
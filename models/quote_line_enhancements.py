@@ -14,24 +14,28 @@ class CCNServiceQuoteLine(models.Model):
         help="Impuestos aplicables a esta línea",
     )
 
-    # Subtotales mostrados en UI
+    # Subtotales mostrados en UI (almacenados para poder agregarlos por SQL)
     price_subtotal = fields.Monetary(
         string="Subtotal base",
         currency_field="currency_id",
         compute="_compute_display_amounts",
-        store=False,
+        store=True,
     )
     amount_tax = fields.Monetary(
         string="Monto de impuestos",
         currency_field="currency_id",
         compute="_compute_display_amounts",
-        store=False,
+        store=True,
     )
 
+    # Misma base que price_unit_final/total_price (product_base_price), no el
+    # list_price vivo: cambiar la tarifa no reescribe cotizaciones históricas.
+    @api.depends('quantity', 'product_base_price', 'tabulator_percent',
+                 'tax_ids', 'tax_ids.amount', 'tax_ids.amount_type')
     def _compute_display_amounts(self):
         for line in self:
             qty = line.quantity or 0.0
-            base = line.product_id.list_price if line.product_id else 0.0
+            base = line.product_base_price or 0.0
             tab = float(getattr(line, 'tabulator_percent', '0') or '0') / 100.0
             pu = base * (1.0 + tab)
             subtotal = qty * pu
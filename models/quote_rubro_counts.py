@@ -1,6 +1,27 @@
 # -*- coding: utf-8 -*-
 from odoo import api, fields, models
 
+# (campo contador, código de rubro). 'transporte' y 'bienestar' no son rubros
+# del catálogo: se conservan por compatibilidad de vistas y quedan en 0.
+RUBRO_COUNT_FIELDS = [
+    ('rubro_count_mano_obra', 'mano_obra'),
+    ('rubro_count_uniforme', 'uniforme'),
+    ('rubro_count_epp', 'epp'),
+    ('rubro_count_epp_alturas', 'epp_alturas'),
+    ('rubro_count_equipo_especial_limpieza', 'equipo_especial_limpieza'),
+    ('rubro_count_comunicacion_computo', 'comunicacion_computo'),
+    ('rubro_count_herramienta_menor_jardineria', 'herramienta_menor_jardineria'),
+    ('rubro_count_material_limpieza', 'material_limpieza'),
+    ('rubro_count_perfil_medico', 'perfil_medico'),
+    ('rubro_count_maquinaria_limpieza', 'maquinaria_limpieza'),
+    ('rubro_count_maquinaria_jardineria', 'maquinaria_jardineria'),
+    ('rubro_count_fertilizantes_tierra_lama', 'fertilizantes_tierra_lama'),
+    ('rubro_count_consumibles_jardineria', 'consumibles_jardineria'),
+    ('rubro_count_transporte', 'transporte'),
+    ('rubro_count_bienestar', 'bienestar'),
+    ('rubro_count_capacitacion', 'capacitacion'),
+]
+
 class CCNServiceQuoteRubroCounts(models.Model):
     _inherit = 'ccn.service.quote'
 
@@ -94,28 +115,10 @@ class CCNServiceQuoteRubroCounts(models.Model):
         'current_site_id', 'current_service_type'
     )
     def _compute_rubro_counts(self):
-        def count_for(rec, code):
-            lines = rec.line_ids.filtered(lambda l:
-                (not rec.current_site_id or l.site_id.id == rec.current_site_id.id) and
-                (not rec.current_service_type or l.service_type == rec.current_service_type) and
-                ((getattr(l, 'rubro_code', False) or getattr(l.rubro_id, 'code', False)) == code)
-            )
-            return len(lines)
-
+        # Una sola lectura de la tabla de estados para todo el recordset (o un
+        # único recorrido de line_ids en onchange); los 16 contadores salen de
+        # las mismas filas.
+        state_rows = self._ccn_rubro_state_rows()
         for rec in self:
-            rec.rubro_count_mano_obra                 = count_for(rec, 'mano_obra')
-            rec.rubro_count_uniforme                  = count_for(rec, 'uniforme')
-            rec.rubro_count_epp                       = count_for(rec, 'epp')
-            rec.rubro_count_epp_alturas               = count_for(rec, 'epp_alturas')
-            rec.rubro_count_equipo_especial_limpieza  = count_for(rec, 'equipo_especial_limpieza')
-            rec.rubro_count_comunicacion_computo      = count_for(rec, 'comunicacion_computo')
-            rec.rubro_count_herramienta_menor_jardineria = count_for(rec, 'herramienta_menor_jardineria')
-            rec.rubro_count_material_limpieza         = count_for(rec, 'material_limpieza')
-            rec.rubro_count_perfil_medico             = count_for(rec, 'perfil_medico')
-            rec.rubro_count_maquinaria_limpieza       = count_for(rec, 'maquinaria_limpieza')
-            rec.rubro_count_maquinaria_jardineria     = count_for(rec, 'maquinaria_jardineria')
-            rec.rubro_count_fertilizantes_tierra_lama = count_for(rec, 'fertilizantes_tierra_lama')
-            rec.rubro_count_consumibles_jardineria    = count_for(rec, 'consumibles_jardineria')
-            rec.rubro_count_transporte                = count_for(rec, 'transporte') if hasattr(rec, 'rubro_count_transporte') else 0
-            rec.rubro_count_bienestar                 = count_for(rec, 'bienestar') if hasattr(rec, 'rubro_count_bienestar') else 0
-            rec.rubro_count_capacitacion              = count_for(rec, 'capacitacion')
+            counts = self._ccn_count_rows(state_rows[rec.id], rec.current_site_id.id, rec.current_service_type)
+            rec.update({fname: counts.get(code, 0) for fname, code in RUBRO_COUNT_FIELDS})
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Tabla de estados de rubro por (cotización, sitio, tipo de servicio, rubro).
+
+Guarda el número de líneas y la marca "No aplica" (ACK) de cada combinación.
+Se mantiene de forma incremental desde create/write/unlink de líneas y ACKs
+(un upsert por clave afectada), de modo que los estados de pestañas, contadores
+y la validación de autorización leen unas pocas filas en lugar de recorrer
+todas las líneas de la cotización.
+"""
+from collections import Counter
+import logging
+
+from odoo import api, fields, models
+from odoo.tools.sql import table_exists
+
+from .ack import RUBRO_SELECTION, SERVICE_TYPE_SELECTION
+
+_logger = logging.getLogger(__name__)
+
+# Campos de la línea/ACK que determinan la clave de estado
+STATE_KEY_FIELDS = ('quote_id', 'site_id', 'service_type', 'rubro_id', 'rubro_code')
+
+
+class ServiceQuoteRubroState(models.Model):
+    _name = 'ccn.service.quote.rubro.state'
+    _description = 'Estado de rubro por sitio y tipo de servicio'
+    _log_access = False
+
+    quote_id = fields.Many2one('ccn.service.quote', string='Cotización', required=True, ondelete='cascade', index=True)
+    site_id = fields.Many2one('ccn.service.quote.site', string='Sitio', required=True, ondelete='cascade')
+    service_type = fields.Selection(SERVICE_TYPE_SELECTION, string='Tipo de servicio', required=True)
+    rubro_code = fields.Selection(RUBRO_SELECTION, string='Rubro', required=True)
+    line_count = fields.Integer(string='Líneas', default=0)
+    is_ack = fields.Boolean(string='No aplica', default=False)
+
+    _sql_constraints = [
+        (
+            'ccn_rubro_state_unique_scope',
+            'unique(quote_id, site_id, service_type, rubro_code)',
+            'Ya existe un estado para ese Sitio/Tipo de servicio/Rubro.'
+        ),
+    ]
+
+    _REBUILD_SQL = """
+        INSERT INTO ccn_service_quote_rubro_state
+               (quote_id, site_id, service_type, rubro_code, line_count, is_ack)
+        SELECT quote_id, site_id, service_type, rubro_code, SUM(line_count), BOOL_OR(is_ack)
+          FROM (
+                SELECT quote_id, site_id, service_type, rubro_code,
+                       COUNT(*) AS line_count, FALSE AS is_ack
+                  FROM ccn_service_quote_line
+                 WHERE site_id IS NOT NULL AND service_type IS NOT NULL AND rubro_code IS NOT NULL
+                   {line_filter}
+                 GROUP BY quote_id, site_id, service_type, rubro_code
+                UNION ALL
+                SELECT quote_id, site_id, service_type, rubro_code, 0, is_empty
+                  FROM ccn_service_quote_ack
+                 WHERE is_empty {ack_filter}
+               ) AS scope
+         GROUP BY quote_id, site_id, service_type, rubro_code
+    """
+
+    def init(self):
+        # Carga inicial solo si la tabla está vacía (instalación o primera
+        # actualización con este modelo). Las migraciones que tocan líneas por
+        # SQL reconstruyen sus cotizaciones con _ccn_rebuild(quote_ids).
+        cr = self.env.cr
+        if not (table_exists(cr, 'ccn_service_quote_line') and table_exists(cr, 'ccn_service_quote_ack')):
+            return
+        cr.execute("SELECT 1 FROM ccn_service_quote_rubro_state LIMIT 1")
+        if not cr.rowcount:
+            self._ccn_rebuild()
+
+    @api.model
+    def _ccn_rebuild(self, quote_ids=None):
+        """Recalcula desde cero los estados (de todas las cotizaciones o de ``quote_ids``)."""
+        cr = self.env.cr
+        if quote_ids is None:
+            cr.execute("DELETE FROM ccn_service_quote_rubro_state")
+            cr.execute(self._REBUILD_SQL.format(line_filter='', ack_filter=''))
+        else:
+            quote_ids = list(quote_ids)
+            if not quote_ids:
+                return
+            self.env['ccn.service.quote.line'].flush_model(['quote_id', 'site_id', 'service_type', 'rubro_code'])
+            self.env['ccn.service.quote.ack'].flush_model(['quote_id', 'site_id', 'service_type', 'rubro_code', 'is_empty'])
+            cr.execute("DELETE FROM ccn_service_quote_rubro_state WHERE quote_id = ANY(%s)", [quote_ids])
+            cr.execute(
+                self._REBUILD_SQL.format(
+                    line_filter='AND quote_id = ANY(%(quote_ids)s)',
+                    ack_filter='AND quote_id = ANY(%(quote_ids)s)',
+                ),
+                {'quote_ids': quote_ids},
+            )
+        _logger.info("Estados de rubro reconstruidos: %s filas", cr.rowcount)
+        self.invalidate_model()
+
+    @api.model
+    def _ccn_apply_line_deltas(self, deltas):
+        """Suma ``{(quote_id, site_id, service_type, rubro_code): delta}`` a line_count."""
+        rows = [key + (delta,) for key, delta in deltas.items() if delta and all(key)]
+        if not rows:
+            return
+        self.env.cr.execute(
+            """
+            INSERT INTO ccn_service_quote_rubro_state
+                   (quote_id, site_id, service_type, rubro_code, line_count, is_ack)
+            VALUES {}
+            ON CONFLICT (quote_id, site_id, service_type, rubro_code)
+            DO UPDATE SET line_count = GREATEST(
+                ccn_service_quote_rubro_state.line_count + EXCLUDED.line_count, 0)
+            """.format(', '.join(['(%s, %s, %s, %s, GREATEST(%s, 0), FALSE)'] * len(rows))),
+            [value for row in rows for value in row],
+        )
+        self.invalidate_model(['line_count'])
+
+    @api.model
+    def _ccn_apply_ack_flags(self, flags):
+        """Fija is_ack para ``{(quote_id, site_id, service_type, rubro_code): bool}``."""
+        rows = [key + (bool(flag),) for key, flag in flags.items() if all(key)]
+        if not rows:
+            return
+        self.env.cr.execute(
+            """
+            INSERT INTO ccn_service_quote_rubro_state
+                   (quote_id, site_id, service_type, rubro_code, line_count, is_ack)
+            VALUES {}
+            ON CONFLICT (quote_id, site_id, service_type, rubro_code)
+            DO UPDATE SET is_ack = EXCLUDED.is_ack
+            """.format(', '.join(['(%s, %s, %s, %s, 0, %s)'] * len(rows))),
+            [value for row in rows for value in row],
+        )
+        self.invalidate_model(['is_ack'])
+
+
+class ServiceQuoteLineRubroState(models.Model):
+    _inherit = 'ccn.service.quote.line'
+
+    def _ccn_state_keys(self):
+        """Counter de claves de estado de estas líneas."""
+        return Counter(
+            (line.quote_id.id, line.site_id.id, line.service_type, line.rubro_code)
+            for line in self
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        self.env['ccn.service.quote.rubro.state']._ccn_apply_line_deltas(lines._ccn_state_keys())
+        return lines
+
+    def write(self, vals):
+        if not any(fname in vals for fname in STATE_KEY_FIELDS):
+            return super().write(vals)
+        before = self._ccn_state_keys()
+        res = super().write(vals)
+        deltas = self._ccn_state_keys()
+        deltas.subtract(before)
+        self.env['ccn.service.quote.rubro.state']._ccn_apply_line_deltas(deltas)
+        return res
+
+    def unlink(self):
+        deltas = Counter({key: -count for key, count in self._ccn_state_keys().items()})
+        res = super().unlink()
+        self.env['ccn.service.quote.rubro.state']._ccn_apply_line_deltas(deltas)
+        return res
+
+
+class ServiceQuoteAckRubroState(models.Model):
+    _inherit = 'ccn.service.quote.ack'
+
+    def _ccn_ack_flags(self, value=None):
+        return {
+            (ack.quote_id.id, ack.site_id.id, ack.service_type, ack.rubro_code):
+                ack.is_empty if value is None else value
+            for ack in self
+        }
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        acks = super().create(vals_list)
+        self.env['ccn.service.quote.rubro.state']._ccn_apply_ack_flags(acks._ccn_ack_flags())
+        return acks
+
+    def write(self, vals):
+        if not any(fname in vals for fname in STATE_KEY_FIELDS + ('is_empty',)):
+            return super().write(vals)
+        before = self._ccn_ack_flags(value=False)
+        res = super().write(vals)
+        before.update(self._ccn_ack_flags())
+        self.env['ccn.service.quote.rubro.state']._ccn_apply_ack_flags(before)
+        return res
+
+    def unlink(self):
+        flags = self._ccn_ack_flags(value=False)
+        res = super().unlink()
+        self.env['ccn.service.quote.rubro.state']._ccn_apply_ack_flags(flags)
+        return res
+
+
+class ServiceRubroState(models.Model):
+    _inherit = 'ccn.service.rubro'
+
+    def write(self, vals):
+        if 'code' not in vals:
+            return super().write(vals)
+        # rubro_code de las líneas se recalcula por dependencia, sin pasar por
+        # line.write: se reconstruyen los estados de las cotizaciones afectadas
+        Line = self.env['ccn.service.quote.line']
+        quote_ids = {quote.id for [quote] in Line._read_group([('rubro_id', 'in', self.ids)], ['quote_id'])}
+        res = super().write(vals)
+        if quote_ids:
+            Line.flush_model(['rubro_code'])
+            self.env['ccn.service.quote.rubro.state']._ccn_rebuild(quote_ids)
+        return res
+
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from odoo import fields, models
+from odoo import api, fields, models
+from odoo.tools.sql import table_exists
 
 RUBRO_CODES = [
     ("mano_obra","Mano de Obra"),
@@ -42,14 +43,55 @@ class CCNServiceRubro(models.Model):
     active = fields.Boolean(default=True)
 
     # Productos permitidos para este rubro
-    # Usamos una tabla rel NUEVA para evitar conflictos con una tabla heredada/antigua
+    # Usamos una tabla rel NUEVA para evitar conflictos con una tabla heredada/antigua.
+    # Índice mantenido rubro → variantes: se reconstruye desde product.template
+    # (ccn_rubro_ids, vendible y no excluido del cotizador); ver
+    # _ccn_refresh_allowed_products.
     allowed_product_ids = fields.Many2many(
         comodel_name='product.product',
         relation='ccn_rubro_product_map',  # <- NUEVA tabla rel (no choca con la vieja)
         string='Productos permitidos',
+        readonly=True,
         help="Sólo estos productos podrán seleccionarse en las líneas que usen este rubro."
     )
 
     _sql_constraints = [
         ("uniq_code", "unique(code)", "El código de rubro debe ser único."),
     ]
+
+    _REFRESH_SQL = """
+        INSERT INTO ccn_rubro_product_map (ccn_service_rubro_id, product_product_id)
+        SELECT DISTINCT rel.rubro_id, pp.id
+          FROM ccn_rubro_product_rel rel
+          JOIN product_template pt ON pt.id = rel.product_tmpl_id
+          JOIN product_product pp ON pp.product_tmpl_id = pt.id
+         WHERE pt.sale_ok AND NOT COALESCE(pt.ccn_exclude_from_quote, FALSE)
+           {tmpl_filter}
+    """
+
+    def init(self):
+        # Reconstrucción completa en cada instalación/actualización
+        if table_exists(self.env.cr, 'ccn_rubro_product_rel'):
+            self._ccn_refresh_allowed_products()
+
+    @api.model
+    def _ccn_refresh_allowed_products(self, template_ids=None):
+        """Recalcula el índice rubro → productos (todo o solo las variantes de ``template_ids``)."""
+        cr = self.env.cr
+        if template_ids is None:
+            cr.execute("DELETE FROM ccn_rubro_product_map")
+            cr.execute(self._REFRESH_SQL.format(tmpl_filter=''))
+        else:
+            template_ids = list(template_ids)
+            if not template_ids:
+                return
+            self.env['product.template'].flush_model(['sale_ok', 'ccn_exclude_from_quote', 'ccn_rubro_ids'])
+            self.env['product.product'].flush_model(['product_tmpl_id'])
+            cr.execute("""
+                DELETE FROM ccn_rubro_product_map
+                 WHERE product_product_id IN (
+                        SELECT id FROM product_product WHERE product_tmpl_id = ANY(%(ids)s))
+            """, {'ids': template_ids})
+            cr.execute(self._REFRESH_SQL.format(tmpl_filter='AND pt.id = ANY(%(ids)s)'), {'ids': template_ids})
+        self.invalidate_model(['allowed_product_ids'])
+        self.env['product.product'].invalidate_model(['ccn_allowed_rubro_ids'])
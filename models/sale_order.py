@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 from collections import defaultdict
-from odoo import models, fields, _
+from odoo import api, models, fields, _
 from odoo.exceptions import UserError
 from odoo.tools.safe_eval import safe_eval
 
@@ -10,6 +10,13 @@ class SaleOrder(models.Model):
     # Campo para guardar la cotización CCN importada
     ccn_quote_id = fields.Many2one('ccn.service.quote', string='Cotización CCN', readonly=True, copy=False)
 
+    # Último trabajo de proyecto/órdenes de materiales (ver ccn.material.order.job)
+    ccn_material_job_id = fields.Many2one('ccn.material.order.job', string='Trabajo de materiales CCN',
+                                          readonly=True, copy=False)
+    ccn_material_job_state = fields.Selection(related='ccn_material_job_id.state', string='Estado materiales CCN')
+    ccn_material_job_progress = fields.Float(related='ccn_material_job_id.progress', string='Avance materiales CCN')
+    ccn_material_job_error = fields.Text(related='ccn_material_job_id.error', string='Error materiales CCN')
+
     def action_ccn_add_service_quote(self):
         """Abrir selector de Cotizador Especial CCN, filtrando por cliente y corrigiendo context."""
         self.ensure_one()
@@ -59,42 +66,89 @@ class SaleOrder(models.Model):
 
     # ----------------- Helpers de producto "contenedor" -----------------
 
+    def _ccn_resolve_container_products(self, specs):
+        """Resuelve ``{clave: etiqueta}`` a ``{clave: product.product}``.
+
+        Los contenedores se identifican por product.template.ccn_container_key
+        (mapa memorizado por transacción); los archivados se reactivan. Los que
+        aún no tienen clave se buscan una sola vez por nombre (productos creados
+        antes de la clave) y se etiquetan; los que faltan se crean en un solo
+        create().
+        """
+        Product = self.env['product.product'].sudo().with_context(active_test=False)
+        known = self.env['product.template']._ccn_container_map()
+        # Contenedores archivados: se reactivan en lugar de crear otro con la misma clave
+        archived = Product.browse([known[key] for key in specs if key in known]).filtered(lambda p: not p.active)
+        if archived:
+            archived.product_tmpl_id.write({'active': True})
+            archived.write({'active': True})
+        missing = {key: label for key, label in specs.items() if key not in known}
+        if missing:
+            legacy = Product.search([
+                ('name', 'in', list(set(missing.values()))),
+                ('type', '=', 'service'),
+                ('ccn_container_key', '=', False),
+            ])
+            by_name = {}
+            for product in legacy.sorted(lambda p: not p.active):
+                by_name.setdefault(product.name, product)
+            to_create = []
+            for key, label in missing.items():
+                product = by_name.pop(label, None)
+                if product:
+                    product.product_tmpl_id.write({
+                        'ccn_container_key': key,
+                        'ccn_exclude_from_quote': True,
+                        'default_code': False,
+                        'active': True,
+                    })
+                    if not product.active:
+                        product.write({'active': True})
+                    known[key] = product.id
+                else:
+                    to_create.append({
+                        'name': label,
+                        'type': 'service',
+                        'list_price': 0.0,
+                        'default_code': False,
+                        # marcar el template para que NO aparezca en service_quote
+                        'ccn_exclude_from_quote': True,
+                        'ccn_container_key': key,
+                    })
+            if to_create:
+                for product in Product.create(to_create):
+                    known[product.ccn_container_key] = product.id
+        return {key: self.env['product.product'].browse(known[key]) for key in specs}
+
     def _ccn_get_category_product(self, category):
-        """Devuelve 'Servicio de Jardinería/Limpieza' y lo marca como excluido del selector de quote."""
-        label = "Servicio de Jardinería" if category == "garden" else "Servicio de Limpieza"
-        Product = self.env['product.product']
-        product = Product.search([('name', '=', label), ('type', '=', 'service')], limit=1)
-        if not product:
-            product = Product.create({'name': label, 'type': 'service', 'list_price': 0.0, 'default_code': False})
-        else:
-            if product.default_code:
-                product.default_code = False
-        # marcar el template para que NO aparezca en service_quote
-        tmpl = product.product_tmpl_id
-        if hasattr(tmpl, 'ccn_exclude_from_quote') and not tmpl.ccn_exclude_from_quote:
-            tmpl.ccn_exclude_from_quote = True
-        return product
-
-    def _ccn_get_named_service_product(self, name):
-        """Producto de servicio con nombre = rubro (contenedor para modo por rubro). Ocúltalo del selector de quote."""
-        Product = self.env['product.product']
-        product = Product.search([('name', '=', name), ('type', '=', 'service')], limit=1)
-        if not product:
-            product = Product.create({'name': name, 'type': 'service', 'list_price': 0.0, 'default_code': False})
+        """Devuelve 'Servicio de Jardinería/Limpieza' (excluido del selector de quote)."""
+        if category == "garden":
+            key, label = 'servicio:jardineria', "Servicio de Jardinería"
         else:
-            if product.default_code:
-                product.default_code = False
-        tmpl = product.product_tmpl_id
-        if hasattr(tmpl, 'ccn_exclude_from_quote') and not tmpl.ccn_exclude_from_quote:
-            tmpl.ccn_exclude_from_quote = True
-        return product
+            key, label = 'servicio:limpieza', "Servicio de Limpieza"
+        return self._ccn_resolve_container_products({key: label})[key]
+
+    def _ccn_get_named_service_product(self, name, key=None):
+        """Producto de servicio contenedor con nombre ``name``. Oculto del selector de quote."""
+        key = key or 'nombre:%s' % name
+        return self._ccn_resolve_container_products({key: name})[key]
 
     # ----------------- Importador principal -----------------
 
-    def ccn_import_from_quote(self, quote):
-        """
-        Inserta líneas en la SO según display_mode de la service_quote, con validaciones de cliente.
-        """
+    def _ccn_service_label(self, srv):
+        """Etiqueta de tipo de servicio."""
+        return {
+            'jardineria': _('Jardinería'),
+            'limpieza': _('Limpieza'),
+            'mantenimiento': _('Mantenimiento'),
+            'materiales': _('Materiales'),
+            'servicios_especiales': _('Servicios Especiales'),
+            'almacenaje': _('Almacenaje'),
+            'fletes': _('Fletes'),
+        }.get(srv or '', srv or '')
+
+    def _ccn_check_import_quote(self, quote):
+        """Validaciones de cliente y contenido previas a importar/previsualizar."""
         self.ensure_one()
 
         # --- VALIDACIONES DE CLIENTE ---
@@ -107,242 +161,309 @@ class SaleOrder(models.Model):
                 "El cliente de la cotización (%s) no coincide con el de la orden (%s)."
             ) % (quote.partner_id.display_name, self.partner_id.display_name))
 
-        # --- GUARDAR REFERENCIA DE LA COTIZACIÓN ---
-        self.ccn_quote_id = quote.id
-
         # --- VALIDACIONES DE CONTENIDO ---
         if not quote.line_ids:
             raise UserError(_("La cotización seleccionada no tiene líneas."))
 
+    def _ccn_prepare_import_lines(self, quote, start_sequence=None, mode=None):
+        """Plan de partidas de la SO para ``quote`` según ``mode`` (por defecto su display_mode), sin escribir nada.
+
+        Sale de un único agregado de las líneas por (sitio, servicio, rubro).
+        Devuelve una lista de dicts en orden de inserción con ``sequence``,
+        ``display_type`` ('line_section' o False), ``name``, ``price_unit``,
+        ``product_uom_qty``, ``container_key`` (clave del producto contenedor),
+        ``product_id`` (id del contenedor si ya existe, si no False) y
+        ``sync_key`` (identidad estable de la partida para re-sincronizar,
+        con el prefijo de la cotización, ver ``_ccn_sync_prefix``).
+        Por defecto las secuencias continúan después de la última línea de la SO.
+        """
+        self.ensure_one()
+        Site = self.env['ccn.service.quote.site'].with_context(active_test=False)
+        Rubro = self.env['ccn.service.rubro'].with_context(active_test=False)
+        containers = self.env['product.template']._ccn_container_map()
+
         # Orden de inserción
-        current_max = max(self.order_line.mapped('sequence') or [0])
-        seq = current_max + 10
+        if start_sequence is None:
+            start_sequence = max(self.order_line.mapped('sequence') or [0]) + 10
+        seq = start_sequence
         STEP = 10
+        plan = []
+        prefix = self._ccn_sync_prefix(quote)
+
+        def _add_section(sync_key, name):
+            nonlocal seq
+            plan.append({
+                'sequence': seq,
+                'display_type': 'line_section',
+                'name': name,
+                'price_unit': 0.0,
+                'product_uom_qty': 0.0,
+                'container_key': False,
+                'product_id': False,
+                'sync_key': prefix + sync_key,
+            })
+            seq += STEP
 
-        # 0) Nota general como sección (si hay)
-        if getattr(quote, 'note_text', False):
-            self.order_line.create({
-                "order_id": self.id,
-                "display_type": "line_section",
-                "name": quote.note_text,
-                "sequence": seq,
+        def _add_line(scope, key, label, price):
+            nonlocal seq
+            plan.append({
+                'sequence': seq,
+                'display_type': False,
+                'name': label,
+                'price_unit': price,
+                'product_uom_qty': 1.0,
+                'container_key': key,
+                'product_id': containers.get(key, False),
+                'sync_key': '%s%s|%s' % (prefix, scope, key),
             })
             seq += STEP
 
-        mode = quote.display_mode
+        # 0) Nota general como sección (si hay)
+        if getattr(quote, 'note_text', False):
+            _add_section('nota', quote.note_text)
+
+        mode = mode or quote.display_mode
+
+        # Totales por sitio → servicio → rubro (un solo _read_group)
+        totals = defaultdict(lambda: defaultdict(dict))
+        for (_qid, site_id, srv, rubro_id), vals in quote._ccn_read_line_totals(
+                ['site_id', 'service_type', 'rubro_id']).items():
+            totals[site_id][srv][rubro_id] = vals['total_price']
 
+        sites = Site.browse([sid for sid in totals if sid]).sorted()
+        site_order = sites.ids + ([False] if False in totals else [])
         # ¿Hay múltiples sitios? Solo en ese caso añadimos la sección "SITIO: ..."
-        site_ids_set = set(l.site_id.id for l in quote.line_ids if l.site_id)
-        multiple_sites = len(site_ids_set) > 1
-
-        # Helper: etiqueta de tipo de servicio
-        def _srv_label(srv):
-            return {
-                'jardineria': _('Jardinería'),
-                'limpieza': _('Limpieza'),
-                'mantenimiento': _('Mantenimiento'),
-                'materiales': _('Materiales'),
-                'servicios_especiales': _('Servicios Especiales'),
-                'almacenaje': _('Almacenaje'),
-                'fletes': _('Fletes'),
-            }.get(srv or '', srv or '')
-
-        # Agrupar por sitio
-        by_site = defaultdict(list)
-        for l in quote.line_ids:
-            by_site[l.site_id].append(l)
-
-        if mode == "itemized":  # Resumen → 1 partida por sitio con total global del sitio
-            for site, lines in by_site.items():
-                total_site = sum(x.total_price for x in lines)
-                # tipos presentes en el sitio
-                types = []
-                seen = set()
-                for x in lines:
-                    if x.service_type and x.service_type not in seen:
-                        seen.add(x.service_type)
-                        types.append(_srv_label(x.service_type))
-                tipos_txt = " y ".join(types) if types else _("Servicio")
-
-                label = _("Servicio de %s") % (tipos_txt,)
-                product = self._ccn_get_named_service_product(label)
-                taxes = product.taxes_id.filtered(lambda t: t.company_id == self.company_id)
+        multiple_sites = len(sites) > 1
+        srv_order = [code for code, _label in self.env['ccn.service.quote.ack']._fields['service_type'].selection]
+        rubros = Rubro.browse([rid for by_srv in totals.values() for by_rubro in by_srv.values()
+                               for rid in by_rubro if rid])
+
+        for site_id in site_order:
+            site = Site.browse(site_id)
+            site_scope = 'sitio:%s' % (site_id or 0)
+            by_srv = totals[site_id]
+            services = sorted(by_srv, key=lambda s: srv_order.index(s) if s in srv_order else len(srv_order))
+
+            # Sección por sitio solo si hay múltiples sitios
+            if site_id and multiple_sites:
+                _add_section(site_scope, _("SITIO: %s") % (site.name,))
+
+            if mode == "itemized":  # Resumen → 1 partida por sitio con total global del sitio
+                types = [srv for srv in services if srv]
+                tipos_txt = " y ".join(self._ccn_service_label(t) for t in types) if types else _("Servicio")
+                total_site = sum(sum(by_rubro.values()) for by_rubro in by_srv.values())
+                # Clave propia del modo ('resumen:'), distinta de las de total_only
+                _add_line(site_scope, 'resumen:%s' % ('+'.join(types) or 'servicio'),
+                          _("Servicio de %s") % (tipos_txt,), total_site)
+
+            elif mode == "total_only":  # Acumulado General → 1 partida por tipo de servicio en cada sitio
+                for srv in services:
+                    _add_line(site_scope, 'servicio:%s' % (srv or 'sin_tipo'),
+                              _("Servicio de %s") % (self._ccn_service_label(srv),),
+                              sum(by_srv[srv].values()))
+
+            else:  # by_rubro → partidas por rubro, separadas por sitio y tipo de servicio
+                for srv in services:
+                    # Sub-sección por tipo de servicio
+                    srv_scope = '%s/%s' % (site_scope, srv or '')
+                    _add_section(srv_scope, _("Servicio: %s") % (self._ccn_service_label(srv),))
+                    by_rubro = by_srv[srv]
+                    for rubro in rubros.filtered(lambda r: r.id in by_rubro).sorted():
+                        _add_line(srv_scope, 'rubro:%s' % (rubro.code or rubro.id), rubro.name, by_rubro[rubro.id])
+                    # Líneas sin rubro: partida propia para que el total de la SO cuadre
+                    if False in by_rubro:
+                        _add_line(srv_scope, 'rubro:sin_rubro', _("Sin rubro"), by_rubro[False])
+        return plan
+
+    @api.model
+    def _ccn_sync_prefix(self, quote):
+        """Prefijo de ``ccn_sync_key``: las claves de sitio/nota se repiten entre cotizaciones."""
+        return 'q%s:' % quote.id
+
+    def _ccn_quote_sync_lines(self, quote):
+        """Partidas de la SO generadas desde ``quote`` (identificadas por su ``ccn_sync_key``)."""
+        prefix = self._ccn_sync_prefix(quote)
+        return self.order_line.filtered(lambda l: l.ccn_sync_key and l.ccn_sync_key.startswith(prefix))
+
+    def ccn_preview_import(self, quote, mode=None):
+        """API de vista previa (dry-run): partidas que generaría ccn_import_from_quote.
+
+        ``mode`` permite comparar otro modo de presentación ('by_rubro',
+        'total_only', 'itemized'); por defecto el display_mode de la cotización.
+        No crea productos, líneas ni ningún otro registro.
+        """
+        self._ccn_check_import_quote(quote)
+        return self._ccn_prepare_import_lines(quote, mode=mode)
 
-                # Sección por sitio solo si hay múltiples sitios
-                if site and multiple_sites:
-                    self.order_line.create({
-                        "order_id": self.id,
-                        "display_type": "line_section",
-                        "name": _("SITIO: %s") % (site.name,),
-                        "sequence": seq,
-                    })
-                    seq += STEP
+    def ccn_import_from_quote(self, quote):
+        """
+        Inserta líneas en la SO según display_mode de la service_quote, con validaciones de cliente.
+        """
+        self._ccn_check_import_quote(quote)
+
+        # --- GUARDAR REFERENCIA DE LA COTIZACIÓN ---
+        self.ccn_quote_id = quote.id
 
-                self.order_line.create({
-                    "order_id": self.id,
+        plan = self._ccn_prepare_import_lines(quote)
+
+        # Se insertan todas las partidas con un solo create(): un lote de
+        # onchanges/impuestos en vez de uno por partida.
+        vals_list = self._ccn_plan_line_vals(plan)
+        if vals_list:
+            self.env['sale.order.line'].create(vals_list)
+
+    def _ccn_plan_line_vals(self, plan):
+        """Valores de creación de sale.order.line para las partidas de ``plan``.
+
+        Los productos contenedor se resuelven (y crean si faltan) en lote.
+        """
+        specs = {item['container_key']: item['name'] for item in plan if not item['display_type']}
+        products = self._ccn_resolve_container_products(specs) if specs else {}
+        vals_list = []
+        for item in plan:
+            vals = {
+                "order_id": self.id,
+                "name": item['name'],
+                "sequence": item['sequence'],
+                "ccn_sync_key": item['sync_key'],
+            }
+            if item['display_type']:
+                vals["display_type"] = item['display_type']
+            else:
+                product = products[item['container_key']]
+                taxes = product.taxes_id.filtered(lambda t: t.company_id == self.company_id)
+                vals.update({
                     "product_id": product.id,
                     "name": product.name,
-                    "product_uom_qty": 1.0,
-                    "price_unit": total_site,
+                    "product_uom_qty": item['product_uom_qty'],
+                    "price_unit": item['price_unit'],
                     "tax_id": [(6, 0, taxes.ids)],
-                    "sequence": seq,
                 })
-                seq += STEP
-
-        elif mode == "total_only":  # Acumulado General → 1 partida por tipo de servicio en cada sitio
-            for site, lines in by_site.items():
-                if site and multiple_sites:
-                    self.order_line.create({
-                        "order_id": self.id,
-                        "display_type": "line_section",
-                        "name": _("SITIO: %s") % (site.name,),
-                        "sequence": seq,
-                    })
-                    seq += STEP
-
-                by_type = defaultdict(list)
-                for x in lines:
-                    by_type[x.service_type].append(x)
-
-                for srv, lst in by_type.items():
-                    total_srv = sum(x.total_price for x in lst)
-                    label = _("Servicio de %s") % (_srv_label(srv),)
-                    product = self._ccn_get_named_service_product(label)
-                    taxes = product.taxes_id.filtered(lambda t: t.company_id == self.company_id)
-                    self.order_line.create({
-                        "order_id": self.id,
-                        "product_id": product.id,
-                        "name": product.name,
-                        "product_uom_qty": 1.0,
-                        "price_unit": total_srv,
-                        "tax_id": [(6, 0, taxes.ids)],
-                        "sequence": seq,
-                    })
-                    seq += STEP
-
-        else:  # by_rubro → partidas por rubro, separadas por sitio y tipo de servicio
-            for site, lines in by_site.items():
-                if site and multiple_sites:
-                    self.order_line.create({
-                        "order_id": self.id,
-                        "display_type": "line_section",
-                        "name": _("SITIO: %s") % (site.name,),
-                        "sequence": seq,
-                    })
-                    seq += STEP
-
-                by_type = defaultdict(list)
-                for x in lines:
-                    by_type[x.service_type].append(x)
-
-                for srv, lst in by_type.items():
-                    # Sub-sección por tipo de servicio
-                    self.order_line.create({
-                        "order_id": self.id,
-                        "display_type": "line_section",
-                        "name": _("Servicio: %s") % (_srv_label(srv),),
-                        "sequence": seq,
-                    })
-                    seq += STEP
-
-                    by_rubro = defaultdict(list)
-                    for x in lst:
-                        by_rubro[x.rubro_id].append(x)
-
-                    for rubro in sorted(by_rubro.keys(), key=lambda r: (getattr(r, 'sequence', 0), getattr(r, 'name', '') or '')):
-                        r_lines = by_rubro[rubro]
-                        total_rubro = sum(x.total_price for x in r_lines)
-                        rubro_product = self._ccn_get_named_service_product(rubro.name)
-                        taxes = rubro_product.taxes_id.filtered(lambda t: t.company_id == self.company_id)
-                        self.order_line.create({
-                            "order_id": self.id,
-                            "product_id": rubro_product.id,
-                            "name": rubro_product.name,
-                            "product_uom_qty": 1.0,
-                            "price_unit": total_rubro,
-                            "tax_id": [(6, 0, taxes.ids)],
-                            "sequence": seq,
-                        })
-                        seq += STEP
+            vals_list.append(vals)
+        return vals_list
+
+    def ccn_sync_from_quote(self, quote=None):
+        """Re-sincroniza incrementalmente la SO con su cotización CCN (``ccn_quote_id``).
+
+        Compara el plan de importación con las líneas generadas por CCN
+        (``ccn_sync_key``) y solo crea, actualiza o elimina lo que cambió. Solo
+        se comparan las partidas de ``quote``; si ``quote`` reemplaza a la
+        cotización anterior de la SO, se eliminan únicamente las partidas de
+        esa cotización. Las líneas manuales, las de otras cotizaciones y la
+        distribución analítica de las líneas conservadas no se tocan.
+        Devuelve ``{'created', 'updated', 'deleted'}`` con los conteos.
+        """
+        self.ensure_one()
+        quote = quote or self.ccn_quote_id
+        if not quote:
+            raise UserError(_("La Orden de Venta no tiene una cotización CCN importada."))
+        # Confirmada: Odoo no permite borrar líneas de producto ya vendidas
+        if self.state not in ('draft', 'sent'):
+            raise UserError(_("Solo se puede sincronizar la cotización CCN en órdenes en borrador o enviadas."))
+        self._ccn_check_import_quote(quote)
+        previous = self.ccn_quote_id
+        # Importadas antes de ccn_sync_key: sin claves el diff duplicaría todas las partidas
+        if previous and self.order_line and not self._ccn_quote_sync_lines(previous):
+            raise UserError(_(
+                "Las partidas de esta orden se importaron antes de la sincronización incremental. "
+                "Elimina las partidas de la cotización CCN y vuelve a agregarla para poder sincronizarla."
+            ))
+        # Otra cotización: se reemplazan solo las partidas de la anterior
+        replaced = self.env['sale.order.line']
+        if previous and previous != quote:
+            replaced = self._ccn_quote_sync_lines(previous)
+        if previous != quote:
+            self.ccn_quote_id = quote.id
+
+        current = {}
+        duplicates = self.env['sale.order.line']
+        for line in self._ccn_quote_sync_lines(quote):
+            if line.ccn_sync_key in current:
+                duplicates |= line
+            else:
+                current[line.ccn_sync_key] = line
+        # Las partidas CCN conservan su posición: el plan arranca donde empezaban
+        kept = replaced.union(*current.values())
+        start = min(kept.mapped('sequence')) if kept else None
+        plan = self._ccn_prepare_import_lines(quote, start_sequence=start)
+
+        to_create = []
+        updated = 0
+        for item in plan:
+            line = current.pop(item['sync_key'], None)
+            if not line:
+                to_create.append(item)
+                continue
+            vals = {}
+            if line.sequence != item['sequence']:
+                vals['sequence'] = item['sequence']
+            if item['display_type']:
+                if line.name != item['name']:
+                    vals['name'] = item['name']
+            else:
+                currency = self.currency_id
+                if currency.compare_amounts(line.price_unit, item['price_unit']):
+                    vals['price_unit'] = item['price_unit']
+                if line.product_uom_qty != item['product_uom_qty']:
+                    vals['product_uom_qty'] = item['product_uom_qty']
+            if vals:
+                line.write(vals)
+                updated += 1
+
+        obsolete = duplicates.union(replaced, *current.values())
+        if obsolete:
+            obsolete.unlink()
+        if to_create:
+            self.env['sale.order.line'].create(self._ccn_plan_line_vals(to_create))
+        return {'created': len(to_create), 'updated': updated, 'deleted': len(obsolete)}
+
+    def action_ccn_sync_quote(self):
+        """Botón: re-sincroniza la SO con su cotización CCN."""
+        for order in self:
+            order.ccn_sync_from_quote()
+        return True
 
     # ----------------- Generación automática de proyecto y órdenes de materiales -----------------
 
     def action_confirm(self):
         """
-        Sobrescribir action_confirm para:
-        1. Crear proyecto si tiene cotización CCN
-        2. Generar órdenes de venta para materiales
-        3. Vincular cuenta analítica a todas las órdenes
+        Sobrescribir action_confirm para encolar, por cada orden con cotización CCN:
+        1. Creación del proyecto y su cuenta analítica
+        2. Generación de órdenes de venta para materiales
+        3. Vinculación de la cuenta analítica a todas las órdenes
+        El trabajo corre en segundo plano (ccn.material.order.job).
         """
         res = super().action_confirm()
 
-        for order in self:
-            if order.ccn_quote_id:
-                order._create_project_and_material_orders()
+        orders = self.filtered('ccn_quote_id')
+        if orders:
+            jobs = self.env['ccn.material.order.job']._ccn_enqueue(orders)
+            for job in jobs:
+                job.order_id.ccn_material_job_id = job
 
         return res
 
     def _create_project_and_material_orders(self):
         """
         Crea un proyecto y órdenes de venta para materiales de la cotización CCN
+        en la transacción actual (sin pasar por la cola).
         """
         self.ensure_one()
 
         if not self.ccn_quote_id:
             return
 
-        quote = self.ccn_quote_id
-
-        # 1. Crear cuenta analítica primero
-        analytic_account = self.env['account.analytic.account'].create({
-            'name': _('Proyecto %s - %s') % (self.name, self.partner_id.name),
-            'partner_id': self.partner_id.id,
-            'plan_id': self.env.ref('analytic.analytic_plan_projects').id if self.env.ref('analytic.analytic_plan_projects', False) else False,
-        })
-
-        # 2. Crear proyecto vinculado a la cuenta analítica
-        project = self.env['project.project'].create({
-            'name': _('Proyecto %s - %s') % (self.name, self.partner_id.name),
-            'partner_id': self.partner_id.id,
-            'sale_order_id': self.id,
-        })
-
-        # 3. Aplicar distribución analítica a las líneas existentes de la SO
-        if analytic_account and self.order_line:
-            for line in self.order_line:
-                line.analytic_distribution = {str(analytic_account.id): 100}
-
-        # 4. Obtener materiales de la cotización (type='material')
-        material_lines = quote.line_ids.filtered(lambda l: l.type == 'material')
+        job = self.env['ccn.material.order.job'].create({'order_id': self.id})
+        self.ccn_material_job_id = job
+        job._ccn_run()
 
-        if not material_lines:
-            return
-
-        # 5. Agrupar materiales por sitio
-        by_site = defaultdict(list)
-        for line in material_lines:
-            by_site[line.site_id].append(line)
+    def action_ccn_retry_material_job(self):
+        self.ccn_material_job_id.action_retry()
+        return True
 
-        # 6. Crear una orden de venta por cada sitio con materiales
-        for site, lines in by_site.items():
-            material_so = self.env['sale.order'].create({
-                'partner_id': self.partner_id.id,
-                'origin': _('%s - Materiales %s') % (self.name, site.name if site else _('General')),
-            })
 
-            # Agregar líneas de materiales
-            for line in lines:
-                if line.product_id:
-                    taxes = line.product_id.taxes_id.filtered(lambda t: t.company_id == self.company_id)
-                    self.env['sale.order.line'].create({
-                        'order_id': material_so.id,
-                        'product_id': line.product_id.id,
-                        'name': line.product_id.name,
-                        'product_uom_qty': line.quantity or 1.0,
-                        'price_unit': line.price_unit_final or 0.0,
-                        'tax_id': [(6, 0, taxes.ids)],
-                        'analytic_distribution': {str(analytic_account.id): 100} if analytic_account else False,
-                    })
+class SaleOrderLine(models.Model):
+    _inherit = "sale.order.line"
 
-            # Confirmar automáticamente la orden de materiales
-            material_so.action_confirm()
+    # Identidad de la partida generada desde la cotización CCN (vacío en líneas manuales)
+    ccn_sync_key = fields.Char(string='Clave CCN', copy=False, index=True, readonly=True)
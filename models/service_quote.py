@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from odoo import Command, api, fields, models, _
 from odoo.exceptions import ValidationError, UserError
+from odoo.tools import float_round
 from markupsafe import Markup
+from collections import Counter
 import logging
-import time
 
 _logger = logging.getLogger(__name__)
 
@@ -41,6 +42,50 @@ RUBROS_POR_SERVICIO = {
     }
 }
 
+# Particiones de line_ids por pestaña: campo -> (rubro_code, service_type o False = todos)
+LINE_PARTITIONS = {
+    'line_ids_mano_obra': ('mano_obra', False),
+    'line_ids_mano_obra_jardineria': ('mano_obra', 'jardineria'),
+    'line_ids_mano_obra_limpieza': ('mano_obra', 'limpieza'),
+    'line_ids_uniforme': ('uniforme', False),
+    'line_ids_uniforme_jardineria': ('uniforme', 'jardineria'),
+    'line_ids_uniforme_limpieza': ('uniforme', 'limpieza'),
+    'line_ids_epp': ('epp', False),
+    'line_ids_epp_jardineria': ('epp', 'jardineria'),
+    'line_ids_epp_limpieza': ('epp', 'limpieza'),
+    'line_ids_epp_alturas': ('epp_alturas', False),
+    'line_ids_equipo_especial_limpieza': ('equipo_especial_limpieza', False),
+    'line_ids_comunicacion_computo': ('comunicacion_computo', False),
+    'line_ids_comunicacion_computo_jardineria': ('comunicacion_computo', 'jardineria'),
+    'line_ids_comunicacion_computo_limpieza': ('comunicacion_computo', 'limpieza'),
+    'line_ids_herramienta_menor_jardineria': ('herramienta_menor_jardineria', False),
+    'line_ids_material_limpieza': ('material_limpieza', False),
+    'line_ids_perfil_medico': ('perfil_medico', False),
+    'line_ids_perfil_medico_jardineria': ('perfil_medico', 'jardineria'),
+    'line_ids_perfil_medico_limpieza': ('perfil_medico', 'limpieza'),
+    'line_ids_maquinaria_limpieza': ('maquinaria_limpieza', False),
+    'line_ids_maquinaria_jardineria': ('maquinaria_jardineria', False),
+    'line_ids_fertilizantes_tierra_lama': ('fertilizantes_tierra_lama', False),
+    'line_ids_consumibles_jardineria': ('consumibles_jardineria', False),
+    'line_ids_capacitacion': ('capacitacion', False),
+    'line_ids_capacitacion_jardineria': ('capacitacion', 'jardineria'),
+    'line_ids_capacitacion_limpieza': ('capacitacion', 'limpieza'),
+}
+
+# Factores de frecuencia → mes equivalente (Subtotal Mensual)
+FREQUENCY_FACTORS = {
+    'weekly': 30.42 / 7.0,
+    'fortnight_14': 30.42 / 14.0,
+    'biweekly': 2.0,
+    'monthly': 1.0,
+    'bimonthly': 1.0 / 2.0,
+    'quarterly': 1.0 / 3.0,
+    'semiannual': 1.0 / 6.0,
+    'annual': 1.0 / 12.0,
+    '18m': 1.0 / 18.0,
+    '24m': 1.0 / 24.0,
+}
+
 # =====================================================================
 # QUOTE (encabezado)
 # =====================================================================
@@ -87,6 +132,14 @@ class ServiceQuote(models.Model):
     def _default_site_ids(self):
         return [Command.create({'name': self.env._('General')})]
 
+    # Sitio 'General' de la cotización (único por el índice parcial del sitio)
+    general_site_id = fields.Many2one(
+        "ccn.service.quote.site",
+        string="Sitio General",
+        compute="_compute_general_site_id",
+        store=True,
+        readonly=True,
+    )
     site_ids = fields.One2many(
         "ccn.service.quote.site",
         "quote_id",
@@ -158,168 +211,358 @@ class ServiceQuote(models.Model):
         readonly=True,
     )
 
-    # Campos separados por rubro para evitar duplicación en tabs
+    # Campos separados por rubro para evitar duplicación en tabs.
+    # Son particiones calculadas de line_ids (ver LINE_PARTITIONS): una sola
+    # lectura de line_ids se reparte entre todas las pestañas y cada una solo
+    # trae las líneas del sitio actual, en lugar de una búsqueda con join por
+    # rubro_id.code por cada pestaña. La edición se aplica con el inverse.
     # Mano de Obra (todas) — se mantiene por compatibilidad
     line_ids_mano_obra = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'mano_obra')],
-        string='Líneas Mano de Obra')
-
-    # Mano de Obra por tipo de servicio (para filtrar correctamente en UI sin recargar)
+        'ccn.service.quote.line', string='Líneas Mano de Obra',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_mano_obra_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'mano_obra'), ('service_type', '=', 'jardineria')],
-        string='Líneas Mano de Obra — Jardinería')
-
+        'ccn.service.quote.line', string='Líneas Mano de Obra — Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_mano_obra_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'mano_obra'), ('service_type', '=', 'limpieza')],
-        string='Líneas Mano de Obra — Limpieza')
+        'ccn.service.quote.line', string='Líneas Mano de Obra — Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     # Uniforme (ambos servicios)
     line_ids_uniforme = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'uniforme')],
-        string='Líneas Uniforme')
+        'ccn.service.quote.line', string='Líneas Uniforme',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_uniforme_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'uniforme'), ('service_type', '=', 'jardineria')],
-        string='Líneas Uniforme — Jardinería')
+        'ccn.service.quote.line', string='Líneas Uniforme — Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_uniforme_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'uniforme'), ('service_type', '=', 'limpieza')],
-        string='Líneas Uniforme — Limpieza')
+        'ccn.service.quote.line', string='Líneas Uniforme — Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     # EPP (ambos servicios)
     line_ids_epp = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'epp')],
-        string='Líneas EPP')
+        'ccn.service.quote.line', string='Líneas EPP',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_epp_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'epp'), ('service_type', '=', 'jardineria')],
-        string='Líneas EPP — Jardinería')
+        'ccn.service.quote.line', string='Líneas EPP — Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_epp_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'epp'), ('service_type', '=', 'limpieza')],
-        string='Líneas EPP — Limpieza')
+        'ccn.service.quote.line', string='Líneas EPP — Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_epp_alturas = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'epp_alturas')],
-        string='Líneas EPP Alturas')
+        'ccn.service.quote.line', string='Líneas EPP Alturas',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_equipo_especial_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'equipo_especial_limpieza')],
-        string='Líneas Equipo Especial Limpieza')
+        'ccn.service.quote.line', string='Líneas Equipo Especial Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     # Comunicación y Cómputo (ambos servicios)
     line_ids_comunicacion_computo = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'comunicacion_computo')],
-        string='Líneas Comunicación y Cómputo')
+        'ccn.service.quote.line', string='Líneas Comunicación y Cómputo',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_comunicacion_computo_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'comunicacion_computo'), ('service_type', '=', 'jardineria')],
-        string='Líneas Comunicación y Cómputo — Jardinería')
+        'ccn.service.quote.line', string='Líneas Comunicación y Cómputo — Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_comunicacion_computo_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'comunicacion_computo'), ('service_type', '=', 'limpieza')],
-        string='Líneas Comunicación y Cómputo — Limpieza')
+        'ccn.service.quote.line', string='Líneas Comunicación y Cómputo — Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_herramienta_menor_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'herramienta_menor_jardineria')],
-        string='Líneas Herramienta Menor Jardinería')
+        'ccn.service.quote.line', string='Líneas Herramienta Menor Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_material_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'material_limpieza')],
-        string='Líneas Material Limpieza')
+        'ccn.service.quote.line', string='Líneas Material Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     # Perfil Médico (ambos servicios)
     line_ids_perfil_medico = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'perfil_medico')],
-        string='Líneas Perfil Médico')
+        'ccn.service.quote.line', string='Líneas Perfil Médico',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_perfil_medico_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'perfil_medico'), ('service_type', '=', 'jardineria')],
-        string='Líneas Perfil Médico — Jardinería')
+        'ccn.service.quote.line', string='Líneas Perfil Médico — Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_perfil_medico_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'perfil_medico'), ('service_type', '=', 'limpieza')],
-        string='Líneas Perfil Médico — Limpieza')
+        'ccn.service.quote.line', string='Líneas Perfil Médico — Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_maquinaria_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'maquinaria_limpieza')],
-        string='Líneas Maquinaria Limpieza')
+        'ccn.service.quote.line', string='Líneas Maquinaria Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_maquinaria_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'maquinaria_jardineria')],
-        string='Líneas Maquinaria Jardinería')
+        'ccn.service.quote.line', string='Líneas Maquinaria Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_fertilizantes_tierra_lama = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'fertilizantes_tierra_lama')],
-        string='Líneas Fertilizantes y Tierra Lama')
+        'ccn.service.quote.line', string='Líneas Fertilizantes y Tierra Lama',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_consumibles_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'consumibles_jardineria')],
-        string='Líneas Consumibles Jardinería')
+        'ccn.service.quote.line', string='Líneas Consumibles Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     # Capacitación (ambos servicios)
     line_ids_capacitacion = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'capacitacion')],
-        string='Líneas Capacitación')
+        'ccn.service.quote.line', string='Líneas Capacitación',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_capacitacion_jardineria = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'capacitacion'), ('service_type', '=', 'jardineria')],
-        string='Líneas Capacitación — Jardinería')
+        'ccn.service.quote.line', string='Líneas Capacitación — Jardinería',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
     line_ids_capacitacion_limpieza = fields.One2many(
-        'ccn.service.quote.line', 'quote_id',
-        domain=[('rubro_id.code', '=', 'capacitacion'), ('service_type', '=', 'limpieza')],
-        string='Líneas Capacitación — Limpieza')
+        'ccn.service.quote.line', string='Líneas Capacitación — Limpieza',
+        compute='_compute_line_partitions', inverse='_inverse_line_partitions')
 
 
     # Estados por rubro (filtrados por sitio/servicio/tipo actual)
-    rubro_state_mano_obra                 = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_uniforme                  = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_epp                       = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_epp_alturas               = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_equipo_especial_limpieza  = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_comunicacion_computo      = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_herramienta_menor_jardineria = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_material_limpieza         = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_perfil_medico             = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_maquinaria_limpieza       = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_maquinaria_jardineria     = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_fertilizantes_tierra_lama = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_consumibles_jardineria    = fields.Integer(compute="_compute_rubro_states", store=True)
-    rubro_state_capacitacion              = fields.Integer(compute="_compute_rubro_states", store=True)
+    # No almacenados: se derivan de la matriz de _ccn_rubro_state_matrix()
+    rubro_state_mano_obra                 = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_uniforme                  = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_epp                       = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_epp_alturas               = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_equipo_especial_limpieza  = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_comunicacion_computo      = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_herramienta_menor_jardineria = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_material_limpieza         = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_perfil_medico             = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_maquinaria_limpieza       = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_maquinaria_jardineria     = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_fertilizantes_tierra_lama = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_consumibles_jardineria    = fields.Integer(compute="_compute_rubro_states")
+    rubro_state_capacitacion              = fields.Integer(compute="_compute_rubro_states")
 
     # Estados por rubro y servicio específico (para vistas)
-    rubro_state_mano_obra_jard                 = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_uniforme_jard                  = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_epp_jard                       = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_epp_alturas_jard               = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_equipo_especial_limpieza_jard  = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_comunicacion_computo_jard      = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_herramienta_menor_jardineria_jard = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_material_limpieza_jard         = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_perfil_medico_jard             = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_maquinaria_limpieza_jard       = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_maquinaria_jardineria_jard     = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_fertilizantes_tierra_lama_jard = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_consumibles_jardineria_jard    = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_capacitacion_jard              = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-
-    rubro_state_mano_obra_limp                 = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_uniforme_limp                  = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_epp_limp                       = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_epp_alturas_limp               = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_equipo_especial_limpieza_limp  = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_comunicacion_computo_limp      = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_herramienta_menor_jardineria_limp = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_material_limpieza_limp         = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_perfil_medico_limp             = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_maquinaria_limpieza_limp       = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_maquinaria_jardineria_limp     = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_fertilizantes_tierra_lama_limp = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_consumibles_jardineria_limp    = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
-    rubro_state_capacitacion_limp              = fields.Integer(compute="_compute_rubro_states_per_service", store=True)
+    rubro_state_mano_obra_jard                 = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_uniforme_jard                  = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_epp_jard                       = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_epp_alturas_jard               = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_equipo_especial_limpieza_jard  = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_comunicacion_computo_jard      = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_herramienta_menor_jardineria_jard = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_material_limpieza_jard         = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_perfil_medico_jard             = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_maquinaria_limpieza_jard       = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_maquinaria_jardineria_jard     = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_fertilizantes_tierra_lama_jard = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_consumibles_jardineria_jard    = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_capacitacion_jard              = fields.Integer(compute="_compute_rubro_states_per_service")
+
+    rubro_state_mano_obra_limp                 = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_uniforme_limp                  = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_epp_limp                       = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_epp_alturas_limp               = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_equipo_especial_limpieza_limp  = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_comunicacion_computo_limp      = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_herramienta_menor_jardineria_limp = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_material_limpieza_limp         = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_perfil_medico_limp             = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_maquinaria_limpieza_limp       = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_maquinaria_jardineria_limp     = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_fertilizantes_tierra_lama_limp = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_consumibles_jardineria_limp    = fields.Integer(compute="_compute_rubro_states_per_service")
+    rubro_state_capacitacion_limp              = fields.Integer(compute="_compute_rubro_states_per_service")
+
+    # ----- Particiones de line_ids por pestaña -----
+    def _ccn_line_partitions(self):
+        """``{campo: líneas}`` del sitio y servicio actuales, repartiendo line_ids una vez.
+
+        Sin sitio o sin servicio no se filtra por ese eje. Las pestañas de la
+        vista solo muestran el sitio/servicio actual, así que el formulario no
+        serializa líneas de otros servicios.
+        """
+        self.ensure_one()
+        Line = self.env['ccn.service.quote.line']
+        site = self.current_site_id
+        service = self.current_service_type
+        by_key = {}
+        for line in self.line_ids:
+            if site and line.site_id != site:
+                continue
+            if service and line.service_type != service:
+                continue
+            code = line.rubro_code or line.rubro_id.code
+            by_key.setdefault((code, line.service_type), []).append(line)
+            by_key.setdefault((code, False), []).append(line)
+        return {
+            fname: Line.union(*by_key.get(key, ()))
+            for fname, key in LINE_PARTITIONS.items()
+        }
+
+    @api.depends('line_ids', 'line_ids.rubro_id', 'line_ids.rubro_code',
+                 'line_ids.service_type', 'line_ids.site_id', 'current_site_id', 'current_service_type')
+    def _compute_line_partitions(self):
+        for rec in self:
+            rec.update(rec._ccn_line_partitions())
+
+    def _ccn_partition_removals(self, vals):
+        """``{quote_id: ids}`` de las líneas quitadas en las pestañas según los comandos de ``vals``.
+
+        Se toman de los comandos recibidos y no de la partición vigente al
+        aplicar el inverso: ``write`` guarda antes current_site_id y
+        current_service_type, y la partición ya no contendría la línea quitada.
+        SET/CLEAR se resuelven contra lo que el cliente tenía cargado (sitio y
+        servicio previos al write).
+        """
+        fnames = [fname for fname in LINE_PARTITIONS if fname in vals]
+        removals = {}
+        for rec in self:
+            before = None
+            ids = set()
+            for fname in fnames:
+                commands = vals[fname] or []
+                if commands and all(isinstance(command, int) for command in commands):
+                    commands = [Command.set(commands)]
+                for command in commands:
+                    if command[0] in (Command.DELETE, Command.UNLINK):
+                        ids.add(command[1])
+                    elif command[0] in (Command.CLEAR, Command.SET):
+                        if before is None:
+                            before = rec._ccn_line_partitions()
+                        kept = set(command[2]) if command[0] == Command.SET else set()
+                        ids.update(set(before[fname].ids) - kept)
+            removals[rec.id] = tuple(ids)
+        return removals
+
+    def _inverse_line_partitions(self):
+        """Aplica a line_ids lo editado en las pestañas: crea las nuevas y elimina las quitadas.
+
+        Las modificaciones de líneas existentes ya se escriben directamente al
+        aplicar los comandos del one2many; las quitadas llegan en el contexto
+        ``ccn_partition_removals`` (ver ``_ccn_partition_removals``).
+        """
+        Line = self.env['ccn.service.quote.line']
+        Rubro = self.env['ccn.service.rubro']
+        removals = self.env.context.get('ccn_partition_removals') or {}
+        for rec in self:
+            to_unlink = rec.line_ids & Line.browse(removals.get(rec.id, ()))
+            vals_list = []
+            for fname, (code, service_type) in LINE_PARTITIONS.items():
+                lines = rec[fname]
+                for line in lines.filtered(lambda l: not l.id):
+                    vals = line._convert_to_write({
+                        name: line[name] for name in line._cache
+                        if line._fields[name].store and not line._fields[name].readonly
+                    })
+                    vals['quote_id'] = rec.id
+                    if not vals.get('site_id') and rec.current_site_id:
+                        vals['site_id'] = rec.current_site_id.id
+                    if service_type and not vals.get('service_type'):
+                        vals['service_type'] = service_type
+                    if not vals.get('rubro_id'):
+                        vals['rubro_id'] = Rubro.search([('code', '=', code)], limit=1).id
+                    vals_list.append(vals)
+            if to_unlink:
+                to_unlink.unlink()
+            if vals_list:
+                Line.create(vals_list)
+        self.invalidate_recordset(['line_ids', *LINE_PARTITIONS])
+
+    # ----- Matriz de estados por (sitio, servicio, rubro) -----
+    # 0 = sin datos (rojo), 1 = con líneas (verde), 2 = "No aplica" (ámbar)
+    def _ccn_rubro_state_rows(self):
+        """Filas de estado por cotización: ``{quote_id: [(site_id, service_type, rubro_code, line_count, is_ack)]}``.
+
+        Las cotizaciones guardadas leen la tabla ccn.service.quote.rubro.state
+        (mantenida de forma incremental por líneas y ACKs); las que están en
+        memoria (onchange) agrupan line_ids/ack_ids del caché para reflejar de
+        inmediato las líneas aún no guardadas.
+        """
+        rows = {rec.id: [] for rec in self}
+        saved = self.filtered(lambda r: isinstance(r.id, int))
+        if saved:
+            self.env.cr.execute("""
+                SELECT quote_id, site_id, service_type, rubro_code, line_count, is_ack
+                  FROM ccn_service_quote_rubro_state
+                 WHERE quote_id = ANY(%s) AND (line_count > 0 OR is_ack)
+            """, [saved.ids])
+            for quote_id, *row in self.env.cr.fetchall():
+                rows[quote_id].append(tuple(row))
+
+        for rec in self - saved:
+            counts = Counter()
+            acks = set()
+            for line in rec.line_ids:
+                code = line.rubro_code or line.rubro_id.code
+                if code:
+                    counts[(line.site_id.id, line.service_type, code)] += 1
+            for ack in rec.ack_ids:
+                if ack.is_empty and ack.rubro_code:
+                    acks.add((ack.site_id.id, ack.service_type, ack.rubro_code))
+            rows[rec.id] = [key + (counts.get(key, 0), key in acks) for key in set(counts) | acks]
+        return rows
+
+    @staticmethod
+    def _ccn_count_rows(quote_rows, site_id=False, service_type=False):
+        """Counter ``{rubro_code: líneas}`` de las filas de estado de un sitio/servicio.
+
+        Sin sitio o sin servicio no se filtra por ese eje. El costo depende del
+        número de filas (sitios × servicios × rubros), no del número de líneas.
+        """
+        counts = Counter()
+        for row_site_id, row_service_type, code, line_count, _is_ack in quote_rows:
+            if (not site_id or row_site_id == site_id) and \
+                    (not service_type or row_service_type == service_type):
+                counts[code] += line_count
+        return counts
+
+    def _ccn_rubro_state_matrix(self):
+        """Matriz de estados de rubro para todas las cotizaciones de ``self``.
+
+        Devuelve ``{quote_id: {site_id: {service_type: {rubro_code: estado}}}}``
+        con solo los estados distintos de 0; las líneas (1) prevalecen sobre
+        el ACK (2).
+        """
+        matrix = {rec.id: {} for rec in self}
+        for quote_id, quote_rows in self._ccn_rubro_state_rows().items():
+            for site_id, service_type, code, line_count, is_ack in quote_rows:
+                state = 1 if line_count else 2 if is_ack else 0
+                if state:
+                    matrix[quote_id].setdefault(site_id or False, {}) \
+                        .setdefault(service_type or False, {})[code] = state
+        return matrix
+
+    def get_rubro_state_matrix(self):
+        """API para las pestañas: matriz por sitio con claves serializables.
+
+        ``{quote_id: {site_id: {service_type: {rubro_code: estado}}}}``; la
+        ausencia de un rubro significa estado 0 (sin datos).
+        """
+        return {
+            quote_id: {
+                site_id: {srv or '': codes for srv, codes in by_srv.items()}
+                for site_id, by_srv in by_site.items()
+            }
+            for quote_id, by_site in self._ccn_rubro_state_matrix().items()
+        }
+
+    @api.depends('site_ids.is_general')
+    def _compute_general_site_id(self):
+        saved = self.filtered(lambda r: isinstance(r.id, int))
+        by_quote = {}
+        if saved:
+            # Incluye el 'General' archivado (get_or_create_general lo reactiva)
+            for site in self.env['ccn.service.quote.site'].with_context(active_test=False).search(
+                    [('quote_id', 'in', saved.ids), ('is_general', '=', True)]):
+                by_quote.setdefault(site.quote_id.id, site)
+        for rec in self:
+            if rec in saved:
+                rec.general_site_id = by_quote.get(rec.id, False)
+            else:
+                rec.general_site_id = rec.site_ids.filtered('is_general')[:1]
+
+    def _ccn_state_site_id(self):
+        """Sitio usado para pintar las pestañas: actual, si no 'General', si no el primero."""
+        self.ensure_one()
+        sid = self.current_site_id.id if self.current_site_id else False
+        if not sid and self.site_ids:
+            gen = self.general_site_id.filtered('active')
+            sid = (gen[:1].id if gen else self.site_ids[:1].id) or False
+        return sid
+
+    @staticmethod
+    def _ccn_site_states(quote_states, site_id):
+        """{service_type: {rubro_code: estado}} de un sitio.
+
+        Sin sitio se consideran las líneas de todos los sitios (los ACK
+        siempre son por sitio).
+        """
+        if site_id:
+            return quote_states.get(site_id, {})
+        merged = {}
+        for by_srv in quote_states.values():
+            for srv, codes in by_srv.items():
+                for code, state in codes.items():
+                    if state == 1:
+                        merged.setdefault(srv, {})[code] = 1
+        return merged
 
     @api.depends(
         'line_ids', 'line_ids.rubro_id', 'line_ids.rubro_code',
@@ -329,58 +572,19 @@ class ServiceQuote(models.Model):
         'ack_ids', 'ack_ids.site_id', 'ack_ids.service_type', 'ack_ids.rubro_code', 'ack_ids.is_empty'
     )
     def _compute_rubro_states(self):
-        def _site_for_compute(rec):
-            sid = rec.current_site_id.id if rec.current_site_id else False
-            if not sid and rec.site_ids:
-                gen = rec.site_ids.filtered(lambda s: (s.name or '').strip().lower() == 'general')
-                sid = (gen[:1].id if gen else rec.site_ids[:1].id) or False
-            return sid
-
+        matrix = self._ccn_rubro_state_matrix()
         for rec in self:
-            site_id = _site_for_compute(rec)
-
-            # Conjuntos de códigos por líneas guardadas en el sitio
-            line_codes_site = set()
-            if rec.line_ids:
-                for l in rec.line_ids:
-                    try:
-                        # Considerar también líneas en memoria (no guardadas) para reflejar
-                        # estado VERDE inmediatamente en UI tras cambiar de servicio.
-                        if site_id and (not l.site_id or l.site_id.id != site_id):
-                            continue
-                        code = getattr(l, 'rubro_code', False) or getattr(l.rubro_id, 'code', False)
-                        if code:
-                            line_codes_site.add(code)
-                    except Exception:
-                        continue
-
-            # Conjunto de ACKs por código (cualquier servicio) en el sitio
-            ack_codes_any = set()
-            if site_id and rec.ack_ids:
-                for a in rec.ack_ids:
-                    try:
-                        if a.site_id and a.site_id.id == site_id and a.is_empty and a.rubro_code:
-                            ack_codes_any.add(a.rubro_code)
-                    except Exception:
-                        continue
-
-            def state_for_code(code):
-                return 1 if code in line_codes_site else (2 if code in ack_codes_any else 0)
-
-            rec.rubro_state_mano_obra                 = state_for_code('mano_obra')
-            rec.rubro_state_uniforme                  = state_for_code('uniforme')
-            rec.rubro_state_epp                       = state_for_code('epp')
-            rec.rubro_state_epp_alturas               = state_for_code('epp_alturas')
-            rec.rubro_state_equipo_especial_limpieza  = state_for_code('equipo_especial_limpieza')
-            rec.rubro_state_comunicacion_computo      = state_for_code('comunicacion_computo')
-            rec.rubro_state_herramienta_menor_jardineria = state_for_code('herramienta_menor_jardineria')
-            rec.rubro_state_material_limpieza         = state_for_code('material_limpieza')
-            rec.rubro_state_perfil_medico             = state_for_code('perfil_medico')
-            rec.rubro_state_maquinaria_limpieza       = state_for_code('maquinaria_limpieza')
-            rec.rubro_state_maquinaria_jardineria     = state_for_code('maquinaria_jardineria')
-            rec.rubro_state_fertilizantes_tierra_lama = state_for_code('fertilizantes_tierra_lama')
-            rec.rubro_state_consumibles_jardineria    = state_for_code('consumibles_jardineria')
-            rec.rubro_state_capacitacion              = state_for_code('capacitacion')
+            site_states = self._ccn_site_states(matrix[rec.id], rec._ccn_state_site_id())
+            # Estado genérico: verde si algún servicio del sitio tiene líneas,
+            # ámbar si alguno lo marcó "No aplica"
+            rec.update({
+                f'rubro_state_{code}': (
+                    1 if any(codes.get(code) == 1 for codes in site_states.values())
+                    else 2 if any(codes.get(code) == 2 for codes in site_states.values())
+                    else 0
+                )
+                for code, _label in RUBRO_CODES
+            })
 
     @api.depends(
         'line_ids', 'line_ids.rubro_id', 'line_ids.rubro_code',
@@ -389,81 +593,20 @@ class ServiceQuote(models.Model):
         'ack_ids', 'ack_ids.site_id', 'ack_ids.service_type', 'ack_ids.rubro_code', 'ack_ids.is_empty'
     )
     def _compute_rubro_states_per_service(self):
-        def _site_for_compute(rec):
-            sid = rec.current_site_id.id if rec.current_site_id else False
-            if not sid and rec.site_ids:
-                gen = rec.site_ids.filtered(lambda s: (s.name or '').strip().lower() == 'general')
-                sid = (gen[:1].id if gen else rec.site_ids[:1].id) or False
-            return sid
-
+        matrix = self._ccn_rubro_state_matrix()
         for rec in self:
-            site_id = _site_for_compute(rec)
-
-            # Conjuntos de códigos por servicio con líneas guardadas en el sitio
-            line_codes_by_srv = {'jardineria': set(), 'limpieza': set()}
-            if rec.line_ids:
-                for l in rec.line_ids:
-                    try:
-                        # Incluir también líneas no guardadas para que el pintado sea inmediato
-                        # al alternar de servicio sin necesidad de visitar cada pestaña.
-                        if site_id and (not l.site_id or l.site_id.id != site_id):
-                            continue
-                        code = getattr(l, 'rubro_code', False) or getattr(l.rubro_id, 'code', False)
-                        st = getattr(l, 'service_type', False)
-                        if code and st in line_codes_by_srv:
-                            line_codes_by_srv[st].add(code)
-                    except Exception:
-                        continue
-
-            # Conjuntos de ACKs por servicio en el sitio
-            ack_codes_by_srv = {'jardineria': set(), 'limpieza': set()}
-            if site_id and rec.ack_ids:
-                for a in rec.ack_ids:
-                    try:
-                        if a.site_id and a.site_id.id == site_id and a.is_empty and a.service_type in ack_codes_by_srv and a.rubro_code:
-                            ack_codes_by_srv[a.service_type].add(a.rubro_code)
-                    except Exception:
-                        continue
-
-            def state_for_service(code, service_type):
-                has_lines = code in line_codes_by_srv.get(service_type, set())
-                has_ack = code in ack_codes_by_srv.get(service_type, set())
-                return 1 if has_lines else (2 if has_ack else 0)
-
-            # Jardinería
-            rec.rubro_state_mano_obra_jard                 = state_for_service('mano_obra', 'jardineria')
-            rec.rubro_state_uniforme_jard                  = state_for_service('uniforme', 'jardineria')
-            rec.rubro_state_epp_jard                       = state_for_service('epp', 'jardineria')
-            rec.rubro_state_epp_alturas_jard               = state_for_service('epp_alturas', 'jardineria')
-            rec.rubro_state_equipo_especial_limpieza_jard  = state_for_service('equipo_especial_limpieza', 'jardineria')
-            rec.rubro_state_comunicacion_computo_jard      = state_for_service('comunicacion_computo', 'jardineria')
-            rec.rubro_state_herramienta_menor_jardineria_jard = state_for_service('herramienta_menor_jardineria', 'jardineria')
-            rec.rubro_state_material_limpieza_jard         = state_for_service('material_limpieza', 'jardineria')
-            rec.rubro_state_perfil_medico_jard             = state_for_service('perfil_medico', 'jardineria')
-            rec.rubro_state_maquinaria_limpieza_jard       = state_for_service('maquinaria_limpieza', 'jardineria')
-            rec.rubro_state_maquinaria_jardineria_jard     = state_for_service('maquinaria_jardineria', 'jardineria')
-            rec.rubro_state_fertilizantes_tierra_lama_jard = state_for_service('fertilizantes_tierra_lama', 'jardineria')
-            rec.rubro_state_consumibles_jardineria_jard    = state_for_service('consumibles_jardineria', 'jardineria')
-            rec.rubro_state_capacitacion_jard              = state_for_service('capacitacion', 'jardineria')
-
-            # Limpieza
-            rec.rubro_state_mano_obra_limp                 = state_for_service('mano_obra', 'limpieza')
-            rec.rubro_state_uniforme_limp                  = state_for_service('uniforme', 'limpieza')
-            rec.rubro_state_epp_limp                       = state_for_service('epp', 'limpieza')
-            rec.rubro_state_epp_alturas_limp               = state_for_service('epp_alturas', 'limpieza')
-            rec.rubro_state_equipo_especial_limpieza_limp  = state_for_service('equipo_especial_limpieza', 'limpieza')
-            rec.rubro_state_comunicacion_computo_limp      = state_for_service('comunicacion_computo', 'limpieza')
-            rec.rubro_state_herramienta_menor_jardineria_limp = state_for_service('herramienta_menor_jardineria', 'limpieza')
-            rec.rubro_state_material_limpieza_limp         = state_for_service('material_limpieza', 'limpieza')
-            rec.rubro_state_perfil_medico_limp             = state_for_service('perfil_medico', 'limpieza')
-            rec.rubro_state_maquinaria_limpieza_limp       = state_for_service('maquinaria_limpieza', 'limpieza')
-            rec.rubro_state_maquinaria_jardineria_limp     = state_for_service('maquinaria_jardineria', 'limpieza')
-            rec.rubro_state_fertilizantes_tierra_lama_limp = state_for_service('fertilizantes_tierra_lama', 'limpieza')
-            rec.rubro_state_consumibles_jardineria_limp    = state_for_service('consumibles_jardineria', 'limpieza')
-            rec.rubro_state_capacitacion_limp              = state_for_service('capacitacion', 'limpieza')
+            site_states = self._ccn_site_states(matrix[rec.id], rec._ccn_state_site_id())
+            jard = site_states.get('jardineria', {})
+            limp = site_states.get('limpieza', {})
+            vals = {}
+            for code, _label in RUBRO_CODES:
+                vals[f'rubro_state_{code}_jard'] = jard.get(code, 0)
+                vals[f'rubro_state_{code}_limp'] = limp.get(code, 0)
+            rec.update(vals)
 
     # ACK granular
     def _ensure_ack(self, rubro_code, value):
+        entries = []
         for rec in self:
             if not (rec.current_service_type and rubro_code):
                 continue
@@ -475,27 +618,33 @@ class ServiceQuote(models.Model):
                     site = self.env['ccn.service.quote.site'].browse(sid)
             except Exception:
                 site = rec.current_site_id
-
-            # Usar sudo() y context para evitar disparar constraints innecesarios
-            # al crear/modificar ACKs (evita error de validación de unicidad en cotización)
-            AckModel = self.env['ccn.service.quote.ack'].sudo().with_context(skip_quote_constraints=True)
-
-            ack = AckModel.search([
-                ('quote_id', '=', rec.id),
-                ('site_id', '=', site.id if site else False),
-                ('service_type', '=', rec.current_service_type),
-                ('rubro_code', '=', rubro_code),
-            ], limit=1)
-            if ack:
-                ack.write({'is_empty': bool(value)})
-            else:
-                AckModel.create({
-                    'quote_id': rec.id,
-                    'site_id': site.id if site else False,
-                    'service_type': rec.current_service_type,
-                    'rubro_code': rubro_code,
-                    'is_empty': bool(value),
-                })
+            if site:
+                entries.append((rec.id, site.id, rec.current_service_type, rubro_code, value))
+        # Un solo upsert (sin search + create/write por rubro ni constraints de la cotización)
+        self.env['ccn.service.quote.ack'].sudo()._ccn_upsert(entries)
+
+    def set_rubro_acks(self, matrix, value=True):
+        """API masiva de "No aplica": marca/desmarca ACKs en una sola llamada.
+
+        ``matrix`` es ``{site_id: {service_type: [rubro_code, ...]}}`` (mismo
+        formato que get_rubro_state_matrix); los sitios deben pertenecer a
+        estas cotizaciones. Todos los ACKs se escriben con un solo upsert.
+        Devuelve el número de ACKs escritos.
+        """
+        # El upsert es SQL directo: validar aquí el acceso de escritura
+        self.check_access('write')
+        sites = self.env['ccn.service.quote.site'].with_context(active_test=False).browse(
+            [int(site_id) for site_id in matrix]).exists()
+        quote_of = {site.id: site.quote_id.id for site in sites}
+        if set(quote_of.values()) - set(self.ids) or len(sites) != len(matrix):
+            raise UserError(_("Los sitios indicados no pertenecen a las cotizaciones seleccionadas."))
+        entries = [
+            (quote_of[int(site_id)], int(site_id), service_type, code, value)
+            for site_id, by_srv in matrix.items()
+            for service_type, codes in by_srv.items()
+            for code in codes
+        ]
+        return self.env['ccn.service.quote.ack']._ccn_upsert(entries)
 
     def action_mark_rubro_empty(self):
         self.ensure_one()
@@ -519,22 +668,9 @@ class ServiceQuote(models.Model):
 
     # Botón para garantizar/crear Sitio "General"
     def action_ensure_general(self):
-        Site = self.env['ccn.service.quote.site'].with_context(active_test=False)
+        general_ids = self.env['ccn.service.quote.site']._ccn_general_site_ids(self.ids)
         for quote in self:
-            general = Site.search([
-                ('quote_id', '=', quote.id),
-                ('name', '=ilike', 'general'),
-            ], limit=1)
-            if general:
-                general.write({'active': True, 'sequence': -999})
-            else:
-                general = Site.create({
-                    'quote_id': quote.id,
-                    'name': 'General',
-                    'active': True,
-                    'sequence': -999,
-                })
-            quote.current_site_id = general.id
+            quote.current_site_id = general_ids[quote.id]
         return True
 
     # Dispara client action JS que abre el selector de productos (sin wizard puente)
@@ -591,12 +727,9 @@ class ServiceQuote(models.Model):
     @api.onchange('current_service_type')
     def _onchange_current_service_type(self):
         for quote in self:
+            # Los rubro_state_* no se almacenan y dependen de current_service_type:
+            # se recalculan solos, sin escribir ni forzar tab_update_trigger.
             quote.current_type = 'material' if quote.current_service_type == 'materiales' else 'servicio'
-            # Forzar recomputo de estados para actualizar colores
-            quote._compute_rubro_states()
-            quote._compute_rubro_states_per_service()
-            # Forzar trigger del JavaScript para que lea los nuevos campos
-            quote.tab_update_trigger = int(time.time())
 
     @api.depends('site_ids', 'site_ids.active', 'site_ids.name')
     def _compute_site_count(self):
@@ -609,13 +742,44 @@ class ServiceQuote(models.Model):
 
     def _make_unique_name(self, partner_id, desired_name):
         """Return a name unique per partner by appending a numeric suffix if needed."""
-        base = (desired_name or '').strip() or self.env._('Nueva Cotización')
-        name = base
-        i = 1
-        while self.search_count([('partner_id', '=', partner_id), ('name', '=', name)]):
-            i += 1
-            name = f"{base} ({i})"
-        return name
+        return self._make_unique_names([(partner_id, desired_name)])[0]
+
+    def _make_unique_names(self, requests):
+        """Batch version of _make_unique_name for ``[(partner_id, desired_name)]``.
+
+        One query fetches every existing ``base`` / ``base (n)`` name of the
+        partners involved; each request gets the base if free, otherwise the
+        smallest free suffix. Names handed out earlier in the same batch count
+        as taken.
+        """
+        default = self.env._('Nueva Cotización')
+        requests = [(pid, (desired or '').strip() or default) for pid, desired in requests]
+        taken = {}
+        wanted = {(pid, base) for pid, base in requests if pid}
+        if wanted:
+            self.flush_model(['partner_id', 'name'])
+            partner_ids, bases = zip(*wanted)
+            self.env.cr.execute("""
+                SELECT t.partner_id, t.base, q.name
+                  FROM unnest(%s::int[], %s::varchar[]) AS t(partner_id, base)
+                  JOIN ccn_service_quote q
+                    ON q.partner_id = t.partner_id
+                   AND (q.name = t.base OR left(q.name, length(t.base) + 2) = t.base || ' (')
+            """, [list(partner_ids), list(bases)])
+            for pid, base, name in self.env.cr.fetchall():
+                taken.setdefault((pid, base), set()).add(name)
+
+        names = []
+        for pid, base in requests:
+            used = taken.setdefault((pid, base), set())
+            name = base
+            i = 1
+            while name in used:
+                i += 1
+                name = f"{base} ({i})"
+            used.add(name)
+            names.append(name)
+        return names
 
     @api.model_create_multi
     def create(self, vals_list):
@@ -623,14 +787,14 @@ class ServiceQuote(models.Model):
         for vals in vals_list:
             if not vals.get('site_ids'):
                 vals['site_ids'] = self._default_site_ids()
-            try:
-                pid = vals.get('partner_id') or None
-                nm = vals.get('name')
-                if pid:
-                    vals['name'] = self._make_unique_name(pid, nm)
-            except Exception:
-                # En caso de no poder garantizar unicidad aquí, dejar que el constraint actúe
-                pass
+        try:
+            named = [vals for vals in vals_list if vals.get('partner_id')]
+            names = self._make_unique_names([(vals['partner_id'], vals.get('name')) for vals in named])
+            for vals, name in zip(named, names):
+                vals['name'] = name
+        except Exception:
+            # En caso de no poder garantizar unicidad aquí, dejar que el constraint actúe
+            pass
 
         quotes = super().create(vals_list)
         for quote in quotes:
@@ -641,29 +805,6 @@ class ServiceQuote(models.Model):
                 quote.current_site_id.write({'quote_id': quote.id})
         return quotes
 
-    # Usado por data/migrate_fix_general.xml
-    @api.model
-    def _fix_general_sites(self, limit=100000):
-        Site = self.env['ccn.service.quote.site'].with_context(active_test=False)
-        quotes = self.search([], limit=limit)
-        for q in quotes:
-            general = Site.search([
-                ('quote_id', '=', q.id),
-                ('name', '=ilike', 'general'),
-            ], limit=1)
-            if general:
-                general.write({'active': True, 'sequence': -999})
-            else:
-                general = Site.create({
-                    'quote_id': q.id,
-                    'name': 'General',
-                    'active': True,
-                    'sequence': -999,
-                })
-            if not q.current_site_id:
-                q.write({'current_site_id': general.id})
-        return True
-
     def write(self, vals):
         # Evitar disparar constraint SQL de unicidad cuando los valores no cambian
         # Esto previene errores al crear/modificar ACKs que actualizan ack_ids
@@ -689,19 +830,68 @@ class ServiceQuote(models.Model):
                     vals = dict(vals)
                     vals['name'] = self._make_unique_name(vals['partner_id'], vals['name'])
 
-        res = super().write(vals)
+        # Cambiar a un sitio que ya es el actual no debe escribir nada
+        if 'current_site_id' in vals and all(
+            rec.current_site_id.id == (vals['current_site_id'] or False) for rec in self
+        ):
+            vals = dict(vals)
+            del vals['current_site_id']
+            if not vals:
+                return True
+
+        records = self
+        if any(fname in vals for fname in LINE_PARTITIONS):
+            records = self.with_context(ccn_partition_removals=self._ccn_partition_removals(vals))
+        res = super(ServiceQuote, records).write(vals)
         # Si se cambió current_site_id y el sitio no tiene quote_id, enlazarlo
         if 'current_site_id' in vals:
             for rec in self:
                 site = rec.current_site_id
                 if site and not site.quote_id:
                     site.write({'quote_id': rec.id})
-                # Mantener flags de is_current sincronizados SIEMPRE
-                if site:
-                    (rec.site_ids - site).with_context(ccn_syncing_current_site=True).write({'is_current': False})
-                    site.with_context(ccn_syncing_current_site=True).write({'is_current': True})
+            # Mantener flags de is_current sincronizados SIEMPRE
+            self._ccn_sync_current_site_flags()
         return res
 
+    def _ccn_sync_current_site_flags(self):
+        """Deja is_current solo en current_site_id, escribiendo únicamente los sitios que cambian."""
+        Site = self.env['ccn.service.quote.site'].with_context(ccn_syncing_current_site=True)
+        to_clear = Site
+        to_set = Site
+        for rec in self:
+            site = rec.current_site_id
+            if not site:
+                continue
+            to_clear |= rec.site_ids.filtered(lambda s: s.is_current and s != site)
+            if not site.is_current:
+                to_set |= site
+        if to_clear:
+            to_clear.write({'is_current': False})
+        if to_set:
+            to_set.write({'is_current': True})
+
+    def get_site_rubro_states(self, site_id=None, service_type=None):
+        """API de cambio de sitio: estados y contadores de un sitio/servicio sin escribir.
+
+        Devuelve ``{'states': {rubro_code: estado}, 'counts': {rubro_code: líneas}}``
+        para ``site_id`` (por defecto el sitio actual) y ``service_type`` (sin
+        servicio se usa el estado genérico: líneas en cualquier servicio
+        prevalecen sobre "No aplica"). Pensado para que el cliente pinte las
+        pestañas de otro sitio sin modificar current_site_id.
+        """
+        self.ensure_one()
+        site_id = site_id or self._ccn_state_site_id()
+        site_states = self._ccn_site_states(self._ccn_rubro_state_matrix()[self.id], site_id)
+        states = {}
+        for code, _label in RUBRO_CODES:
+            if service_type:
+                states[code] = site_states.get(service_type, {}).get(code, 0)
+            else:
+                values = {codes.get(code) for codes in site_states.values()}
+                states[code] = 1 if 1 in values else 2 if 2 in values else 0
+        counts = self._ccn_count_rows(self._ccn_rubro_state_rows()[self.id], site_id, service_type)
+        return {'states': states, 'counts': dict(counts)}
+
     @api.onchange('site_ids', 'site_ids.is_current')
     def _onchange_site_ids_current_flag(self):
         for quote in self:
@@ -727,6 +917,37 @@ class ServiceQuote(models.Model):
             if current_sites:
                 quote.current_site_id = current_sites[0]
 
+    # === Totales agregados de líneas (SUM en SQL sobre importes almacenados) ===
+    def _ccn_read_line_totals(self, groupby=()):
+        """Agrupa las líneas guardadas de estas cotizaciones con un solo _read_group.
+
+        ``groupby`` son campos de ccn.service.quote.line además de quote_id
+        (p. ej. ``['site_id', 'rubro_code']``). Devuelve
+        ``{(quote_id, *claves): {'count', 'quantity', 'monthly_subtotal',
+        'mo_prestaciones', 'total_price', 'amount_tax'}}`` donde los many2one se
+        reducen a su id.
+        """
+        quote_ids = [qid for qid in self.ids if isinstance(qid, int)]
+        if not quote_ids:
+            return {}
+        groupby = ['quote_id'] + list(groupby)
+        aggregates = ['__count', 'quantity:sum', 'monthly_subtotal:sum',
+                      'mo_prestaciones:sum', 'total_price:sum', 'amount_tax:sum']
+        res = {}
+        for row in self.env['ccn.service.quote.line']._read_group(
+                [('quote_id', 'in', quote_ids)], groupby, aggregates):
+            keys = tuple(k.id if isinstance(k, models.BaseModel) else k for k in row[:len(groupby)])
+            count, qty, monthly, prest, total, tax = row[len(groupby):]
+            res[keys] = {
+                'count': count,
+                'quantity': qty or 0.0,
+                'monthly_subtotal': monthly or 0.0,
+                'mo_prestaciones': prest or 0.0,
+                'total_price': total or 0.0,
+                'amount_tax': tax or 0.0,
+            }
+        return res
+
     # === Utilidad: versión instalada del módulo ===
     @api.depends()
     def _compute_module_version(self):
@@ -743,6 +964,52 @@ class ServiceQuote(models.Model):
     # FLUJO DE AUTORIZACIÓN
     # ============================================
 
+    def _ccn_auth_debug(self):
+        """Switch de diagnóstico de autorización: contexto ``ccn_debug_auth`` o
+        parámetro de sistema ``ccn_service_quote.debug_authorization``."""
+        return bool(
+            self.env.context.get('ccn_debug_auth')
+            or self.env['ir.config_parameter'].sudo().get_param('ccn_service_quote.debug_authorization')
+        )
+
+    def _ccn_authorization_matrix(self):
+        """Rubros faltantes por servicio activo, en una sola pasada sobre las filas de estado.
+
+        Devuelve ``{quote_id: {service_type: rubros_faltantes}}``. Un servicio es
+        activo si algún rubro tiene líneas o ACK; un rubro está completo si
+        tiene líneas (verde) o ACK (ámbar). Una cotización sin servicios
+        activos devuelve ``{}``.
+        """
+        all_codes = {code for code, _label in RUBRO_CODES}
+        res = {}
+        for quote_id, quote_rows in self._ccn_rubro_state_rows().items():
+            # Rubros completos (líneas o ACK) por servicio, todos los sitios
+            completos = {}
+            for _site_id, service_type, code, line_count, is_ack in quote_rows:
+                if service_type and (line_count or is_ack):
+                    completos.setdefault(service_type, set()).add(code)
+            # Si no hay rubros definidos para el servicio se exigen todos
+            res[quote_id] = {
+                servicio: (RUBROS_POR_SERVICIO.get(servicio) or all_codes) - codes
+                for servicio, codes in completos.items()
+            }
+        return res
+
+    def get_authorization_missing_rubros(self):
+        """API (UI): rubros que impiden solicitar autorización.
+
+        ``{quote_id: {service_type: [rubro_code, ...]}}`` solo con los servicios
+        activos incompletos, rubros en el orden del catálogo.
+        """
+        order = {code: idx for idx, (code, _label) in enumerate(RUBRO_CODES)}
+        return {
+            quote_id: {
+                servicio: sorted(missing, key=lambda c: order.get(c, len(order)))
+                for servicio, missing in by_srv.items() if missing
+            }
+            for quote_id, by_srv in self._ccn_authorization_matrix().items()
+        }
+
     @api.depends('line_ids', 'line_ids.service_type', 'line_ids.rubro_code',
                  'ack_ids', 'ack_ids.service_type', 'ack_ids.rubro_code', 'ack_ids.is_empty', 'state')
     def _compute_can_request_authorization(self):
@@ -750,73 +1017,16 @@ class ServiceQuote(models.Model):
         Verifica si todos los tabs activos están completos (verde o ámbar).
         Un servicio se considera inactivo si TODOS sus rubros están en rojo.
         """
+        drafts = self.filtered(lambda r: r.state == 'draft')
+        matrix = drafts._ccn_authorization_matrix() if drafts else {}
+        debug = self._ccn_auth_debug()
         for rec in self:
-            _logger.info(f"[AUTH] Computing authorization for quote {rec.id} (state={rec.state})")
-
-            # Solo en estado borrador se puede solicitar autorización
-            if rec.state != 'draft':
-                rec.can_request_authorization = False
-                _logger.info(f"[AUTH] Quote {rec.id}: state is not draft, can_request=False")
-                continue
-
-            # Obtener servicios activos con al menos una línea o ACK
-            servicios_activos = set()
-            for line in rec.line_ids:
-                if line.service_type:
-                    servicios_activos.add(line.service_type)
-            for ack in rec.ack_ids:
-                if ack.service_type and ack.is_empty:
-                    servicios_activos.add(ack.service_type)
-
-            _logger.info(f"[AUTH] Quote {rec.id}: servicios_activos={servicios_activos}")
-
-            # Si no hay servicios activos, no se puede solicitar autorización
-            if not servicios_activos:
-                rec.can_request_authorization = False
-                _logger.info(f"[AUTH] Quote {rec.id}: no active services, can_request=False")
-                continue
-
-            # Verificar que cada servicio activo tenga todos sus rubros completos
-            # Un rubro está completo si tiene líneas (verde) o ACK (ámbar)
-            all_complete = True
-            for servicio in servicios_activos:
-                # Obtener rubros con datos para este servicio
-                rubros_con_lineas = set()
-                rubros_con_ack = set()
-
-                for line in rec.line_ids.filtered(lambda l: l.service_type == servicio):
-                    if line.rubro_code:
-                        rubros_con_lineas.add(line.rubro_code)
-
-                for ack in rec.ack_ids.filtered(lambda a: a.service_type == servicio and a.is_empty):
-                    if ack.rubro_code:
-                        rubros_con_ack.add(ack.rubro_code)
-
-                # Rubros que aplican para este tipo de servicio
-                rubros_requeridos = RUBROS_POR_SERVICIO.get(servicio, set())
-
-                # Si no hay rubros definidos para este servicio, usar todos
-                if not rubros_requeridos:
-                    rubros_requeridos = {code for code, _ in RUBRO_CODES}
-
-                # Verificar si hay al menos un rubro sin completar (sin líneas ni ACK)
-                rubros_completos = rubros_con_lineas | rubros_con_ack
-                rubros_incompletos = rubros_requeridos - rubros_completos
-
-                _logger.info(f"[AUTH] Quote {rec.id}, servicio {servicio}: "
-                           f"rubros_requeridos={rubros_requeridos}, "
-                           f"rubros_con_lineas={rubros_con_lineas}, "
-                           f"rubros_con_ack={rubros_con_ack}, "
-                           f"rubros_incompletos={rubros_incompletos}")
-
-                # Si hay rubros incompletos, este servicio no está completo
-                if rubros_incompletos:
-                    all_complete = False
-                    _logger.info(f"[AUTH] Quote {rec.id}, servicio {servicio}: INCOMPLETO")
-                    break
-
-            rec.can_request_authorization = all_complete
-            _logger.info(f"[AUTH] Quote {rec.id}: FINAL can_request_authorization={all_complete}")
+            # Solo en estado borrador y con al menos un servicio activo
+            by_srv = matrix.get(rec.id)
+            rec.can_request_authorization = bool(by_srv) and not any(by_srv.values())
+            if debug:
+                _logger.info("[AUTH] Quote %s (state=%s): faltantes=%s, can_request=%s",
+                             rec.id, rec.state, by_srv, rec.can_request_authorization)
 
     @api.depends()
     def _compute_is_authorizer(self):
@@ -833,7 +1043,14 @@ class ServiceQuote(models.Model):
             raise UserError(_('Solo se pueden solicitar autorización de cotizaciones en estado Borrador.'))
 
         if not self.can_request_authorization:
-            raise UserError(_('No se puede solicitar autorización. Asegúrese de que todos los servicios activos tengan todos sus rubros completos.'))
+            missing = self.get_authorization_missing_rubros().get(self.id) or {}
+            labels = dict(RUBRO_CODES)
+            srv_labels = dict(self._fields['current_service_type'].selection)
+            detail = ''.join(
+                '\n- %s: %s' % (srv_labels.get(srv, srv), ', '.join(labels.get(c, c) for c in codes))
+                for srv, codes in missing.items()
+            )
+            raise UserError(_('No se puede solicitar autorización. Asegúrese de que todos los servicios activos tengan todos sus rubros completos.') + detail)
 
         # Cambiar estado a pendiente
         self.write({'state': 'pending'})
@@ -847,48 +1064,59 @@ class ServiceQuote(models.Model):
             'tag': 'reload',
         }
 
-    def action_authorize(self):
-        """Autoriza la cotización (solo para autorizadores)"""
-        self.ensure_one()
+    def _ccn_check_authorizer(self):
+        authorizer_group = self.env.ref('ccn_service_quote.group_ccn_quote_authorizer', raise_if_not_found=False)
+        return bool(authorizer_group) and self.env.user in authorizer_group.users
+
+    def _ccn_state_action_result(self, message):
+        """Un solo registro (formulario): recarga. Varios (lista): una notificación."""
+        if len(self) == 1:
+            # Recargar la vista para reflejar el cambio de estado inmediatamente
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'reload',
+            }
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'message': message,
+                'type': 'success',
+                'sticky': False,
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
 
+    def action_authorize(self):
+        """Autoriza las cotizaciones (solo para autorizadores); admite selección múltiple."""
         # Verificar que el usuario sea autorizador
-        if not self.is_authorizer:
+        if not self._ccn_check_authorizer():
             raise UserError(_('No tiene permisos para autorizar cotizaciones.'))
 
-        if self.state != 'pending':
+        if any(rec.state != 'pending' for rec in self):
             raise UserError(_('Solo se pueden autorizar cotizaciones en estado Pendiente.'))
 
-        # Cambiar estado a autorizado
+        # Cambiar estado a autorizado (una sola escritura)
         self.write({'state': 'authorized'})
 
-        # Notificar al creador
+        # Notificar a los creadores (un resumen por creador)
         self._notify_authorization_complete()
 
-        # Recargar la vista para reflejar el cambio de estado inmediatamente
-        return {
-            'type': 'ir.actions.client',
-            'tag': 'reload',
-        }
+        return self._ccn_state_action_result(_('%s cotizaciones autorizadas.') % len(self))
 
     def action_reset_to_draft(self):
-        """Restablece la cotización a borrador (solo para autorizadores)"""
-        self.ensure_one()
-
+        """Restablece las cotizaciones a borrador (solo para autorizadores); admite selección múltiple."""
         # Verificar que el usuario sea autorizador
-        if not self.is_authorizer:
+        if not self._ccn_check_authorizer():
             raise UserError(_('No tiene permisos para restablecer cotizaciones.'))
 
-        if self.state != 'authorized':
+        if any(rec.state != 'authorized' for rec in self):
             raise UserError(_('Solo se pueden restablecer cotizaciones en estado Autorizado.'))
 
-        # Cambiar estado a borrador
+        # Cambiar estado a borrador (una sola escritura)
         self.write({'state': 'draft'})
 
-        # Recargar la vista para reflejar el cambio de estado inmediatamente
-        return {
-            'type': 'ir.actions.client',
-            'tag': 'reload',
-        }
+        return self._ccn_state_action_result(_('%s cotizaciones restablecidas a borrador.') % len(self))
 
     def _notify_authorizers(self):
         """Envía notificación a los usuarios autorizadores"""
@@ -921,24 +1149,45 @@ class ServiceQuote(models.Model):
         )
 
     def _notify_authorization_complete(self):
-        """Notifica al creador que la cotización fue autorizada"""
-        self.ensure_one()
+        """Notifica a cada creador sus cotizaciones autorizadas.
 
-        # Notificar al creador del registro
-        if self.create_uid:
-            message = Markup(_(
-                'La cotización <b>%(quote_name)s</b> para el cliente <b>%(partner_name)s</b> '
-                'ha sido autorizada.',
-                quote_name=self.name,
-                partner_name=self.partner_id.name,
-            ))
+        Una sola notificación por creador: el mensaje de la cotización si es
+        una, o un resumen con todas las suyas si son varias. El cambio de
+        estado ya queda en el chatter de cada cotización por el tracking.
+        """
+        by_creator = {}
+        for rec in self:
+            if rec.create_uid.partner_id:
+                by_creator.setdefault(rec.create_uid.partner_id, self.browse())
+                by_creator[rec.create_uid.partner_id] |= rec
+
+        for partner, quotes in by_creator.items():
+            if len(quotes) == 1:
+                message = Markup(_(
+                    'La cotización <b>%(quote_name)s</b> para el cliente <b>%(partner_name)s</b> '
+                    'ha sido autorizada.',
+                    quote_name=quotes.name,
+                    partner_name=quotes.partner_id.name,
+                ))
+                quotes.message_post(
+                    body=message,
+                    subject=_('Cotización autorizada'),
+                    message_type='notification',
+                    partner_ids=[partner.id],
+                    subtype_xmlid='mail.mt_comment',
+                )
+                continue
 
-            self.message_post(
+            items = Markup('').join(
+                Markup('<li><b>%s</b> — %s</li>') % (quote.name, quote.partner_id.name or '')
+                for quote in quotes
+            )
+            message = Markup(_('Se autorizaron %(count)s cotizaciones:', count=len(quotes))) + \
+                Markup('<ul>%s</ul>') % items
+            quotes[:1].message_notify(
                 body=message,
-                subject=_('Cotización autorizada'),
-                message_type='notification',
-                partner_ids=[self.create_uid.partner_id.id] if self.create_uid.partner_id else [],
-                subtype_xmlid='mail.mt_comment',
+                subject=_('Cotizaciones autorizadas'),
+                partner_ids=[partner.id],
             )
 
 
@@ -1000,11 +1249,8 @@ class CCNServiceQuoteLine(models.Model):
         string='Producto/Servicio',
         required=True,
         index=True,
-        # Evitamos 'in' con lista vacía; usamos OR de igualdades
-        domain="['&', ('product_tmpl_id.ccn_exclude_from_quote','=',False), "
-               "'&', ('product_tmpl_id.sale_ok','=', True), "
-               "'|', ('product_tmpl_id.ccn_rubro_ids.code','=', context.get('ctx_rubro_code')), "
-                     "('product_tmpl_id.ccn_rubro_ids.code','=', rubro_code)]",
+        # Índice rubro → productos (ya excluye no vendibles y excluidos del cotizador)
+        domain="[('ccn_allowed_rubro_ids', '=', rubro_id)]",
     )
 
     # Cantidad
@@ -1035,7 +1281,7 @@ class CCNServiceQuoteLine(models.Model):
     )
     price_unit_final = fields.Monetary(
         string='Precio Unitario',
-        compute='_compute_price_unit_final',
+        compute='_compute_prices',
         store=True,
     )
     taxes_display = fields.Char(
@@ -1043,16 +1289,11 @@ class CCNServiceQuoteLine(models.Model):
         compute='_compute_taxes_display',
         store=False,
     )
-    amount_tax = fields.Monetary(
-        string='IVA',
-        compute='_compute_amount_tax',
-        store=False,
-        currency_field='currency_id',
-    )
+    # amount_tax (impuestos de tax_ids) se define en quote_line_enhancements
     total_price = fields.Monetary(
         string='Total Mensual',
-        compute='_compute_total_price',
-        store=False,
+        compute='_compute_prices',
+        store=True,
     )
 
     # Frecuencia y subtotal mensual
@@ -1084,7 +1325,7 @@ class CCNServiceQuoteLine(models.Model):
 
     monthly_subtotal = fields.Monetary(
         string='Subtotal Mensual',
-        compute='_compute_monthly_subtotal',
+        compute='_compute_prices',
         store=True,
         currency_field='currency_id',
     )
@@ -1092,8 +1333,8 @@ class CCNServiceQuoteLine(models.Model):
     # Prestaciones (solo aplica a Mano de Obra; en otros rubros = 0)
     mo_prestaciones = fields.Monetary(
         string='Prestaciones',
-        compute='_compute_mo_prestaciones',
-        store=False,
+        compute='_compute_prices',
+        store=True,
         currency_field='currency_id',
     )
 
@@ -1103,108 +1344,93 @@ class CCNServiceQuoteLine(models.Model):
         for rec in self:
             rec.rubro_code = rec.rubro_id.code or False
 
-    @api.depends('product_id')
-    def _compute_product_base_price(self):
-        for line in self:
-            val = line.product_id.list_price if line.product_id else 0.0
-            if line.quote_id.currency_id:
-                val = line.quote_id.currency_id.round(val)
-            line.product_base_price = val
+    # ----- Motor de precios por lote -----
+    # Los cinco importes de la línea (precio base → precio unitario → subtotal
+    # mensual → prestaciones → total) se encadenan; en lugar de que cada compute
+    # recorra las líneas y lea quote_id.currency_id por su cuenta, se precargan
+    # moneda y porcentajes por cotización una sola vez y se calcula todo en una
+    # pasada. El redondeo es el mismo que currency.round() en cada paso.
+    # Todos los importes son almacenados para poder sumarlos con _read_group.
+    def _ccn_currency_roundings(self):
+        """{quote_id: rounding} de la moneda de cada cotización (None si no hay moneda)."""
+        return {
+            q.id: (q.currency_id.rounding if q.currency_id else None)
+            for q in self.quote_id
+        }
 
-    @api.depends('product_base_price', 'tabulator_percent')
-    def _compute_price_unit_final(self):
-        for line in self:
-            base = line.product_base_price or 0.0
-            tab = float(line.tabulator_percent or '0') / 100.0
-            val = base * (1.0 + tab)
-            if line.quote_id.currency_id:
-                val = line.quote_id.currency_id.round(val)
-            line.price_unit_final = val
+    def _ccn_price_values(self):
+        """Calcula en lote la cadena de importes a partir de product_base_price.
 
-    @api.depends('product_id')
-    def _compute_taxes_display(self):
-        tax_model = self.env.get('account.tax')
-        for line in self:
-            txt = ''
-            taxes = getattr(line.product_id, 'taxes_id', False)
-            if tax_model and taxes:
-                txt = ', '.join(taxes.mapped('name'))
-            line.taxes_display = txt
+        Devuelve {línea: {'price_unit_final', 'monthly_subtotal',
+        'mo_prestaciones', 'total_price'}}.
+        """
+        roundings = self._ccn_currency_roundings()
+        prest_pct = {q.id: (q.prestaciones_percent or 0.0) / 100.0 for q in self.quote_id}
 
-    @api.depends('price_unit_final', 'quantity', 'product_id')
-    def _compute_amount_tax(self):
-        for line in self:
-            total = (line.price_unit_final or 0.0) * (line.quantity or 0.0)
-            rate = 0.0
-            taxes = getattr(line.product_id, 'taxes_id', False)
-            if taxes:
-                rate = sum(t.amount for t in taxes if getattr(t, 'amount_type', 'percent') == 'percent') / 100.0
-            amt = total * rate
-            if line.quote_id.currency_id:
-                amt = line.quote_id.currency_id.round(amt)
-            line.amount_tax = amt
-
-    @api.depends('quantity', 'monthly_subtotal', 'quote_id.prestaciones_percent', 'rubro_code')
-    def _compute_total_price(self):
+        res = {}
         for line in self:
+            rounding = roundings.get(line.quote_id.id)
+
+            def _round(val):
+                return float_round(val, precision_rounding=rounding) if rounding else val
+
+            tab = float(line.tabulator_percent or '0') / 100.0
+            price_unit_final = _round((line.product_base_price or 0.0) * (1.0 + tab))
+            factor = FREQUENCY_FACTORS.get(line.frequency or 'monthly', 1.0)
+            monthly = _round(price_unit_final * factor)
+
+            qty = line.quantity or 0.0
             # Total Mensual:
             # - Mano de Obra: (Percepción Mensual + Prestaciones) x Cantidad
             # - Otros rubros: Subtotal Mensual x Cantidad
             if (line.rubro_code or '').strip() == 'mano_obra':
-                base = (line.monthly_subtotal or 0.0) + (line.mo_prestaciones or 0.0)
-                val = base * (line.quantity or 0.0)
+                prestaciones = _round(monthly * prest_pct.get(line.quote_id.id, 0.0))
+                total = _round((monthly + prestaciones) * qty)
             else:
-                val = (line.monthly_subtotal or 0.0) * (line.quantity or 0.0)
-            if line.quote_id.currency_id:
-                val = line.quote_id.currency_id.round(val)
-            line.total_price = val
+                prestaciones = _round(0.0)
+                total = _round(monthly * qty)
+
+            res[line] = {
+                'price_unit_final': price_unit_final,
+                'monthly_subtotal': monthly,
+                'mo_prestaciones': prestaciones,
+                'total_price': total,
+            }
+        return res
 
-    @api.depends('monthly_subtotal', 'quote_id.prestaciones_percent', 'rubro_code')
-    def _compute_mo_prestaciones(self):
+    @api.depends('product_id', 'quote_id.currency_id')
+    def _compute_product_base_price(self):
+        list_prices = {p.id: p.list_price for p in self.product_id}
+        roundings = self._ccn_currency_roundings()
         for line in self:
-            if (line.rubro_code or '').strip() == 'mano_obra':
-                perc = (getattr(line.quote_id, 'prestaciones_percent', 0.0) or 0.0) / 100.0
-                val = (line.monthly_subtotal or 0.0) * perc
-            else:
-                val = 0.0
-            if line.quote_id.currency_id:
-                val = line.quote_id.currency_id.round(val)
-            line.mo_prestaciones = val
+            val = list_prices.get(line.product_id.id, 0.0)
+            rounding = roundings.get(line.quote_id.id)
+            if rounding:
+                val = float_round(val, precision_rounding=rounding)
+            line.product_base_price = val
 
-    @api.depends('price_unit_final', 'frequency')
-    def _compute_monthly_subtotal(self):
+    @api.depends('product_base_price', 'tabulator_percent', 'frequency', 'quantity',
+                 'quote_id.prestaciones_percent', 'quote_id.currency_id', 'rubro_code')
+    def _compute_prices(self):
+        """Precio unitario, subtotal mensual, prestaciones y total (almacenados)."""
+        values = self._ccn_price_values()
         for line in self:
+            vals = values[line]
+            line.price_unit_final = vals['price_unit_final']
             # Subtotal mensual unitario (no multiplicado por cantidad)
-            unit_total = (line.price_unit_final or 0.0)
-            f = (line.frequency or 'monthly')
-            # Factores a mes equivalente
-            if f == 'weekly':
-                factor = 30.42 / 7.0
-            elif f == 'fortnight_14':
-                factor = 30.42 / 14.0
-            elif f == 'biweekly':
-                factor = 2.0
-            elif f == 'monthly':
-                factor = 1.0
-            elif f == 'bimonthly':
-                factor = 1.0 / 2.0
-            elif f == 'quarterly':
-                factor = 1.0 / 3.0
-            elif f == 'semiannual':
-                factor = 1.0 / 6.0
-            elif f == 'annual':
-                factor = 1.0 / 12.0
-            elif f == '18m':
-                factor = 1.0 / 18.0
-            elif f == '24m':
-                factor = 1.0 / 24.0
-            else:
-                factor = 1.0
+            line.monthly_subtotal = vals['monthly_subtotal']
+            line.mo_prestaciones = vals['mo_prestaciones']
+            line.total_price = vals['total_price']
 
-            val = unit_total * factor
-            if line.quote_id.currency_id:
-                val = line.quote_id.currency_id.round(val)
-            line.monthly_subtotal = val
+    @api.depends('product_id')
+    def _compute_taxes_display(self):
+        tax_model = self.env.get('account.tax')
+        for line in self:
+            txt = ''
+            taxes = getattr(line.product_id, 'taxes_id', False)
+            if tax_model and taxes:
+                txt = ', '.join(taxes.mapped('name'))
+            line.taxes_display = txt
 
     # Asegurar opciones de frecuencia válidas por rubro
     @api.onchange('rubro_id', 'rubro_code', 'frequency')
@@ -1267,15 +1493,10 @@ class CCNServiceQuoteLine(models.Model):
     # Onchange para reforzar el dominio de producto por rubro
     @api.onchange('rubro_id')
     def _onchange_rubro_id(self):
-        code = self.rubro_id.code if self.rubro_id else False
+        # Índice rubro → productos permitidos (ccn.service.rubro.allowed_product_ids)
         return {
             'domain': {
-                'product_id': [
-                    ('product_tmpl_id.ccn_exclude_from_quote','=', False),
-                    '|',
-                        ('product_tmpl_id.ccn_rubro_ids.code','=', code),
-                        ('product_tmpl_id.ccn_rubro_ids.code','=', False),  # evita dominio inválido si no hay code
-                ]
+                'product_id': [('ccn_allowed_rubro_ids', '=', self.rubro_id.id)]
             }
         }
 
@@ -1302,15 +1523,18 @@ class CCNServiceQuoteLine(models.Model):
     @api.model_create_multi
     def create(self, vals_list):
         # Garantiza site_id siempre presente: si falta, usa/crea 'General' del quote
-        for vals in vals_list:
-            if not vals.get('site_id'):
-                qid = vals.get('quote_id') or (self.env.context or {}).get('default_quote_id')
-                if qid:
-                    try:
-                        vals['site_id'] = self.env['ccn.service.quote.site'].get_or_create_general(qid)
-                    except Exception:
-                        # permitir que el required dispare error si no logramos resolverlo
-                        pass
+        default_qid = (self.env.context or {}).get('default_quote_id')
+        missing = [vals for vals in vals_list
+                   if not vals.get('site_id') and (vals.get('quote_id') or default_qid)]
+        if missing:
+            try:
+                general_ids = self.env['ccn.service.quote.site']._ccn_general_site_ids(
+                    [vals.get('quote_id') or default_qid for vals in missing])
+                for vals in missing:
+                    vals['site_id'] = general_ids[vals.get('quote_id') or default_qid]
+            except Exception:
+                # permitir que el required dispare error si no logramos resolverlo
+                pass
         return super().create(vals_list)
 
     def write(self, vals):
@@ -1,6 +1,19 @@
 # -*- coding: utf-8 -*-
-from odoo import api, fields, models
+import logging
+
+import psycopg2
+
+from odoo import api, fields, models, _
 from odoo.exceptions import ValidationError
+from odoo.tools.sql import index_exists
+
+from .quote_cost_breakdown import compute_breakdown
+
+_logger = logging.getLogger(__name__)
+
+# Un solo sitio 'General' por cotización (índice único parcial)
+GENERAL_INDEX = 'ccn_service_quote_site_single_general_idx'
+
 
 class CCNServiceQuoteSite(models.Model):
     _name = "ccn.service.quote.site"
@@ -83,7 +96,7 @@ class CCNServiceQuoteSite(models.Model):
     # Cálculos de indicadores
     @api.depends(
         "line_ids.quantity",
-        "line_ids.product_id",
+        "line_ids.total_price",
         "line_ids.rubro_code",
         "quote_id.admin_percent",
         "quote_id.utility_percent",
@@ -92,41 +105,28 @@ class CCNServiceQuoteSite(models.Model):
         "quote_id.bienestar_rate",
     )
     def _compute_indicators(self):
+        # Misma fórmula que el Resumen del Sitio (quote_cost_breakdown). Todas las
+        # cotizaciones del lote salen de un solo _read_group por
+        # (cotización, sitio, servicio, rubro): editar un porcentaje recalcula
+        # cada sitio a partir del agregado, sin recorrer líneas ni list_price.
+        quotes = self.quote_id
+        site_buckets = quotes._ccn_site_buckets()
+        params = {quote.id: quote._ccn_breakdown_params() for quote in quotes}
         for site in self:
-            lines = site.line_ids
-            site.headcount = sum(l.quantity for l in lines if getattr(l, 'rubro_code', False) == "mano_obra")
-            base = 0.0
-            for l in lines:
-                qty = l.quantity or 0.0
-                prod_price = l.product_id.list_price if l.product_id else 0.0
-                tab = float(getattr(l, 'tabulator_percent', '0') or '0') / 100.0
-                pu = prod_price * (1.0 + tab)
-                base += qty * pu
-
-            admin_p = site.quote_id.admin_percent or 0.0
-            util_p = site.quote_id.utility_percent or 0.0
-            fin_p = site.quote_id.financial_percent or 0.0
-            trans_p = site.quote_id.transporte_rate or 0.0
-            bien_p = site.quote_id.bienestar_rate or 0.0
-
-            admin_amt = base * admin_p / 100.0
-            util_amt = (base + admin_amt) * util_p / 100.0
-            subtotal2 = base + admin_amt + util_amt
-
-            transporte_amt = subtotal2 * trans_p / 100.0
-            bienestar_amt = subtotal2 * bien_p / 100.0
-            financial_amt = subtotal2 * fin_p / 100.0
-
-            total = subtotal2 + transporte_amt + bienestar_amt + financial_amt
-
-            site.subtotal1 = base
-            site.admin_amt = admin_amt
-            site.util_amt = util_amt
-            site.subtotal2 = subtotal2
-            site.transporte_amt = transporte_amt
-            site.bienestar_amt = bienestar_amt
-            site.financial_amt = financial_amt
-            site.total_monthly = total
+            quote_id = site.quote_id.id
+            if quote_id in site_buckets:
+                b = compute_breakdown(site_buckets[quote_id].get(site.id, {}), **params[quote_id])
+            else:
+                b = compute_breakdown({})
+            site.headcount = b['colaboradores']
+            site.subtotal1 = b['subtotal_1']
+            site.admin_amt = b['administracion']
+            site.util_amt = b['utilidad']
+            site.subtotal2 = b['subtotal_2']
+            site.transporte_amt = b['transporte']
+            site.bienestar_amt = b['bienestar']
+            site.financial_amt = b['costo_financiero']
+            site.total_monthly = b['total_mensual_antes_iva']
 
     # Computados / Constraints
     @api.depends('name')
@@ -134,20 +134,74 @@ class CCNServiceQuoteSite(models.Model):
         for rec in self:
             rec.is_general = ((rec.name or '').strip().lower() == 'general')
 
+    def init(self):
+        self._ccn_ensure_general_index()
+
+    def _ccn_general_index_active(self):
+        """True si el índice único de 'General' existe (memorizado por cursor)."""
+        cache = self.env.cr.cache
+        if GENERAL_INDEX not in cache:
+            cache[GENERAL_INDEX] = index_exists(self.env.cr, GENERAL_INDEX)
+        return cache[GENERAL_INDEX]
+
     @api.constrains('name', 'quote_id')
     def _check_single_general_per_quote(self):
-        for rec in self:
-            if not rec.quote_id or not rec.name:
-                continue
-            if (rec.name or '').strip().lower() == 'general':
-                dup = self.search([
-                    ('id', '!=', rec.id),
-                    ('quote_id', '=', rec.quote_id.id),
-                    ('name', '=ilike', 'general'),
-                    ('active', 'in', [True, False]),
-                ], limit=1)
-                if dup:
-                    raise ValidationError("Solo puede existir un sitio llamado 'General' por cotización.")
+        # Respaldo mientras el índice no existe (base con duplicados sin normalizar)
+        if self._ccn_general_index_active():
+            return
+        quote_ids = self.filtered('is_general').quote_id.ids
+        if not quote_ids:
+            return
+        self.flush_model(['name', 'is_general', 'quote_id'])
+        self.env.cr.execute("""
+            SELECT quote_id FROM ccn_service_quote_site
+             WHERE is_general AND quote_id = ANY(%s)
+             GROUP BY quote_id HAVING COUNT(*) > 1
+             LIMIT 1
+        """, [quote_ids])
+        if self.env.cr.rowcount:
+            raise ValidationError(_("Solo puede existir un sitio llamado 'General' por cotización."))
+
+    def _ccn_flush_general(self):
+        """Escribe ya los sitios 'General' y traduce la violación del índice único."""
+        generals = self.filtered('is_general')
+        if not generals:
+            return
+        try:
+            with self.env.cr.savepoint(flush=False):
+                generals.flush_recordset(['name', 'is_general', 'quote_id'])
+        except psycopg2.errors.UniqueViolation as e:
+            if e.diag.constraint_name == GENERAL_INDEX:
+                raise ValidationError(_("Solo puede existir un sitio llamado 'General' por cotización.")) from None
+            raise
+
+    @api.model
+    def _ccn_ensure_general_index(self):
+        """Índice único parcial (quote_id) WHERE is_general.
+
+        Sustituye al constraint Python que buscaba duplicados en cada
+        create/write. Si la base aún tiene cotizaciones con más de un 'General'
+        no se crea: se avisa en el log, se reintenta tras _fix_general_sites y
+        mientras tanto _check_single_general_per_quote hace de respaldo.
+        """
+        cr = self.env.cr
+        if index_exists(cr, GENERAL_INDEX):
+            return True
+        cr.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT quote_id FROM ccn_service_quote_site
+                 WHERE is_general AND quote_id IS NOT NULL
+                 GROUP BY quote_id HAVING COUNT(*) > 1
+            ) AS dup
+        """)
+        duplicates = cr.fetchone()[0]
+        if duplicates:
+            _logger.warning("No se creó %s: %s cotizaciones tienen más de un sitio 'General'",
+                            GENERAL_INDEX, duplicates)
+            return False
+        cr.execute(f"CREATE UNIQUE INDEX {GENERAL_INDEX} ON ccn_service_quote_site (quote_id) WHERE is_general")
+        cr.cache.pop(GENERAL_INDEX, None)
+        return True
 
     # Creación / Escritura: normaliza y prioriza 'General'
     @api.model_create_multi
@@ -164,6 +218,7 @@ class CCNServiceQuoteSite(models.Model):
                 if 'sequence' not in vals or vals.get('sequence') is None:
                     vals['sequence'] = -999
         recs = super().create(vals_list)
+        recs._ccn_flush_general()
         # Si el contexto lo pide, fijar el sitio recién creado como "Sitio actual" de la cotización
         if (ctx.get('set_current_on_create') or ctx.get('set_current_site')) and ctx_qid:
             quote = self.env['ccn.service.quote'].browse(ctx_qid)
@@ -173,10 +228,7 @@ class CCNServiceQuoteSite(models.Model):
                 quote.with_context(ccn_syncing_current_site=True).write({'current_site_id': new_site.id})
                 # Si esta cotización sólo tenía el sitio "General" sin líneas, retirarlo para dejar un único sitio
                 try:
-                    general = self.with_context(active_test=False).search([
-                        ('quote_id', '=', quote.id),
-                        ('name', '=ilike', 'general'),
-                    ], limit=1)
+                    general = quote.general_site_id
                     if general and general.id != new_site.id:
                         if not general.line_ids:
                             general.unlink()
@@ -215,15 +267,17 @@ class CCNServiceQuoteSite(models.Model):
     def write(self, vals):
         vals = self._normalize_name_vals(dict(vals))
         res = super().write(vals)
+        if 'name' in vals or 'quote_id' in vals:
+            self._ccn_flush_general()
         if 'is_current' in vals and not self.env.context.get('ccn_syncing_current_site'):
             for rec in self:
                 q = rec.quote_id
                 if not q:
                     continue
                 if rec.is_current:
-                    # Encienden este → apaga otros y fija encabezado
-                    (q.site_ids - rec).with_context(ccn_syncing_current_site=True).write({'is_current': False})
+                    # Encienden este → fija encabezado (apaga solo el anterior)
                     q.with_context(ccn_syncing_current_site=True).write({'current_site_id': rec.id})
+                    q._ccn_sync_current_site_flags()
                 else:
                     # Intentan apagar el actual → mover a otro o restaurar
                     if q.current_site_id and q.current_site_id.id == rec.id:
@@ -241,10 +295,10 @@ class CCNServiceQuoteSite(models.Model):
             q = rec.quote_id
             if not q:
                 continue
-            # Fijar encabezado y sincronizar flags sin recursión
+            # Fijar encabezado y sincronizar flags sin recursión; si ya es el
+            # actual no se escribe nada y solo cambian los sitios que voltean
             q.with_context(ccn_syncing_current_site=True).write({'current_site_id': rec.id})
-            (q.site_ids - rec).with_context(ccn_syncing_current_site=True).write({'is_current': False})
-            rec.with_context(ccn_syncing_current_site=True).write({'is_current': True})
+            q._ccn_sync_current_site_flags()
         return True
 
     @api.onchange('is_current')
@@ -270,12 +324,10 @@ class CCNServiceQuoteSite(models.Model):
         args = args or []
         res = super().name_search(name=name, args=args, operator=operator, limit=limit)
 
-        generals = self.with_context(active_test=False).search(args + [('name', '=ilike', 'general')])
-        general_ids = generals.ids
-
-        if general_ids and res:
+        if res:
             ids_in_res = [r[0] for r in res]
-            generals_in_res = [gid for gid in general_ids if gid in ids_in_res]
+            # is_general es almacenado: sin búsqueda adicional
+            generals_in_res = self.browse(ids_in_res).filtered('is_general').ids
             if generals_in_res:
                 id2label = dict(res)
                 front = [(gid, id2label[gid]) for gid in generals_in_res]
@@ -291,17 +343,34 @@ class CCNServiceQuoteSite(models.Model):
     def get_or_create_general(self, quote_id):
         if not quote_id:
             return False
-        rec = self.search([
-            ('quote_id', '=', quote_id),
-            ('name', '=ilike', 'general'),
-        ], limit=1)
-        if rec:
-            if not rec.active or rec.sequence > -999:
-                rec.write({'active': True, 'sequence': -999})
-            return rec.id
-        return self.create({
-            'quote_id': quote_id,
-            'name': 'General',
-            'active': True,
-            'sequence': -999,
-        }).id
+        return self._ccn_general_site_ids([quote_id])[quote_id]
+
+    @api.model
+    def _ccn_general_site_ids(self, quote_ids):
+        """``{quote_id: id del sitio 'General'}``, reactivándolo o creándolo si falta.
+
+        Lee quote.general_site_id (almacenado) en lugar de buscar por nombre;
+        los que faltan se crean en un solo create().
+        """
+        quotes = self.env['ccn.service.quote'].browse(set(quote_ids))
+        res = {}
+        to_reactivate = self.browse()
+        to_create = []
+        for quote in quotes:
+            general = quote.general_site_id
+            if general:
+                if not general.active or general.sequence > -999:
+                    to_reactivate |= general
+                res[quote.id] = general.id
+            else:
+                to_create.append({
+                    'quote_id': quote.id,
+                    'name': 'General',
+                    'active': True,
+                    'sequence': -999,
+                })
+        if to_reactivate:
+            to_reactivate.write({'active': True, 'sequence': -999})
+        for site in self.create(to_create) if to_create else self.browse():
+            res[site.quote_id.id] = site.id
+        return res
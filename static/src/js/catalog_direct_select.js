@@ -316,10 +316,9 @@ registry.category("actions").add("ccn_catalog_direct_select", async (env, action
     notification?.add('No se pudo abrir Catálogo (falta contexto).', { type: 'warning' });
     return;
   }
+  // Índice rubro → productos (ya excluye no vendibles y excluidos del cotizador)
   const domain = [
-    ['product_tmpl_id.ccn_exclude_from_quote', '=', false],
-    ['product_tmpl_id.sale_ok', '=', true],
-    ['product_tmpl_id.ccn_rubro_ids.code', '=', rubro],
+    ['ccn_allowed_rubro_ids.code', '=', rubro],
   ];
   // sin notificaciones ni delays
   // Si no viene siteId en el contexto, resolver al 'General' del quote
@@ -97,6 +97,26 @@ function readStrFieldDOM(name){
     }catch(_e){ return ''; }
 }
 
+// Estados por sitio/servicio leídos del servidor (get_site_rubro_states):
+// cambiar de sitio o servicio solo lee las filas precalculadas, sin guardar
+// el registro. Se memoriza por contexto `${rid}|${sitio}|${servicio}|firma`.
+const __serverStates = {};
+const __serverPending = new Set();
+
+function fetchServerStates(controller, rid, siteId, service, cacheKey) {
+    if (__serverPending.has(cacheKey)) return;
+    __serverPending.add(cacheKey);
+    const kwargs = { site_id: siteId, service_type: service || false };
+    controller.model.orm.call('ccn.service.quote', 'get_site_rubro_states', [[rid]], kwargs)
+        .then((res) => {
+            __serverStates[cacheKey] = res || { states: {}, counts: {} };
+            publishStates(controller);
+            try { (window.__ccnTabsWatch && typeof window.__ccnTabsWatch.repaint === 'function') && window.__ccnTabsWatch.repaint(); } catch (_e) {}
+        })
+        .catch(() => {})
+        .finally(() => __serverPending.delete(cacheKey));
+}
+
 function publishStates(controller) {
     try {
         if (!controller?.model || controller.model.name !== "ccn.service.quote") return;
@@ -133,6 +153,24 @@ function publishStates(controller) {
             if (cnt != null) counts[code] = cnt;
         }
 
+        // Registro guardado sin cambios pendientes (salvo el sitio/servicio
+        // visto): los estados salen del servidor para el sitio en pantalla
+        const root = controller.model.root;
+        const dirtyFields = Object.keys(root?._changes || {}).filter(
+            (f) => f !== 'current_site_id' && f !== 'current_service_type' && f !== 'current_type'
+        );
+        if (Number.isInteger(rid) && currentSite && !dirtyFields.length) {
+            // La firma (write_date + contadores cargados) descarta lo memorizado tras guardar o recargar
+            const cacheKey = `${ctxStr}|${data.write_date || ''}|${JSON.stringify(counts)}`;
+            const cached = __serverStates[cacheKey];
+            if (cached) {
+                Object.assign(states, cached.states || {});
+                for (const code of CODES) counts[code] = (cached.counts || {})[code] || 0;
+            } else {
+                fetchServerStates(controller, rid, currentSite, currentService, cacheKey);
+            }
+        }
+
         try {
             const statesJson = JSON.stringify(states);
             const countsJson = JSON.stringify(counts);
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark reproducible de los contadores por rubro de la cotización.
+
+Compara, para cotizaciones de distinto tamaño, el cómputo actual de
+``rubro_count_*`` (una lectura de ccn.service.quote.rubro.state) contra el
+recorrido anterior (16 ``line_ids.filtered`` por cotización). Todo se crea
+dentro de un savepoint que se revierte al terminar. Uso desde ``odoo-bin shell``::
+
+    from odoo.addons.ccn_service_quote.tools.benchmark import benchmark_rubro_counts
+    benchmark_rubro_counts(env, sizes=(100, 1000, 10000))
+
+Cada fila del resultado trae el número de líneas, milisegundos y consultas SQL
+de cada variante, y el plan (EXPLAIN ANALYZE) de la lectura de estados. Lo
+esperado: tiempo y consultas del cómputo actual planos respecto a las líneas;
+los del recorrido anterior crecen linealmente.
+"""
+import logging
+import time
+
+from ..models.quote_rubro_counts import RUBRO_COUNT_FIELDS
+
+_logger = logging.getLogger(__name__)
+
+BENCH_SERVICE_TYPES = ('jardineria', 'limpieza')
+
+
+def _legacy_counts(quote):
+    """Cómputo anterior: un ``filtered`` sobre todas las líneas por cada contador."""
+    def count_for(code):
+        return len(quote.line_ids.filtered(lambda l:
+            (not quote.current_site_id or l.site_id.id == quote.current_site_id.id) and
+            (not quote.current_service_type or l.service_type == quote.current_service_type) and
+            ((l.rubro_code or l.rubro_id.code) == code)
+        ))
+    return {fname: count_for(code) for fname, code in RUBRO_COUNT_FIELDS}
+
+
+def _measure(env, func):
+    cr = env.cr
+    queries = cr.sql_log_count
+    start = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - start) * 1000.0, cr.sql_log_count - queries
+
+
+def _bench_quote(env, size):
+    """Crea una cotización con ``size`` líneas repartidas en rubros y servicios."""
+    rubros = env['ccn.service.rubro'].search([('code', '!=', False)])
+    template = env['product.template'].create({
+        'name': 'CCN benchmark',
+        'list_price': 100.0,
+        'sale_ok': True,
+        'ccn_rubro_ids': [(6, 0, rubros.ids)],
+    })
+    product = template.product_variant_id
+    partner = env['res.partner'].create({'name': 'CCN benchmark'})
+    quote = env['ccn.service.quote'].create({'partner_id': partner.id, 'name': f'Benchmark {size}'})
+    site = env['ccn.service.quote.site'].browse(env['ccn.service.quote.site'].get_or_create_general(quote.id))
+    env['ccn.service.quote.line'].create([{
+        'quote_id': quote.id,
+        'site_id': site.id,
+        'service_type': BENCH_SERVICE_TYPES[i % len(BENCH_SERVICE_TYPES)],
+        'rubro_id': rubros[i % len(rubros)].id,
+        'product_id': product.id,
+        'quantity': 1.0,
+    } for i in range(size)])
+    quote.write({'current_site_id': site.id, 'current_service_type': BENCH_SERVICE_TYPES[0]})
+    env.flush_all()
+    return quote
+
+
+def benchmark_rubro_counts(env, sizes=(100, 1000, 10000), repeat=3):
+    """Mide ambos cómputos por tamaño de cotización; devuelve una lista de dicts."""
+    results = []
+    fnames = [fname for fname, _code in RUBRO_COUNT_FIELDS]
+    for size in sizes:
+        with env.cr.savepoint(flush=False) as savepoint:
+            quote = _bench_quote(env, size)
+            best_new = best_old = None
+            for _i in range(repeat):
+                env.invalidate_all()
+                new, new_ms, new_queries = _measure(env, lambda: {f: quote[f] for f in fnames})
+                # Misma condición de partida para el recorrido: líneas en caché
+                env.invalidate_all()
+                quote.line_ids.mapped('rubro_code')
+                old, old_ms, old_queries = _measure(env, lambda: _legacy_counts(quote))
+                if new != old:
+                    _logger.warning("[CCN] Benchmark %s líneas: los contadores difieren %s / %s", size, new, old)
+                if best_new is None or new_ms < best_new[0]:
+                    best_new = (new_ms, new_queries)
+                if best_old is None or old_ms < best_old[0]:
+                    best_old = (old_ms, old_queries)
+            env.cr.execute("""
+                EXPLAIN ANALYZE
+                SELECT quote_id, site_id, service_type, rubro_code, line_count, is_ack
+                  FROM ccn_service_quote_rubro_state
+                 WHERE quote_id = ANY(%s) AND (line_count > 0 OR is_ack)
+            """, [quote.ids])
+            plan = '\n'.join(row[0] for row in env.cr.fetchall())
+            savepoint.rollback()
+        env.invalidate_all()
+        row = {
+            'lines': size,
+            'state_ms': round(best_new[0], 2),
+            'state_queries': best_new[1],
+            'legacy_ms': round(best_old[0], 2),
+            'legacy_queries': best_old[1],
+            'plan': plan,
+        }
+        _logger.info("[CCN] Benchmark contadores: %(lines)s líneas → estados %(state_ms)s ms / "
+                     "%(state_queries)s consultas; recorrido %(legacy_ms)s ms / %(legacy_queries)s consultas", row)
+        results.append(row)
+    return results
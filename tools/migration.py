@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Utilidades para migraciones de datos del módulo en bases grandes.
+
+Las correcciones se ejecutan por rangos de id (``id >= lo AND id < hi``) en
+lugar de un UPDATE sobre toda la tabla: cada lote toca un número acotado de
+filas y el avance se registra en el logger del módulo con conteos y tiempos.
+
+Uso desde un script de migración::
+
+    from odoo.addons.ccn_service_quote.tools.migration import batched_update
+
+    def migrate(cr, version):
+        batched_update(
+            cr, 'ccn_service_quote_line',
+            set_sql="service_type = %(srv)s",
+            where_sql="t.rubro_code = %(code)s AND t.service_type IS DISTINCT FROM %(srv)s",
+            params={'srv': 'jardineria', 'code': 'maquinaria_jardineria'},
+            label="service_type maquinaria_jardineria",
+        )
+
+``commit=True`` (commit entre lotes) es solo para scripts independientes,
+p. ej. desde ``odoo-bin shell``, y con correcciones idempotentes. Dentro de una
+migración de módulo NO debe usarse: ``cr.commit()`` confirmaría toda la
+actualización en curso (cambios de esquema y datos de otros módulos), y si la
+actualización falla después la base queda a medio actualizar.
+"""
+import logging
+import time
+
+_logger = logging.getLogger('odoo.addons.ccn_service_quote.migration')
+
+BATCH_SIZE = 50000
+
+
+def id_ranges(cr, table, batch_size=BATCH_SIZE):
+    """Rangos ``(lo, hi)`` semiabiertos que cubren los ids actuales de ``table``."""
+    cr.execute(f'SELECT MIN(id), MAX(id) FROM "{table}"')
+    low, high = cr.fetchone()
+    if low is None:
+        return
+    for lo in range(low, high + 1, batch_size):
+        yield lo, lo + batch_size
+
+
+def batched_update(cr, table, set_sql, where_sql='TRUE', params=None, from_sql='',
+                   batch_size=BATCH_SIZE, commit=False, label=None):
+    """UPDATE por lotes de id sobre ``table`` (alias ``t``); devuelve las filas actualizadas.
+
+    ``set_sql``, ``where_sql`` y ``from_sql`` son fragmentos SQL con
+    parámetros nombrados (``%(nombre)s``) tomados de ``params``; ``from_sql``
+    permite unir otras tablas (p. ej. ``"ccn_service_rubro r"``). ``commit``
+    solo en scripts independientes, nunca en migraciones (ver el módulo).
+    """
+    label = label or table
+    query = f"""
+        UPDATE "{table}" t SET {set_sql}
+          {'FROM ' + from_sql if from_sql else ''}
+         WHERE t.id >= %(_lo)s AND t.id < %(_hi)s
+           AND ({where_sql})
+    """
+    total = 0
+    start = time.monotonic()
+    for lo, hi in id_ranges(cr, table, batch_size):
+        cr.execute(query, dict(params or {}, _lo=lo, _hi=hi))
+        total += cr.rowcount
+        if cr.rowcount:
+            _logger.info("%s: %s filas en ids [%s, %s)", label, cr.rowcount, lo, hi)
+        if commit:
+            cr.commit()
+    _logger.info("%s: %s filas actualizadas en %.2fs", label, total, time.monotonic() - start)
+    return total
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
+from markupsafe import Markup
+
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
+from odoo.tools.misc import formatLang
 
 class CCNServiceQuotePickWizard(models.TransientModel):
     _name = "ccn.service.quote.pick.wizard"
@@ -28,6 +31,23 @@ class CCNServiceQuotePickWizard(models.TransientModel):
     readonly=True,
     )
 
+    # Modo con el que se arma la vista previa; por defecto el de la cotización
+    preview_mode = fields.Selection(
+        selection=lambda self: self.env['ccn.service.quote']._fields['display_mode'].selection,
+        string="Modo de vista previa",
+        compute="_compute_preview_mode",
+        store=True,
+        readonly=False,
+        help="Permite comparar las partidas de cada modo de presentación antes de importar. "
+             "La importación usa el modo de presentación de la cotización.",
+    )
+
+    # Vista previa (dry-run): partidas que se agregarían, sin crear nada
+    preview_html = fields.Html(
+        string="Vista previa",
+        compute="_compute_preview_html",
+        sanitize=False,
+    )
 
     @api.model
     def default_get(self, fields_list):
@@ -37,6 +57,46 @@ class CCNServiceQuotePickWizard(models.TransientModel):
             res["order_id"] = ctx["active_id"]
         return res
 
+    @api.depends('quote_id')
+    def _compute_preview_mode(self):
+        for wiz in self:
+            wiz.preview_mode = wiz.quote_id.display_mode or False
+
+    @api.depends('quote_id', 'order_id', 'preview_mode')
+    def _compute_preview_html(self):
+        for wiz in self:
+            if not wiz.quote_id or not wiz.order_id:
+                wiz.preview_html = False
+                continue
+            try:
+                plan = wiz.order_id.ccn_preview_import(wiz.quote_id, mode=wiz.preview_mode)
+            except UserError as e:
+                wiz.preview_html = Markup('<div class="alert alert-warning mb-0">%s</div>') % e.args[0]
+                continue
+            currency = wiz.order_id.currency_id
+            rows = []
+            for item in plan:
+                if item['display_type']:
+                    rows.append(Markup('<tr class="fw-bold table-light"><td colspan="3">%s</td></tr>') % item['name'])
+                else:
+                    rows.append(Markup('<tr><td>%s</td><td class="text-end">%s</td><td class="text-end">%s</td></tr>') % (
+                        item['name'],
+                        formatLang(self.env, item['product_uom_qty']),
+                        formatLang(self.env, item['price_unit'], currency_obj=currency),
+                    ))
+            total = sum(item['price_unit'] * item['product_uom_qty'] for item in plan if not item['display_type'])
+            wiz.preview_html = Markup(
+                '<table class="table table-sm o_ccn_import_preview">'
+                '<thead><tr><th>%s</th><th class="text-end">%s</th><th class="text-end">%s</th></tr></thead>'
+                '<tbody>%s</tbody>'
+                '<tfoot><tr class="fw-bold"><td colspan="2">%s</td><td class="text-end">%s</td></tr></tfoot>'
+                '</table>'
+            ) % (
+                _("Partida"), _("Cantidad"), _("Precio"),
+                Markup('').join(rows),
+                _("Total"), formatLang(self.env, total, currency_obj=currency),
+            )
+
     def action_apply(self):
         self.ensure_one()
         if not self.order_id:
@@ -60,6 +120,10 @@ class CCNServiceQuotePickWizard(models.TransientModel):
                 "La cotización es del cliente '%s' y la SO es del cliente '%s'."
             ) % (q_partner.display_name, so_partner.display_name))
 
-        # Llama a tu importador
-        self.order_id.ccn_import_from_quote(self.quote_id)
+        # Misma cotización ya importada → re-sincronización incremental
+        if self.order_id.ccn_quote_id == self.quote_id and self.order_id._ccn_quote_sync_lines(self.quote_id):
+            self.order_id.ccn_sync_from_quote(self.quote_id)
+        else:
+            # Llama a tu importador
+            self.order_id.ccn_import_from_quote(self.quote_id)
         return {"type": "ir.actions.act_window_close"}
@@ -22,7 +22,7 @@ class GeneralSummaryWizard(models.TransientModel):
     def _compute_summary_table_html(self):
         """
         Genera la tabla HTML del resumen general con columnas dinámicas por sitio.
-        Usa la misma lógica de cálculo que _compute_indicators_sitio().
+        Usa el motor de desglose compartido con _compute_indicators_sitio().
         """
         for rec in self:
             if not rec.quote_id:
@@ -43,96 +43,13 @@ class GeneralSummaryWizard(models.TransientModel):
             # Símbolo de moneda
             currency_symbol = rec.currency_id.symbol or '$'
 
-            # Porcentajes configurables
+            # Porcentajes configurables (solo para las etiquetas)
             admin_pct = quote.admin_percent or 0.0
             utilidad_pct = quote.utility_percent or 0.0
             costo_financiero_pct = quote.financial_percent or 0.0
-            tarifa_transporte = quote.transporte_rate or 0.0
-            tarifa_bienestar = quote.bienestar_rate or 0.0
 
-            # Calcular valores por sitio
-            site_data = {}
-            for site in sites:
-                lines = quote.line_ids.filtered(lambda l: l.site_id == site)
-                mo_lines = lines.filtered(lambda l: l.rubro_code == 'mano_obra')
-                total_colaboradores = int(sum(mo_lines.mapped('quantity')))
-
-                # Helper para sumar por rubro
-                def sum_by_rubro(rubro_code):
-                    return sum(lines.filtered(lambda l: l.rubro_code == rubro_code).mapped('total_price'))
-
-                # Calcular rubros individuales
-                mano_obra = sum_by_rubro('mano_obra')
-                uniformes = sum_by_rubro('uniforme')
-                epp = sum_by_rubro('epp')
-                epp_alturas = sum_by_rubro('epp_alturas')
-                equipo_especial = sum_by_rubro('equipo_especial_limpieza')
-                comunicacion = sum_by_rubro('comunicacion_computo')
-                herramienta = sum_by_rubro('herramienta_menor_jardineria')
-                material_limpieza = sum_by_rubro('material_limpieza')
-                perfil_medico = sum_by_rubro('perfil_medico')
-                maquinaria_limpieza = sum_by_rubro('maquinaria_limpieza')
-                maquinaria_jardineria = sum_by_rubro('maquinaria_jardineria')
-                fertilizantes = sum_by_rubro('fertilizantes_tierra_lama')
-                consumibles = sum_by_rubro('consumibles_jardineria')
-                capacitacion = sum_by_rubro('capacitacion')
-
-                # SUBTOTAL 1
-                subtotal_1 = (mano_obra + uniformes + epp + epp_alturas + equipo_especial +
-                             comunicacion + herramienta + material_limpieza)
-
-                # Administración y Utilidad
-                administracion = subtotal_1 * (admin_pct / 100.0)
-                utilidad = subtotal_1 * (utilidad_pct / 100.0)
-
-                # SUBTOTAL 2
-                subtotal_2 = subtotal_1 + administracion + utilidad
-
-                # Transporte y Bienestar
-                transporte = tarifa_transporte * total_colaboradores
-                bienestar = tarifa_bienestar * total_colaboradores
-
-                # Costo Financiero
-                base_costo_financiero = (subtotal_1 + perfil_medico + maquinaria_limpieza +
-                                        fertilizantes + consumibles + transporte + capacitacion)
-                costo_financiero = base_costo_financiero * (costo_financiero_pct / 100.0)
-
-                # TOTAL MENSUAL ANTES DE IVA
-                total_mensual_antes_iva = (subtotal_2 + perfil_medico + maquinaria_limpieza +
-                                          maquinaria_jardineria + fertilizantes + consumibles +
-                                          transporte + bienestar + capacitacion + costo_financiero)
-
-                # IVA y TOTAL CON IVA
-                iva = total_mensual_antes_iva * 0.16
-                total_mensual_con_iva = total_mensual_antes_iva + iva
-
-                # Guardar datos del sitio
-                site_data[site.id] = {
-                    'mano_obra': mano_obra,
-                    'uniformes': uniformes,
-                    'epp': epp,
-                    'epp_alturas': epp_alturas,
-                    'equipo_especial': equipo_especial,
-                    'comunicacion': comunicacion,
-                    'herramienta': herramienta,
-                    'material_limpieza': material_limpieza,
-                    'subtotal_1': subtotal_1,
-                    'administracion': administracion,
-                    'utilidad': utilidad,
-                    'subtotal_2': subtotal_2,
-                    'perfil_medico': perfil_medico,
-                    'maquinaria_limpieza': maquinaria_limpieza,
-                    'maquinaria_jardineria': maquinaria_jardineria,
-                    'fertilizantes': fertilizantes,
-                    'consumibles': consumibles,
-                    'transporte': transporte,
-                    'bienestar': bienestar,
-                    'capacitacion': capacitacion,
-                    'costo_financiero': costo_financiero,
-                    'total_mensual_antes_iva': total_mensual_antes_iva,
-                    'iva': iva,
-                    'total_mensual_con_iva': total_mensual_con_iva,
-                }
+            # Desglose por sitio con el motor compartido (mismo cálculo que los indicadores)
+            site_data = quote._ccn_cost_breakdown(site_ids=sites.ids)[quote.id]
 
             # Generar HTML
             html = ['<table class="table table-sm table-bordered table-hover" style="width: 100%;">']